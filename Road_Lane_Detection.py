@@ -1,119 +1,1018 @@
-import cv2
-import numpy as np
-
-def process_image(image):
-    # Resize for consistency (optional)
-    image = cv2.resize(image, (640, 480))
-    
-    # Brightness normalization (helps in varying light)
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    cl = clahe.apply(l)
-    limg = cv2.merge((cl, a, b))
-    image = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
-    
-    # Improved color masking (BGR space for better yellow detection)
-    white_mask = cv2.inRange(image, np.array([200, 200, 200]), np.array([255, 255, 255]))
-    yellow_mask = cv2.inRange(image, np.array([0, 100, 100]), np.array([80, 255, 255]))
-    combined_mask = cv2.bitwise_or(white_mask, yellow_mask)
-    masked = cv2.bitwise_and(image, image, mask=combined_mask)
-    
-    # Edge detection with adaptive thresholds
-    gray = cv2.cvtColor(masked, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (7, 7), 0)
-    
-    # Auto Canny thresholds using median
-    v = np.median(blur)
-    lower = int(max(0, 0.7 * v))
-    upper = int(min(255, 1.3 * v))
-    edges = cv2.Canny(blur, lower, upper)
-    
-    # Dynamic ROI (works better for hills/curves)
-    height, width = edges.shape
-    roi_vertices = np.array([[
-        (width * 0.1, height),
-        (width * 0.4, height * 0.65),
-        (width * 0.6, height * 0.65),
-        (width * 0.9, height)
-    ]], dtype=np.int32)
-    
-    # ROI masking
-    mask = np.zeros_like(edges)
-    cv2.fillPoly(mask, roi_vertices, 255)
-    roi_edges = cv2.bitwise_and(edges, mask)
-    
-    # Probabilistic Hough with better parameters
-    lines = cv2.HoughLinesP(roi_edges, 
-                           rho=1, 
-                           theta=np.pi/180, 
-                           threshold=30,
-                           minLineLength=50,
-                           maxLineGap=30)
-    
-    # Line filtering and averaging
-    left_fit = []
-    right_fit = []
-    
-    if lines is not None:
-        for line in lines:
-            x1, y1, x2, y2 = line.reshape(4)
-            if x1 == x2:
-                continue
-            
-            # Calculate polynomial fit (degree 1 for straight lines)
-            fit = np.polyfit((x1, x2), (y1, y2), 1)
-            slope, intercept = fit[0], fit[1]
-            
-            # Filter based on slope and position
-            if abs(slope) < 0.4:
-                continue
-            
-            # Classify left/right using x-position at bottom
-            x_bottom = (height - intercept) / slope if slope !=0 else 0
-            if slope < 0 and x_bottom < width/2:
-                left_fit.append((slope, intercept))
-            elif slope > 0 and x_bottom > width/2:
-                right_fit.append((slope, intercept))
-    
-    # Create averaged lines
-    line_image = np.zeros_like(image)
-    
-    if left_fit:
-        left_avg = np.mean(left_fit, axis=0)
-        left_points = make_coordinates(image, left_avg)
-        cv2.line(line_image, left_points[0], left_points[1], (0,255,0), 8)
-    
-    if right_fit:
-        right_avg = np.mean(right_fit, axis=0)
-        right_points = make_coordinates(image, right_avg)
-        cv2.line(line_image, right_points[0], right_points[1], (0,255,0), 8)
-    
-    # Blend with original
-    return cv2.addWeighted(image, 0.8, line_image, 1, 1)
-
-def make_coordinates(image, line_params):
-    slope, intercept = line_params
-    y1 = image.shape[0]  # Bottom of image
-    y2 = int(y1 * 0.65)  # Match ROI height
-    x1 = int((y1 - intercept) / slope) if slope != 0 else 0
-    x2 = int((y2 - intercept) / slope) if slope != 0 else 0
-    return ((x1, y1), (x2, y2))
-
-# Debugging: Uncomment to see intermediate steps
-def debug_steps(image):
-    cv2.imshow("Original", image)
-    cv2.imshow("CLAHE Enhanced", process_image(image))
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-
-if __name__ == "__main__":
-    image = cv2.imread("test_image.jpg")  # Replace with your image path
-    if image is None:
-        print("Error loading image!")
-    else:
-        result = process_image(image)
-        cv2.imshow("Lane Detection", result)
-        # debug_steps(image)  # Uncomment to debug
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
\ No newline at end of file
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from lane_sinks import DisplaySink, ImageSequenceSink
+
+# Color thresholds (BGR space for better yellow detection)
+WHITE_LOWER = np.array([200, 200, 200], dtype=np.uint8)
+WHITE_UPPER = np.array([255, 255, 255], dtype=np.uint8)
+YELLOW_LOWER = np.array([0, 100, 100], dtype=np.uint8)
+YELLOW_UPPER = np.array([80, 255, 255], dtype=np.uint8)
+
+# Approximate equivalents on 8-bit LAB (L scaled to 0-255, a/b offset by 128):
+# white is bright and close to neutral, yellow has a strongly positive b
+LAB_WHITE_LOWER = np.array([207, 118, 118], dtype=np.uint8)
+LAB_WHITE_UPPER = np.array([255, 138, 138], dtype=np.uint8)
+LAB_YELLOW_LOWER = np.array([106, 0, 150], dtype=np.uint8)
+LAB_YELLOW_UPPER = np.array([255, 255, 255], dtype=np.uint8)
+
+PREPROCESS_MODES = ("bgr", "fused", "lab")
+
+# Top of the ROI (and of the drawn lanes) as a fraction of the frame height
+ROI_TOP = 0.65
+
+
+def roi_vertices(width, height):
+    # Dynamic ROI (works better for hills/curves)
+    return np.array([[
+        (width * 0.1, height),
+        (width * 0.4, height * ROI_TOP),
+        (width * 0.6, height * ROI_TOP),
+        (width * 0.9, height)
+    ]], dtype=np.int32)
+
+
+def classify_lines(lines, width, height, min_slope=0.4):
+    # Classify all Hough segments at once into left and right (slope, intercept) arrays
+    if lines is None:
+        return np.empty((0, 2)), np.empty((0, 2))
+    x1, y1, x2, y2 = lines.reshape(-1, 4).astype(np.float64).T
+    vertical = x1 == x2
+    if vertical.any():
+        keep = ~vertical
+        x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+
+    # Degree 1 fit through both end points (what np.polyfit gives for two points)
+    slope = (y2 - y1) / (x2 - x1)
+    intercept = (y1 + y2) / 2 - slope * (x1 + x2) / 2
+    fits = np.stack((slope, intercept), axis=1)
+
+    # Filter based on slope, then classify left/right using x-position at bottom
+    steep = np.abs(slope) >= min_slope
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_bottom = (height - intercept) / slope
+    left = steep & (slope < 0) & (x_bottom < width / 2)
+    right = steep & (slope > 0) & (x_bottom > width / 2)
+
+    return fits[left], fits[right]
+
+
+@dataclass
+class LaneLine:
+    slope: float
+    intercept: float
+    endpoints: tuple   # ((x, bottom), (x, ROI top)) at the working resolution
+    segments: int      # Hough segments behind this line in the current frame
+    confidence: float
+
+
+@dataclass
+class LaneResult:
+    left: Optional[LaneLine]
+    right: Optional[LaneLine]
+    width: int         # working resolution the geometry refers to
+    height: int
+
+    @property
+    def confidence(self):
+        # Missing sides count as zero
+        sides = [line.confidence if line else 0.0 for line in (self.left, self.right)]
+        return sum(sides) / 2
+
+    def as_dict(self):
+        def line_dict(line):
+            if line is None:
+                return None
+            return {"slope": line.slope, "intercept": line.intercept,
+                    "endpoints": [list(point) for point in line.endpoints],
+                    "segments": line.segments, "confidence": line.confidence}
+        return {"left": line_dict(self.left), "right": line_dict(self.right),
+                "width": self.width, "height": self.height, "confidence": self.confidence}
+
+
+def line_confidence(fits, width, height):
+    # Grows with the number of agreeing segments and shrinks as their bottom
+    # x positions spread out (5% of the width costs a factor of e)
+    if not len(fits):
+        return 0.0
+    x_bottom = (height - fits[:, 1]) / fits[:, 0]
+    spread = x_bottom.std() / width
+    return float((1 - np.exp(-len(fits) / 3)) * np.exp(-spread / 0.05))
+
+
+def render_lanes(frame, result, blend=True, color=(0, 255, 0), thickness=8, top=ROI_TOP):
+    # Draws a LaneResult onto frame in place, touching only the rows below the
+    # ROI top instead of blending a whole line image. With blend=True only the
+    # line pixels get draw_lanes' blend, the rest of the frame is unchanged.
+    # Endpoints are scaled when frame is not at the result's working resolution.
+    height, width = frame.shape[:2]
+    sx, sy = width / result.width, height / result.height
+    top = max(0, int(height * top) - thickness)
+    band = frame[top:]
+    canvas = np.zeros_like(band) if blend else band
+    mask = np.zeros(band.shape[:2], dtype=np.uint8) if blend else None
+    for line in (result.left, result.right):
+        if line is None:
+            continue
+        (x1, y1), (x2, y2) = line.endpoints
+        p1, p2 = (int(x1 * sx), int(y1 * sy) - top), (int(x2 * sx), int(y2 * sy) - top)
+        cv2.line(canvas, p1, p2, color, thickness)
+        if blend:
+            cv2.line(mask, p1, p2, 255, thickness)
+    if blend:
+        np.copyto(band, blend_overlay(band, canvas), where=mask[:, :, None].astype(bool))
+    return frame
+
+
+def blend_overlay(image, overlay, out=None, weight=0.8):
+    # The detectors' look: the frame at weight with the overlay added on top.
+    # The result gets its own array unless out is given.
+    return cv2.addWeighted(image, weight, overlay, 1, 1, dst=out)
+
+
+def overlay_lanes(image, result, line_image, out=None, color=(0, 255, 0), thickness=8, weight=0.8, timer=None):
+    # Straight-lane drawing shared by the detectors' draw_lanes: the lines go
+    # into line_image (a reused buffer of image's shape, cleared here), which
+    # is then blended over the whole frame
+    timer = timer or NoTimer()
+    timer.start()
+    line_image.fill(0)
+    for line in (result.left, result.right):
+        if line is not None:
+            cv2.line(line_image, line.endpoints[0], line.endpoints[1], color, thickness)
+    timer.mark("drawing")
+    out = blend_overlay(image, line_image, out, weight)
+    timer.mark("blend")
+    return out
+
+
+class CannyThresholds:
+    # Auto Canny thresholds from the median of the blurred image.
+    #   method="histogram": median from a 256-bin histogram (same value as
+    #       np.median, without partitioning every pixel), "median": np.median
+    #   roi_only: statistics over the ROI pixels only
+    #   refresh: recompute every N frames and reuse the thresholds in between
+    #   low, high: the thresholds as factors of the median
+    def __init__(self, method="histogram", roi_only=False, refresh=1, low=0.7, high=1.3):
+        if method not in ("histogram", "median"):
+            raise ValueError(f"Unknown threshold method: {method}")
+        if refresh < 1:
+            raise ValueError(f"refresh must be at least 1, got {refresh}")
+        self.method = method
+        self.roi_only = roi_only
+        self.refresh = refresh
+        self.low = low
+        self.high = high
+        self._frames = 0
+        self._last = None
+
+    def median(self, blur, mask=None):
+        if self.method == "median":
+            return np.median(blur if mask is None else blur[mask > 0])
+        # The color mask leaves most pixels black, and a histogram of a nearly
+        # constant image is slow (every pixel hits one bin), so count zeros first
+        if mask is None:
+            total = blur.size
+            zeros = total - cv2.countNonZero(blur)
+        else:
+            total = cv2.countNonZero(mask)
+            zeros = total - cv2.countNonZero(cv2.bitwise_and(blur, mask))
+        if total == 0 or zeros > total // 2:
+            return 0.0
+
+        hist = cv2.calcHist([blur], [0], mask, [256], [0, 256]).ravel()
+        # Average the two middle order statistics, exactly like np.median
+        cumulative = np.cumsum(hist)
+        low = np.searchsorted(cumulative, (total - 1) // 2, side="right")
+        high = np.searchsorted(cumulative, total // 2, side="right")
+        return (low + high) / 2
+
+    def __call__(self, blur, roi_mask=None):
+        if self._last is None or self._frames % self.refresh == 0:
+            v = self.median(blur, roi_mask if self.roi_only else None)
+            lower = int(max(0, self.low * v))
+            upper = int(min(255, self.high * v))
+            self._last = lower, upper
+        self._frames += 1
+        return self._last
+
+
+class LaneTracker:
+    # Carries lane lines across video frames. Each side is an alpha-beta
+    # filter in (x at bottom, x at ROI top) space, which behaves better than
+    # averaging slopes: the position moves alpha of the way to each
+    # measurement and a velocity term (beta) follows the road's drift, so the
+    # smoothed lanes do not trail a moving road the way a plain exponential
+    # average does. Tracked sides are searched in a narrow band around the
+    # prediction; a side that misses max_misses frames in a row is lost and
+    # its half of the full ROI is searched again.
+    def __init__(self, alpha=0.5, band=40, max_misses=5, beta=0.3):
+        self.alpha = alpha
+        self.beta = beta
+        self.band = band
+        self.max_misses = max_misses
+        self.reset()
+
+    def reset(self):
+        self.lines = [None, None]  # left, right as np.array([x_bottom, x_top])
+        self.velocity = [None, None]  # change of lines per frame
+        self.misses = [0, 0]
+        self._mask = None
+
+    @property
+    def tracking(self):
+        return all(line is not None for line in self.lines)
+
+    def predicted(self, side):
+        # Where the side's line is expected in the next frame
+        line = self.lines[side]
+        return None if line is None else line + self.velocity[side]
+
+    def search_mask(self, roi_mask):
+        if all(line is None for line in self.lines):
+            return roi_mask
+        height, width = roi_mask.shape
+        if self._mask is None or self._mask.shape != roi_mask.shape:
+            self._mask = np.empty_like(roi_mask)
+        mask = self._mask
+        mask.fill(0)
+
+        y_top = int(height * ROI_TOP)
+        for side in range(2):
+            line = self.predicted(side)
+            if line is None:
+                # Lost side: its half of the static ROI
+                x0, x1 = (0, width // 2) if side == 0 else (width // 2, width)
+                mask[:, x0:x1] = 255
+            else:
+                x_bottom, x_top = line
+                band = np.array([[
+                    (x_bottom - self.band, height),
+                    (x_top - self.band, y_top),
+                    (x_top + self.band, y_top),
+                    (x_bottom + self.band, height)
+                ]], dtype=np.int32)
+                cv2.fillPoly(mask, band, 255)
+        return cv2.bitwise_and(mask, roi_mask, dst=mask)
+
+    def update(self, left_avg, right_avg, height):
+        # Feed this frame's averages, returns the smoothed (slope, intercept) per side
+        y_top = int(height * ROI_TOP)
+        smoothed = []
+        for side, fit in enumerate((left_avg, right_avg)):
+            prediction = self.predicted(side)
+            measured = None
+            if fit is not None:
+                slope, intercept = fit
+                measured = np.array([(height - intercept) / slope, (y_top - intercept) / slope])
+                # Reject jumps far outside the search band as outliers
+                if prediction is not None and np.abs(measured - prediction).max() > 2 * self.band:
+                    measured = None
+
+            line, velocity = prediction, self.velocity[side]
+            if measured is not None:
+                self.misses[side] = 0
+                if line is None:
+                    line, velocity = measured, np.zeros(2)
+                else:
+                    residual = measured - prediction
+                    line = prediction + self.alpha * residual
+                    velocity = velocity + self.beta * residual
+            elif line is not None:
+                # Coast along the prediction until the side is lost
+                self.misses[side] += 1
+                if self.misses[side] > self.max_misses:
+                    line = velocity = None
+            self.lines[side], self.velocity[side] = line, velocity
+
+            if line is None:
+                smoothed.append(None)
+            else:
+                x_bottom, x_top = line
+                if x_bottom == x_top:
+                    smoothed.append(None)
+                    continue
+                slope = (height - y_top) / (x_bottom - x_top)
+                smoothed.append(np.array([slope, height - slope * x_bottom]))
+        return smoothed[0], smoothed[1]
+
+
+class _FrameBuffers:
+    # Everything that only depends on the working resolution and the window
+    # the per-pixel stages cover, built once. With crop=True the window is the
+    # ROI's bounding box (plus a few pixels of context for the blur and Sobel
+    # kernels); window=(x0, x1, y0, y1) gives it explicitly, and base (the
+    # buffers of the same resolution) lends its full-frame arrays, so a
+    # window only adds window-sized ones.
+    def __init__(self, height, width, crop=False, bands=1, window=None, base=None):
+        if base is None:
+            self.vertices = roi_vertices(width, height)
+            self.roi_mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.fillPoly(self.roi_mask, self.vertices, 255)
+        else:
+            self.vertices, self.roi_mask = base.vertices, base.roi_mask
+
+        if window is not None:
+            x0, x1, y0, y1 = window
+        elif crop:
+            margin = 4
+            xs, ys = self.vertices[0, :, 0], self.vertices[0, :, 1]
+            x0, x1 = max(0, xs.min() - margin), min(width, xs.max() + 1 + margin)
+            y0, y1 = max(0, ys.min() - margin), height
+        else:
+            x0, x1, y0, y1 = 0, width, 0, height
+        self.cropped = (x0, x1, y0, y1) != (0, width, 0, height)
+        self.offset = np.array([x0, y0, x0, y0], dtype=np.int32)
+        self.window = (slice(y0, y1), slice(x0, x1))
+        self.window_mask = np.ascontiguousarray(self.roi_mask[self.window])
+
+        if base is None:
+            # Hough lengths and votes were tuned at 640 pixels wide, scale them with the frame
+            scale = width / 640
+            self.hough = {"threshold": max(8, round(30 * scale)),
+                          "minLineLength": max(10, round(50 * scale)),
+                          "maxLineGap": max(6, round(30 * scale))}
+            self.resized = np.empty((height, width, 3), dtype=np.uint8)
+            self.line_image = np.empty((height, width, 3), dtype=np.uint8)
+        else:
+            self.hough, self.resized, self.line_image = base.hough, base.resized, base.line_image
+
+        height, width = y1 - y0, x1 - x0
+        self.lab = np.empty((height, width, 3), dtype=np.uint8)
+        self.lightness = np.empty((height, width), dtype=np.uint8)
+        self.enhanced = np.empty((height, width, 3), dtype=np.uint8)
+        self.white_mask = np.empty((height, width), dtype=np.uint8)
+        self.yellow_mask = np.empty((height, width), dtype=np.uint8)
+        self.color_mask = np.empty((height, width), dtype=np.uint8)
+        self.masked = np.empty((height, width, 3), dtype=np.uint8)
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.blur = np.empty((height, width), dtype=np.uint8)
+        self.edges = np.empty((height, width), dtype=np.uint8)
+        self.roi_edges = np.empty((height, width), dtype=np.uint8)
+
+        if bands > 1:
+            # Row slices of the window per band; with CLAHE tiles, groups of
+            # whole tile rows (OpenCV pads to a multiple of the 8x8 grid, by a
+            # full extra tile row/column when only the other side is uneven)
+            if height % 8 or width % 8:
+                ext_height, ext_width = height + 8 - height % 8, width + 8 - width % 8
+            else:
+                ext_height, ext_width = height, width
+            tile = ext_height // 8
+            edges = np.linspace(0, 8, min(bands, 8) + 1).round().astype(int)
+            # On short windows the padding can leave the last groups without
+            # real rows; the group before them then reaches the bottom anyway
+            self.tile_groups = [(first, last) for first, last in zip(edges[:-1], edges[1:]) if first * tile < height]
+            self.bands = [slice(first * tile, min(last * tile, height)) for first, last in self.tile_groups]
+            self.clahe_ext = np.empty((ext_height, ext_width), dtype=np.uint8)
+            # One CLAHE per band (they keep internal buffers), context tiles included
+            self.band_clahe = [cv2.createCLAHE(clipLimit=2.0,
+                                               tileGridSize=(8, min(8, last + 1) - max(0, first - 1)))
+                               for first, last in self.tile_groups]
+            self.dx = np.empty((height, width), dtype=np.int16)
+            self.dy = np.empty((height, width), dtype=np.int16)
+
+
+class StageTimer:
+    # Collects per-stage wall times from LaneDetector. start() begins a frame,
+    # mark(name) charges the time since the previous mark to that stage.
+    def __init__(self):
+        self.samples = {}
+        self._last = None
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.samples.setdefault(stage, []).append(now - self._last)
+        self._last = now
+
+    def reset(self):
+        self.samples = {}
+
+
+class NoTimer:
+    # Stands in for a StageTimer when nothing is measured
+    def start(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+
+def _search_window(mask, window, margin=4, steps=16):
+    # Bounding box of the mask's pixels plus the kernels' context, snapped
+    # outwards to 1/steps of the frame (so a few windows' buffers serve a
+    # whole video) and kept inside window, the (rows, columns) slices of the
+    # full search
+    x, y, w, h = cv2.boundingRect(mask)
+    rows, cols = window
+    if not w:
+        return cols.start, cols.stop, rows.start, rows.stop
+    step_y, step_x = (max(16, -(-size // steps)) for size in mask.shape)
+    x0 = max(cols.start, (x - margin) // step_x * step_x)
+    x1 = min(cols.stop, -(-(x + w + margin) // step_x) * step_x)
+    y0 = max(rows.start, (y - margin) // step_y * step_y)
+    return x0, x1, y0, rows.stop
+
+
+def working_size(size, shape):
+    # (width, height) a frame of the given shape is processed at: size is a
+    # fixed (width, height), a width that keeps the frame's aspect ratio, or
+    # None for the native resolution
+    height, width = shape[:2]
+    if size is None:
+        return width, height
+    if isinstance(size, int):
+        return size, max(1, round(height * size / width))
+    return tuple(size)
+
+
+class LaneDetector:
+    # Reuses the CLAHE object, ROI mask and intermediate images across frames.
+    # Not thread safe: create one detector per thread. With a LaneTracker the
+    # frames must also arrive in order, and once it predicts lanes the pixel
+    # stages are cropped to the bounding box of its search bands, like
+    # crop_roi does with the ROI (lanes are then always drawn on the
+    # unenhanced frame).
+    #
+    # crop_roi=True runs CLAHE, color masking, blur and Canny on the ROI's
+    # bounding box only (about 3.5x fewer pixels at 640x480). CLAHE tiles and
+    # the Canny median then come from that box, so edges can differ slightly
+    # from the full-frame path, and lanes are drawn on the unenhanced frame.
+    #
+    # preprocess selects how the masked grayscale image is produced:
+    #   "bgr"   the original LAB round trip, BGR masks and a masked BGR image
+    #   "fused" same masks, but the gray image is taken from the enhanced BGR
+    #           and masked directly (identical output, two 3-channel passes less)
+    #   "lab"   no LAB->BGR conversion: masks on the CLAHE'd LAB image and the
+    #           CLAHE'd L as gray (approximate, lanes drawn on the unenhanced frame)
+    #
+    # size is passed to working_size(): (640, 480) stretches every frame to
+    # 4:3 like the original script, a plain width such as 640 keeps the aspect.
+    #
+    # bands > 1 splits the per-pixel stages into that many horizontal bands
+    # processed on a thread pool (OpenCV releases the GIL), for large native
+    # frames. Edges and lanes are identical to the unsplit path. CLAHE itself
+    # stays whole, since OpenCV already parallelizes it internally and banded
+    # CLAHE cannot be bit-exact; tile_clahe=True bands it anyway (whole tile
+    # rows with one tile of overlap), which is faster on many cores but moves
+    # a few L values by one level. The bands' threads are released by close()
+    # (or by using the detector as a context manager).
+    def __init__(self, size=(640, 480), tracker=None, crop_roi=False, thresholds=None, timer=None,
+                 preprocess="bgr", bands=1, tile_clahe=False):
+        if preprocess not in PREPROCESS_MODES:
+            raise ValueError(f"Unknown preprocess mode: {preprocess}")
+        self.bands = bands
+        self.tile_clahe = tile_clahe
+        self._pool = ThreadPoolExecutor(bands) if bands > 1 else None
+        self.size = size
+        self.preprocess = preprocess
+        self.tracker = tracker
+        self.crop_roi = crop_roi
+        self.thresholds = thresholds or CannyThresholds()
+        self.timer = timer or NoTimer()
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self._buffers = {}
+        self._last = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def buffers(self, height, width, window=None):
+        key = (height, width, window)
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            base = None
+            if window is not None:
+                base = self.buffers(height, width)
+                # Tracked windows move with the lanes; only the most recent are kept
+                tracked = [k for k in self._buffers if k[2] is not None]
+                if len(tracked) >= 3:
+                    del self._buffers[tracked[0]]
+            buffers = self._buffers[key] = _FrameBuffers(height, width, self.crop_roi, self.bands, window, base)
+        return buffers
+
+    def process(self, image, out=None):
+        image, result = self.find_lanes(image)
+        return self.draw_lanes(image, result, out)
+
+    def detect(self, image):
+        # Lane geometry only, nothing is drawn or blended
+        return self.find_lanes(image)[1]
+
+    def find_lanes(self, image):
+        # Returns the image to draw on and the frame's LaneResult
+        timer = self.timer
+        timer.start()
+
+        # Resize for consistency (optional)
+        width, height = working_size(self.size, image.shape)
+        buf = self.buffers(height, width)
+        if (height, width) != image.shape[:2]:
+            image = cv2.resize(image, (width, height), dst=buf.resized)
+        frame = image
+
+        # While tracking, the pixel stages only cover the search bands around
+        # the predicted lanes
+        search_mask = None
+        if self.tracker is not None:
+            search_mask = self.tracker.search_mask(buf.roi_mask)
+            if search_mask is not buf.roi_mask:
+                buf = self.buffers(height, width, _search_window(search_mask, buf.window))
+        self._last = buf, frame
+        timer.mark("resize")
+
+        if self.bands > 1:
+            image = self._banded_edges(image, buf)
+        else:
+            image = self._edges(image, buf)
+
+        # ROI masking (narrowed to the predicted lanes while tracking)
+        if search_mask is None:
+            search_mask = buf.window_mask
+        else:
+            search_mask = search_mask[buf.window]
+        cv2.bitwise_and(buf.edges, search_mask, dst=buf.roi_edges)
+        timer.mark("roi")
+
+        # Probabilistic Hough with better parameters
+        lines = cv2.HoughLinesP(buf.roi_edges,
+                               rho=1,
+                               theta=np.pi/180,
+                               **buf.hough)
+        timer.mark("hough")
+
+        # Map cropped segments back to frame coordinates
+        if lines is not None and buf.cropped:
+            lines += buf.offset
+
+        # Line filtering and averaging
+        left_fit, right_fit = classify_lines(lines, width, height)
+        left_avg = left_fit.mean(axis=0) if len(left_fit) else None
+        right_avg = right_fit.mean(axis=0) if len(right_fit) else None
+        if self.tracker is not None:
+            left_avg, right_avg = self.tracker.update(left_avg, right_avg, height)
+
+        sides = []
+        for avg, fits in ((left_avg, left_fit), (right_avg, right_fit)):
+            if avg is None:
+                sides.append(None)
+                continue
+            sides.append(LaneLine(float(avg[0]), float(avg[1]), make_coordinates(frame, avg),
+                                  len(fits), line_confidence(fits, width, height)))
+        result = LaneResult(sides[0], sides[1], width, height)
+        timer.mark("classification")
+        # The enhanced image only covers the whole frame without cropping
+        # (tracked frames are cropped to their search window)
+        enhanced = not self.crop_roi and self.tracker is None and self.preprocess != "lab"
+        return (image if enhanced else frame), result
+
+    def stage_images(self):
+        # Intermediate images of the last frame, straight from the reused
+        # buffers (valid until the next frame). With crop_roi the stage
+        # images only cover the ROI's bounding box, while tracking only the
+        # search window.
+        buf, frame = self._last
+        images = {"resized": frame}
+        if self.preprocess != "lab":
+            images["clahe"] = buf.enhanced
+        images.update(color_mask=buf.color_mask, gray=buf.gray, blur=buf.blur, canny=buf.edges,
+                      roi=buf.roi_edges)
+        return images
+
+    def _edges(self, image, buf):
+        # CLAHE, color masks, blur and Canny into buf.edges; returns the
+        # enhanced window (or the frame for "lab")
+
+        # Brightness normalization (helps in varying light), CLAHE on L only
+        cv2.cvtColor(image[buf.window], cv2.COLOR_BGR2LAB, dst=buf.lab)
+        cv2.extractChannel(buf.lab, 0, dst=buf.lightness)
+        self.clahe.apply(buf.lightness, dst=buf.lightness)
+        cv2.insertChannel(buf.lightness, buf.lab, 0)
+        if self.preprocess != "lab":
+            image = cv2.cvtColor(buf.lab, cv2.COLOR_LAB2BGR, dst=buf.enhanced)
+        self.timer.mark("clahe")
+
+        self._mask_rows(image, buf, slice(None))
+        self.timer.mark("color_mask")
+
+        # Edge detection with adaptive thresholds
+        cv2.GaussianBlur(buf.gray, (7, 7), 0, dst=buf.blur)
+        self.timer.mark("blur")
+
+        # Auto Canny thresholds using median
+        lower, upper = self.thresholds(buf.blur, buf.window_mask)
+        self.timer.mark("median")
+        cv2.Canny(buf.blur, lower, upper, edges=buf.edges)
+        self.timer.mark("canny")
+        return image
+
+    def _banded_edges(self, image, buf):
+        # Same stages as _edges, split into horizontal bands on the thread
+        # pool. Pointwise steps take a band's rows as they are; the blur reads
+        # 4 rows of context on each side and keeps one extra blurred row for
+        # the Sobel derivatives, so every band's rows come out exactly as in
+        # the whole image. Canny then runs once on the stitched derivatives
+        # (its own Sobel uses replicated borders, as here), which keeps its
+        # hysteresis global. CLAHE runs on the whole L channel unless
+        # tile_clahe is set, see __init__.
+        pool = self._pool
+        bands = buf.bands
+        window = image[buf.window]
+
+        def to_lab(rows):
+            cv2.cvtColor(window[rows], cv2.COLOR_BGR2LAB, dst=buf.lab[rows])
+            cv2.extractChannel(buf.lab[rows], 0, dst=buf.lightness[rows])
+        list(pool.map(to_lab, bands))
+        if self.tile_clahe:
+            self._banded_clahe(buf)
+        else:
+            self.clahe.apply(buf.lightness, dst=buf.lightness)
+
+        def enhance(rows):
+            cv2.insertChannel(buf.lightness[rows], buf.lab[rows], 0)
+            if self.preprocess != "lab":
+                cv2.cvtColor(buf.lab[rows], cv2.COLOR_LAB2BGR, dst=buf.enhanced[rows])
+        list(pool.map(enhance, bands))
+        self.timer.mark("clahe")
+
+        source = image if self.preprocess == "lab" else buf.enhanced
+        list(pool.map(lambda rows: self._mask_rows(source, buf, rows), bands))
+        self.timer.mark("color_mask")
+
+        height = buf.gray.shape[0]
+
+        def blur_and_gradients(rows):
+            # Blurred rows [y0 - 1, y1 + 1) need gray rows 3 further out
+            y0, y1 = rows.start, rows.stop
+            b0, b1 = max(0, y0 - 1), min(height, y1 + 1)
+            g0, g1 = max(0, b0 - 3), min(height, b1 + 3)
+            blurred = cv2.GaussianBlur(buf.gray[g0:g1], (7, 7), 0)[b0 - g0:b1 - g0]
+            buf.blur[rows] = blurred[y0 - b0:y1 - b0]
+            dx = cv2.Sobel(blurred, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+            dy = cv2.Sobel(blurred, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
+            buf.dx[rows] = dx[y0 - b0:y1 - b0]
+            buf.dy[rows] = dy[y0 - b0:y1 - b0]
+        list(pool.map(blur_and_gradients, bands))
+        self.timer.mark("blur")
+
+        lower, upper = self.thresholds(buf.blur, buf.window_mask)
+        self.timer.mark("median")
+        cv2.Canny(buf.dx, buf.dy, lower, upper, edges=buf.edges)
+        self.timer.mark("canny")
+        return image if self.preprocess == "lab" else buf.enhanced
+
+    def _banded_clahe(self, buf):
+        # CLAHE per band of whole tile rows, with one tile of context on each
+        # side. OpenCV pads images whose size is not a multiple of the grid
+        # (reflect-101 on the bottom/right); the padded copy is built here so
+        # every band divides evenly. Tile LUTs match the whole-image CLAHE,
+        # but the interpolation weights are computed from band-local rows in
+        # float32, which moves about 0.02% of pixels by one level.
+        height, width = buf.lightness.shape
+        ext = buf.clahe_ext
+        ext[:height, :width] = buf.lightness
+        pad_y, pad_x = ext.shape[0] - height, ext.shape[1] - width
+        if pad_x:
+            ext[:height, width:] = ext[:height, width - 2:width - 2 - pad_x:-1]
+        if pad_y:
+            ext[height:] = ext[height - 2:height - 2 - pad_y:-1]
+        tile = ext.shape[0] // 8
+
+        def apply(group):
+            (first, last), clahe = group
+            t0, t1 = max(0, first - 1), min(8, last + 1)
+            out = clahe.apply(ext[t0 * tile:t1 * tile])
+            y0, y1 = first * tile, min(last * tile, height)
+            buf.lightness[y0:y1] = out[y0 - t0 * tile:y1 - t0 * tile, :width]
+        list(self._pool.map(apply, zip(buf.tile_groups, buf.band_clahe)))
+
+    def _mask_rows(self, image, buf, rows):
+        # Color masks and the masked gray image for some rows of the window;
+        # image is the enhanced BGR window (unused by the "lab" path)
+        if self.preprocess == "lab":
+            lab = buf.lab[rows]
+            cv2.inRange(lab, LAB_WHITE_LOWER, LAB_WHITE_UPPER, dst=buf.white_mask[rows])
+            cv2.inRange(lab, LAB_YELLOW_LOWER, LAB_YELLOW_UPPER, dst=buf.yellow_mask[rows])
+        else:
+            # Improved color masking (BGR space for better yellow detection)
+            image = image[rows]
+            cv2.inRange(image, WHITE_LOWER, WHITE_UPPER, dst=buf.white_mask[rows])
+            cv2.inRange(image, YELLOW_LOWER, YELLOW_UPPER, dst=buf.yellow_mask[rows])
+        cv2.bitwise_or(buf.white_mask[rows], buf.yellow_mask[rows], dst=buf.color_mask[rows])
+
+        if self.preprocess == "bgr":
+            # A masked bitwise_and leaves unselected pixels of a reused dst untouched
+            masked = buf.masked[rows]
+            masked.fill(0)
+            cv2.bitwise_and(image, image, dst=masked, mask=buf.color_mask[rows])
+            cv2.cvtColor(masked, cv2.COLOR_BGR2GRAY, dst=buf.gray[rows])
+        else:
+            # Masks are 0/255, so a plain AND zeroes everything outside them
+            if self.preprocess == "lab":
+                gray = buf.lightness[rows]
+            else:
+                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=buf.gray[rows])
+            cv2.bitwise_and(gray, buf.color_mask[rows], dst=buf.gray[rows])
+
+    def draw_lanes(self, image, result, out=None):
+        return overlay_lanes(image, result, self.buffers(*image.shape[:2]).line_image, out, timer=self.timer)
+
+
+def refine_line(frame, line, band, min_rows=20, step=1):
+    # Re-fits a (slope, intercept) line to the markings in frame. Every step-th
+    # row of the ROI band is scanned within +-band pixels of the line; the
+    # bright pixels in each row (max over B, G, R, so white and yellow both
+    # count) give the marking's center. A straight line x = a*y + c is fitted
+    # through the centers, dropping outliers once. Returns None when fewer than
+    # min_rows rows (e.g. gaps between dashes) contain a marking.
+    height, width = frame.shape[:2]
+    slope, intercept = line
+    if slope == 0:
+        return None
+    ys = np.arange(height - 1, int(height * ROI_TOP) - 1, -step)
+    centers = np.rint((ys - intercept) / slope).astype(np.int64)
+    offsets = np.arange(-band, band + 1)
+    xs = centers[:, None] + offsets
+    inside = (xs >= 0) & (xs < width)
+    strips = frame[ys[:, None], np.clip(xs, 0, width - 1)].max(axis=2).astype(np.float32)
+
+    # Marking pixels stand out from the row's asphalt by a clear margin. A
+    # slanted marking can fill half the strip, so the asphalt level is a low
+    # percentile rather than the median.
+    base = np.partition(strips, strips.shape[1] // 5, axis=1)[:, strips.shape[1] // 5, None]
+    peak = strips.max(axis=1, keepdims=True)
+    weights = strips - base
+    weights[~((weights > np.maximum(30, 0.5 * (peak - base))) & inside)] = 0
+    totals = weights.sum(axis=1)
+    rows = totals > 0
+    if rows.sum() < min_rows:
+        return None
+    x = (weights[rows] * xs[rows]).sum(axis=1) / totals[rows]
+    y = ys[rows].astype(np.float64)
+
+    a, c = np.polyfit(y, x, 1)
+    residuals = np.abs(x - (a * y + c))
+    keep = residuals <= max(2.0, 2.5 * residuals.std())
+    if keep.sum() >= min_rows and not keep.all():
+        a, c = np.polyfit(y[keep], x[keep], 1)
+    if a == 0:
+        return None
+    # x = a*y + c  ->  y = x/a - c/a
+    return np.array([1 / a, -c / a])
+
+
+class MultiScaleLaneDetector:
+    # Runs the LaneDetector pipeline on a small copy of the frame (detect_width
+    # wide, aspect ratio kept) and maps the lanes back to native coordinates.
+    # With refine=True each lane is then re-fitted by refine_line() in a band
+    # of +-band native pixels around it (default 1.5% of the frame width), so
+    # only a few thousand full-resolution pixels are read per lane. The
+    # trade-off is set by detect_width and refine: a low width without
+    # refinement is fastest, refinement restores native-resolution placement.
+    # Results and drawing are always at the native resolution.
+    def __init__(self, detect_width=320, refine=True, band=None, refine_step=1, **options):
+        self.coarse = LaneDetector(size=detect_width, **options)
+        self.refine = refine
+        self.band = band
+        self.refine_step = refine_step
+        self._line_image = None
+
+    @property
+    def tracker(self):
+        return self.coarse.tracker
+
+    @property
+    def timer(self):
+        return self.coarse.timer
+
+    @timer.setter
+    def timer(self, timer):
+        self.coarse.timer = timer
+
+    def close(self):
+        self.coarse.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def process(self, image, out=None):
+        image, result = self.find_lanes(image)
+        return self.draw_lanes(image, result, out)
+
+    def detect(self, image):
+        return self.find_lanes(image)[1]
+
+    def find_lanes(self, image):
+        # Returns the native frame and its LaneResult
+        _, coarse = self.coarse.find_lanes(image)
+        height, width = image.shape[:2]
+        scale = width / coarse.width
+        band = self.band or max(4, round(width * 0.015))
+
+        sides = []
+        for line in (coarse.left, coarse.right):
+            if line is None:
+                sides.append(None)
+                continue
+            # Uniform scaling keeps the slope, only the intercept grows
+            params = np.array([line.slope, line.intercept * scale])
+            if self.refine:
+                refined = refine_line(image, params, band, step=self.refine_step)
+                if refined is not None:
+                    params = refined
+            sides.append(LaneLine(float(params[0]), float(params[1]), make_coordinates(image, params),
+                                  line.segments, line.confidence))
+        self.timer.mark("refine")
+        return image, LaneResult(sides[0], sides[1], width, height)
+
+    def draw_lanes(self, image, result, out=None):
+        if self._line_image is None or self._line_image.shape != image.shape:
+            self._line_image = np.empty_like(image)
+        # Same look as LaneDetector at 640 wide
+        thickness = max(2, round(8 * image.shape[1] / 640))
+        return overlay_lanes(image, result, self._line_image, out, thickness=thickness, timer=self.timer)
+
+
+# process_image keeps one detector per thread so callers can share it freely
+_local = threading.local()
+
+def thread_detector():
+    detector = getattr(_local, "detector", None)
+    if detector is None:
+        detector = _local.detector = LaneDetector()
+    return detector
+
+def process_image(image):
+    return thread_detector().process(image)
+
+def make_coordinates(image, line_params, top=ROI_TOP):
+    slope, intercept = line_params
+    y1 = image.shape[0]  # Bottom of image
+    y2 = int(y1 * top)  # Match ROI height
+    x1 = int((y1 - intercept) / slope) if slope != 0 else 0
+    x2 = int((y2 - intercept) / slope) if slope != 0 else 0
+    return ((x1, y1), (x2, y2))
+
+# Debugging: shows (or writes to output_dir) every intermediate image of a
+# single detector pass, captured from its buffers instead of recomputed
+def debug_steps(image, output_dir=None):
+    detector = LaneDetector()
+    enhanced, result = detector.find_lanes(image)
+    steps = {"original": image, **detector.stage_images(), "result": detector.draw_lanes(enhanced, result)}
+    if output_dir:
+        with ImageSequenceSink(os.path.join(output_dir, "{index}.png")) as sink:
+            for name, step in steps.items():
+                sink.put(step, name)
+        return steps
+    for name, step in steps.items():
+        cv2.imshow(name, step)
+    cv2.waitKey(0)
+    cv2.destroyAllWindows()
+    return steps
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def collect_images(inputs):
+    # Expand directories (recursively) and glob patterns into a sorted, de-duplicated file list
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = [os.path.join(root, name) for root, _, names in os.walk(item)
+                     for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+        elif any(char in item for char in "*?["):
+            found = glob.glob(item, recursive=True)
+        else:
+            found = [item]
+        paths.extend(sorted(found))
+    return list(dict.fromkeys(paths))
+
+
+def _init_worker():
+    # One OpenCV thread per process, the pool already provides the parallelism
+    cv2.setNumThreads(1)
+
+
+def _process_file(task):
+    path, output_path, keep_image, debug_prefix = task
+    image = cv2.imread(path)
+    if image is None:
+        return {"image": path, "error": "could not read image"}
+
+    detector = thread_detector()
+    enhanced, result = detector.find_lanes(image)
+    if debug_prefix:
+        # Stage images come from this pass's buffers, nothing is recomputed
+        os.makedirs(os.path.dirname(debug_prefix) or ".", exist_ok=True)
+        for name, step in detector.stage_images().items():
+            cv2.imwrite(f"{debug_prefix}_{name}.png", step)
+    annotated = None
+    if output_path or keep_image:
+        annotated = detector.draw_lanes(enhanced, result)
+    if output_path:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, annotated)
+
+    record = {"image": path, "output": output_path, **result.as_dict()}
+    if keep_image:
+        record["annotated"] = annotated
+    return record
+
+
+def process_batch(paths, output_dir=None, workers=None, chunksize=None, keep_images=False, debug_dir=None):
+    # Annotated images mirror the input layout below output_dir; yields one
+    # record per image. keep_images adds the annotated image to each record
+    # ("annotated"), debug_dir receives every stage image as <name>_<stage>.png.
+    relative = [os.path.basename(p) for p in paths]
+    if paths and (output_dir or debug_dir):
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+        relative = [os.path.relpath(os.path.abspath(p), root) for p in paths]
+    tasks = [(p, os.path.join(output_dir, rel) if output_dir else None, keep_images,
+              os.path.join(debug_dir, os.path.splitext(rel)[0]) if debug_dir else None)
+             for p, rel in zip(paths, relative)]
+
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (workers * 4))
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        yield from pool.imap(_process_file, tasks, chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect lane lines in images")
+    parser.add_argument("inputs", nargs="*", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="write annotated images and lanes.jsonl here")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=None, help="images handed to a worker at a time")
+    parser.add_argument("--show", action="store_true",
+                        help="display results as they finish; the last one stays up until a key is pressed")
+    parser.add_argument("--debug-dir", help="write every intermediate stage image here")
+    args = parser.parse_args(argv)
+
+    # No arguments: the original single-image preview
+    if not args.inputs:
+        args.inputs = ["test_image.jpg"]  # Replace with your image path
+        args.show = True
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        print("No images found!")
+        return 1
+
+    lanes_file = None
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        lanes_file = open(os.path.join(args.output_dir, "lanes.jsonl"), "w")
+
+    failed = 0
+    display = DisplaySink(hold=True) if args.show else None
+    try:
+        for record in process_batch(paths, args.output_dir, args.workers, args.chunksize,
+                                    keep_images=args.show, debug_dir=args.debug_dir):
+            if "error" in record:
+                failed += 1
+                print(f"Error loading image {record['image']}!")
+                continue
+            annotated = record.pop("annotated", None)
+            if lanes_file:
+                lanes_file.write(json.dumps(record) + "\n")
+            if display is not None:
+                display.put(annotated)
+    finally:
+        if lanes_file:
+            lanes_file.close()
+        if display is not None:
+            display.close()
+
+    print(f"Processed {len(paths) - failed} of {len(paths)} images")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import bisect
+import random
+import time
+
+import numpy as np
+
+# The departments of the chatbot's agent menu
+DEPARTMENTS = ("customer service", "technical support", "billing", "sales")
+
+
+class Agent:
+    """A human agent who takes sessions from the queues of their departments"""
+
+    def __init__(self, name, departments=DEPARTMENTS):
+        self.name = name
+        self.departments = tuple(departments)
+        self.request = None
+        self.served = 0
+
+
+class AgentRequest:
+    """One session waiting for an agent; await future for the Agent"""
+
+    def __init__(self, department, priority, session_id, created, key, seq, future):
+        self.department = department
+        self.priority = priority
+        self.session_id = session_id
+        self.created = created
+        self.key = key
+        self.seq = seq
+        self.future = future
+        self.agent = None
+        self.assigned = None
+        # Estimated wait when the request was queued, in seconds
+        self.estimate = None
+
+    @property
+    def waited(self):
+        return (self.assigned if self.assigned is not None else time.monotonic()) - self.created
+
+
+class AgentRouter:
+    # Routes sessions to a pool of agents through one queue per department.
+    # Queues are lists kept sorted by key = arrival time - priority * aging:
+    # a request of priority p is served as if it had arrived p * aging
+    # seconds earlier, so higher priorities go first but a long enough wait
+    # beats any priority (nothing starves). Keys never change while a
+    # request waits, so inserting, cancelling and finding a queue position
+    # are a bisect each. A freed agent takes the smallest key across all of
+    # their departments, which serves shared agents' departments in arrival
+    # order; a new request goes to the free agent that has been idle longest.
+    # Waiting costs an asyncio future per session, no thread or task.
+    #
+    # Wait estimates come from service-time statistics: an exponentially
+    # weighted mean per department (seeded with service_time), and k
+    # requests ahead estimate (k + 1) / n mean service times, where n counts
+    # an agent of d departments as 1/d of an agent in each. Agents call
+    # finish() when done with a session; with handle_time the router
+    # simulates that instead, keeping each agent busy for a random time with
+    # that mean.
+    def __init__(self, agents, departments=DEPARTMENTS, service_time=300.0, aging=120.0, smoothing=0.1,
+                 handle_time=None, seed=None):
+        self.agents = list(agents)
+        self.aging = aging
+        self.smoothing = smoothing
+        self.handle_time = handle_time
+        self.queues = {department: [] for department in departments}
+        self.service_time = {department: float(service_time) for department in departments}
+        self._staff = {department: 0.0 for department in departments}
+        # Free agents per department, longest idle first (dicts keep insertion order)
+        self._free = {department: {} for department in departments}
+        for agent in self.agents:
+            for department in agent.departments:
+                if department not in self.queues:
+                    raise ValueError(f"Agent {agent.name!r} works for unknown department {department!r}")
+                self._staff[department] += 1 / len(agent.departments)
+                self._free[department][agent] = None
+        unstaffed = [department for department, count in self._staff.items() if not count]
+        if unstaffed:
+            raise ValueError(f"No agents for {', '.join(unstaffed)}")
+        self._rng = random.Random(seed)
+        self._seq = 0
+        self.requested = 0
+        self.served = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+        self.longest_wait = 0.0
+
+    def request(self, department, priority=0, session_id=None):
+        """Queue a session for the department (must be called in the event loop)"""
+        if department not in self.queues:
+            raise ValueError(f"Unknown department: {department}")
+        now = time.monotonic()
+        self._seq += 1
+        request = AgentRequest(department, priority, session_id, now, now - priority * self.aging, self._seq,
+                               asyncio.get_running_loop().create_future())
+        self.requested += 1
+        free = self._free[department]
+        if free:
+            request.estimate = 0.0
+            self._assign(next(iter(free)), request, now)
+        else:
+            bisect.insort(self.queues[department], (request.key, request.seq, request))
+            request.estimate = self.estimate(request)
+        return request
+
+    def position(self, request):
+        """Requests ahead of this one in its queue (0 once an agent has it)"""
+        if request.agent is not None:
+            return 0
+        return bisect.bisect_left(self.queues[request.department], (request.key, request.seq))
+
+    def estimate(self, request):
+        """Expected seconds until an agent takes the request"""
+        department = request.department
+        if request.agent is not None or self._free[department]:
+            return 0.0
+        return (self.position(request) + 1) * self.service_time[department] / self._staff[department]
+
+    def cancel(self, request):
+        """Leave the queue, e.g. when the user disconnects (no-op once assigned)"""
+        if request.agent is not None or request.future.done():
+            return
+        queue = self.queues[request.department]
+        index = bisect.bisect_left(queue, (request.key, request.seq))
+        if index < len(queue) and queue[index][2] is request:
+            del queue[index]
+        request.future.cancel()
+        self.cancelled += 1
+
+    def finish(self, agent):
+        """The agent is done with their session: record its service time and take the next one"""
+        request = agent.request
+        if request is None:
+            return
+        now = time.monotonic()
+        department = request.department
+        self.service_time[department] += self.smoothing * (now - request.assigned - self.service_time[department])
+        agent.request = None
+        agent.served += 1
+        # The oldest (by key) request any of the agent's departments has waiting
+        best = None
+        for department in agent.departments:
+            queue = self.queues[department]
+            if queue and (best is None or queue[0] < best[0]):
+                best = queue
+        if best is None:
+            for department in agent.departments:
+                self._free[department][agent] = None
+        else:
+            self._assign(agent, best.pop(0)[2], now)
+
+    def _assign(self, agent, request, now):
+        for department in agent.departments:
+            self._free[department].pop(agent, None)
+        agent.request = request
+        request.agent = agent
+        request.assigned = now
+        self.served += 1
+        self.total_wait += now - request.created
+        self.longest_wait = max(self.longest_wait, now - request.created)
+        request.future.set_result(agent)
+        if self.handle_time:
+            asyncio.get_running_loop().call_later(self._rng.expovariate(1 / self.handle_time), self.finish, agent)
+
+    def stats(self):
+        return {"waiting": sum(len(queue) for queue in self.queues.values()),
+                "agents_busy": sum(agent.request is not None for agent in self.agents), "agents": len(self.agents),
+                "served": self.served, "cancelled": self.cancelled,
+                "mean_wait_s": self.total_wait / self.served if self.served else 0.0,
+                "longest_wait_s": self.longest_wait}
+
+
+def default_agents(per_department=2, generalists=1, departments=DEPARTMENTS):
+    """per_department agents for each department plus generalists who take all of them"""
+    agents = [Agent(f"{department.title()} agent {i + 1}", (department,))
+              for department in departments for i in range(per_department)]
+    agents += [Agent(f"Support agent {i + 1}", departments) for i in range(generalists)]
+    return agents
+
+
+def format_wait(seconds):
+    """An estimated wait the way the chatbot says it"""
+    if seconds < 60:
+        return "less than a minute"
+    minutes = round(seconds / 60)
+    return "about 1 minute" if minutes == 1 else f"about {minutes} minutes"
+
+
+async def simulate(sessions=5000, rate=0.0, per_department=2, generalists=1, handle_time=0.02, priority_share=0.1,
+                   seed=0):
+    """Queue simulated users (all at once, or `rate` per second) and compare their waits with the estimates"""
+    rng = random.Random(seed)
+    router = AgentRouter(default_agents(per_department, generalists), service_time=handle_time,
+                         handle_time=handle_time, seed=seed)
+    requests, peak = [], 0
+    start = time.perf_counter()
+    for _ in range(sessions):
+        requests.append(router.request(rng.choice(DEPARTMENTS), int(rng.random() < priority_share)))
+        peak = max(peak, router.stats()["waiting"])
+        if rate:
+            await asyncio.sleep(rng.expovariate(rate))
+    queued = time.perf_counter() - start
+    await asyncio.gather(*(request.future for request in requests))
+    elapsed = time.perf_counter() - start
+
+    waits = np.array([request.waited for request in requests])
+    estimates = np.array([request.estimate for request in requests])
+    priority = np.array([request.priority > 0 for request in requests])
+    queued_waits = waits > 0
+    error = np.abs(estimates - waits)[queued_waits]
+    return {"sessions": sessions, "agents": len(router.agents), "peak_waiting": peak, "elapsed_s": elapsed,
+            "request_us": queued / sessions * 1e6 if not rate else None,
+            "wait_p50_s": float(np.percentile(waits, 50)), "wait_p99_s": float(np.percentile(waits, 99)),
+            "priority_wait_mean_s": float(waits[priority].mean()) if priority.any() else None,
+            "normal_wait_mean_s": float(waits[~priority].mean()),
+            "estimate_error_median": float(np.median(error / waits[queued_waits])) if len(error) else 0.0,
+            "served": {agent.name: agent.served for agent in router.agents}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the human-agent queues with many waiting sessions")
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0.0, help="arrivals per second (default: all at once)")
+    parser.add_argument("--agents", type=int, default=2, help="agents per department")
+    parser.add_argument("--generalists", type=int, default=1, help="agents who take every department")
+    parser.add_argument("--handle-time", type=float, default=0.02, help="mean seconds an agent spends per session")
+    parser.add_argument("--priority-share", type=float, default=0.1, help="share of priority sessions")
+    args = parser.parse_args()
+    result = asyncio.run(simulate(args.sessions, args.rate, args.agents, args.generalists, args.handle_time,
+                                  args.priority_share))
+    print(f"{result['sessions']} sessions, {result['agents']} agents, up to {result['peak_waiting']} waiting, "
+          f"done in {result['elapsed_s']:.2f} s"
+          + (f", {result['request_us']:.1f} us per request" if result["request_us"] is not None else ""))
+    print(f"wait p50 {result['wait_p50_s']:.3f} s  p99 {result['wait_p99_s']:.3f} s  "
+          f"mean normal {result['normal_wait_mean_s']:.3f} s"
+          + (f" / priority {result['priority_wait_mean_s']:.3f} s" if result["priority_wait_mean_s"] is not None
+             else ""))
+    print(f"median estimate error {result['estimate_error_median']:.1%} of the actual wait")
+    for name, served in result["served"].items():
+        print(f"  {name:32s} {served:6d} sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,695 @@
+import collections
+import itertools
+import random
+import uuid
+
+# Output items besides text: a pause of `units` typing delays, and a
+# request to queue the session for a human agent (see chat_agents)
+Pause = collections.namedtuple("Pause", "units")
+Transfer = collections.namedtuple("Transfer", "department priority")
+
+# Typing indicator used in "say" lists: three dots while "processing"
+TYPING = {"dots": 3, "delay": 1}
+
+INVALID = "I'm sorry, that's not a valid option. Please try again."
+
+# Ticket numbers of dialogues without a recorder (unique within the process)
+_TICKETS = itertools.count(100001)
+
+# The conversation as a table of states. On entering a state:
+#   set      session variables to assign: a constant, ["randint", a, b], ["choice", [...]]
+#            or ["ticket", kind] for a new ticket number (unique, and stored
+#            with the session's variables when the dialogue has a recorder)
+#   history  line appended to the conversation history
+#   say      lines to send (str.format'ed with the variables and the tables),
+#            TYPING, {"lookup": table, "key": variable} for a table entry, or
+#            {"transfer": variable} to queue for the department in variable
+#            (at the session's "priority", 0 when unset)
+# and then either
+#   prompt   text to send before waiting for the user's next message, then
+#   store    variable that receives the message (mapped through "values" if given)
+#   next     target state, or {input: target} with "*" as the fallback;
+#            without a fallback any other input repeats the state after "invalid"
+# In states marked "free_text", a message that is not one of the choices is
+# matched against the dialogue's intents instead (see chat_intents).
+# Or, without a prompt, "branch" names a variable whose value selects from
+# "next" the same way. Targets are formatted with the variables too
+# ("menu_{service}"). A state with "end" finishes the conversation.
+# Sessions only hold a state name and variables, so any of them can be
+# saved between messages and resumed by another process.
+#
+# Menus, sub-menus and per-option states are generated from the chatbot's
+# tables by compile_dialogue(); the entry state of option k of service n is
+# "handle_n_k" and every handler path ends in "followup".
+FLOW = {
+    "start": {
+        "say": ["\n" + "=" * 50,
+                "Welcome to our Customer Support Chatbot!",
+                "I'm here to help you with any questions or issues you might have.",
+                "=" * 50,
+                "Before we begin, may I know your name?"],
+        "prompt": "Your name: ", "store": "user_name", "next": "greet",
+    },
+    "greet": {
+        "say": ["\nNice to meet you, {user_name}! How can I assist you today?"],
+        "next": "main",
+    },
+    "followup": {
+        "say": ["\nIs there anything else you need help with regarding this issue?",
+                "1: Yes, I need more assistance",
+                "2: No, I'm good for now"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "followup_more", "*": "followup_done"},
+    },
+    "followup_more": {"say": ["Let me help you further..."], "next": "menu_{service}"},
+    "followup_done": {"say": ["Great! Let's return to the previous menu."], "next": "menu_{service}"},
+
+    # Account status
+    "handle_1_1": {
+        "set": {"balance": ["randint", 100, 1000]},
+        "say": ["\nYour current account balance is ${balance}.00",
+                "Would you like to make a payment?",
+                "1: Yes, make a payment",
+                "2: No, just checking"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "payment_redirect", "*": "balance_ok"},
+    },
+    "payment_redirect": {
+        "say": ["Redirecting you to our secure payment portal...", TYPING,
+                "You would now be redirected to make a payment in our actual system."],
+        "next": "followup",
+    },
+    "balance_ok": {"say": ["No problem! Your account is in good standing."], "next": "followup"},
+    "handle_1_2": {
+        "say": ["\nWhat information would you like to update?",
+                "1: Contact information",
+                "2: Mailing address",
+                "3: Email preferences",
+                "4: Security settings"],
+        "prompt": "\nEnter your choice (1-4): ", "next": "information_updated",
+    },
+    "information_updated": {
+        "say": ["In a real system, you would now be guided through updating your selected information.", TYPING,
+                "Information updated successfully!"],
+        "next": "followup",
+    },
+    "handle_1_3": {
+        "set": {"status": ["choice", ["Active", "Expiring soon", "Renewal needed"]]},
+        "say": ["\nYour subscription status is: {status}"],
+        "branch": "status", "next": {"Active": "subscription_active", "*": "subscription_renew"},
+    },
+    "subscription_active": {"say": ["Your subscription is active and will renew automatically."], "next": "followup"},
+    "subscription_renew": {
+        "say": ["Would you like to renew your subscription?",
+                "1: Yes, renew now",
+                "2: No, maybe later"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "renewing", "*": "renew_later"},
+    },
+    "renewing": {
+        "say": ["Processing your renewal...", TYPING, "Subscription renewed successfully!"],
+        "next": "followup",
+    },
+    "renew_later": {"say": ["No problem! We'll remind you again before it expires."], "next": "followup"},
+
+    # Billing
+    "handle_2_1": {
+        "say": ["\nHere are your most recent transactions:",
+                "2025-03-01 - $45.99 - Monthly subscription",
+                "2025-02-15 - $10.00 - Add-on service",
+                "2025-02-01 - $45.99 - Monthly subscription"],
+        "next": "followup",
+    },
+    "handle_2_2": {
+        "say": ["\nWhich charge would you like to dispute?",
+                "1: March 1, 2025 - $45.99 - Monthly subscription",
+                "2: February 15, 2025 - $10.00 - Add-on service",
+                "3: February 1, 2025 - $45.99 - Monthly subscription"],
+        "prompt": "\nEnter your choice (1-3): ", "next": "dispute_reason",
+    },
+    "dispute_reason": {
+        "say": ["\nPlease tell us why you're disputing this charge:",
+                "1: Unauthorized charge",
+                "2: Incorrect amount",
+                "3: Service not received",
+                "4: Other reason"],
+        "prompt": "\nEnter your choice (1-4): ", "next": "dispute_filed",
+    },
+    "dispute_filed": {
+        "set": {"reference": ["ticket", "dispute"]},
+        "say": ["\nThank you for providing this information. Your dispute has been filed.",
+                "Dispute reference number: #{reference}",
+                "A billing specialist will review this and contact you within 48 hours."],
+        "next": "followup",
+    },
+    "handle_2_3": {
+        "say": ["\nSelect the payment method you'd like to use:",
+                "1: Add new credit/debit card",
+                "2: Use existing payment method",
+                "3: Set up automatic bank transfer"],
+        "prompt": "\nEnter your choice (1-3): ", "next": "payment_method_updated",
+    },
+    "payment_method_updated": {
+        "say": ["In a real system, you would now be guided through updating your payment method.", TYPING,
+                "Payment method updated successfully!"],
+        "next": "followup",
+    },
+    "handle_2_4": {
+        "say": ["\nWe offer the following payment plans:",
+                "1: Monthly ($45.99/month)",
+                "2: Quarterly ($129.99/quarter - Save 5%)",
+                "3: Annual ($499.99/year - Save 10%)"],
+        "prompt": "\nEnter your choice (1-3): ", "next": "plan_switch",
+    },
+    "plan_switch": {
+        "say": ["Would you like to switch to this payment plan?",
+                "1: Yes, switch now",
+                "2: No, just checking"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "plan_switching", "*": "plan_unchanged"},
+    },
+    "plan_switching": {
+        "say": ["Processing your request...", TYPING, "Payment plan updated successfully!"],
+        "next": "followup",
+    },
+    "plan_unchanged": {"say": ["No problem! Your current payment plan remains unchanged."], "next": "followup"},
+
+    # Technical support
+    "handle_3_1": {
+        "say": ["{solutions[login]}",
+                "\nDid this solution help resolve your issue?",
+                "1: Yes, it's resolved",
+                "2: No, I still need help"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"2": "login_details", "*": "followup"},
+    },
+    "login_details": {
+        "say": ["\nLet me connect you with our technical team for more specialized assistance.",
+                "Please provide additional details about your login issue:"],
+        "prompt": "\nYour issue details: ", "store": "issue_details", "next": "login_ticket",
+    },
+    "login_ticket": {
+        "set": {"ticket": ["ticket", "login"]},
+        "say": ["\nThank you for providing these details. A support ticket (#{ticket}) has been created.",
+                "Our technical team will contact you within 24 hours."],
+        "next": "followup",
+    },
+    "handle_3_2": {
+        "say": ["{solutions[app]}",
+                "\nIs there a specific feature or page that's not working?"],
+        "prompt": "\nPlease specify (or type 'all' if everything is affected): ", "store": "feature",
+        "next": "outage_check",
+    },
+    "outage_check": {
+        "set": {"outage": ["choice", ["yes", "no"]]},
+        "say": ["\nThank you for letting us know about issues with {feature}.",
+                "Let me check if there are any known outages in our system...", TYPING],
+        "branch": "outage", "next": {"yes": "known_outage", "*": "no_outage"},
+    },
+    "known_outage": {
+        "say": ["We're currently experiencing some technical difficulties with this feature.",
+                "Our team is working on it and it should be resolved within the next few hours."],
+        "next": "followup",
+    },
+    "no_outage": {
+        "say": ["There are no known outages at this time. I recommend clearing your browser cache or reinstalling "
+                "the app.",
+                "Would you like me to guide you through these steps?",
+                "1: Yes, guide me through the steps",
+                "2: No, I'll try on my own"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "clear_cache_steps", "*": "followup"},
+    },
+    "clear_cache_steps": {
+        "say": ["\nHere's how to clear your cache and cookies:",
+                "1. Open your browser settings",
+                "2. Navigate to Privacy & Security",
+                "3. Select 'Clear browsing data'",
+                "4. Check 'Cookies' and 'Cached images and files'",
+                "5. Click 'Clear data'"],
+        "next": "followup",
+    },
+    "handle_3_3": {
+        "say": ["{solutions[installation]}",
+                "\nWhich platform are you trying to install on?",
+                "1: Windows",
+                "2: Mac",
+                "3: iOS",
+                "4: Android"],
+        "prompt": "\nEnter your choice (1-4): ", "store": "platform", "next": "install_steps",
+    },
+    "install_steps": {
+        "say": ["\nHere are the specific installation steps for your platform:", TYPING],
+        "branch": "platform", "next": {"1": "install_windows", "2": "install_mac", "*": "install_mobile"},
+    },
+    "install_windows": {
+        "say": ["1. Download the installer from our website",
+                "2. Right-click the installer and select 'Run as administrator'",
+                "3. Follow the on-screen instructions",
+                "4. Restart your computer after installation"],
+        "next": "followup",
+    },
+    "install_mac": {
+        "say": ["1. Download the DMG file from our website",
+                "2. Open the DMG file",
+                "3. Drag the application to your Applications folder",
+                "4. Right-click the app and select 'Open' for first-time use"],
+        "next": "followup",
+    },
+    "install_mobile": {
+        "say": ["1. Open the App Store/Google Play Store",
+                "2. Search for our application",
+                "3. Tap 'Install' and follow the prompts"],
+        "next": "followup",
+    },
+    "handle_3_4": {
+        "say": ["{solutions[error]}",
+                "\nCan you provide the error code or message you're seeing?"],
+        "prompt": "\nError code/message: ", "store": "error_message", "next": "error_lookup",
+    },
+    "error_lookup": {
+        "say": ["\nI've searched our database for error '{error_message}'", TYPING,
+                "This error typically occurs when there's a connection issue with our servers.",
+                "Would you like to try some troubleshooting steps or file a detailed report?",
+                "1: Try troubleshooting steps",
+                "2: File a detailed report"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "error_steps", "*": "error_ticket"},
+    },
+    "error_steps": {
+        "say": ["\nPlease try the following:",
+                "1. Check your internet connection",
+                "2. Disable any VPN or proxy services",
+                "3. Clear your application cache",
+                "4. Restart the application"],
+        "next": "followup",
+    },
+    "error_ticket": {
+        "set": {"ticket": ["ticket", "error_report"]},
+        "say": ["\nA support ticket has been created.",
+                "Ticket number: #{ticket}",
+                "A technical specialist will contact you within 24 hours."],
+        "next": "followup",
+    },
+
+    # Product information (feature_<n> and compatibility_<n> come from the tables)
+    "handle_4_1": {
+        "say": ["\nOur product includes the following key features:",
+                "1. Cloud synchronization across all your devices",
+                "2. Advanced security with two-factor authentication",
+                "3. Collaborative editing in real-time",
+                "4. Automated backup and version history",
+                "5. AI-powered suggestions and insights",
+                "\nWhich feature would you like to learn more about?"],
+        "prompt": "\nEnter your choice (1-5): ",  # next: one feature_<n> per detail page
+    },
+    "handle_4_2": {
+        "say": ["\nWe offer the following pricing plans:",
+                "Basic Plan: $9.99/month - Includes core features for individual users",
+                "Premium Plan: $19.99/month - Includes advanced features and priority support",
+                "Business Plan: $49.99/month - Includes team collaboration and admin controls",
+                "Enterprise: Custom pricing - Includes custom integrations and dedicated support",
+                "\nWould you like to see a detailed feature comparison?",
+                "1: Yes, show comparison",
+                "2: No, thanks"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "plan_comparison", "*": "followup"},
+    },
+    "plan_comparison": {
+        "say": ["\nFeature Comparison:",
+                "━" * 51,
+                "Feature          | Basic | Premium | Business | Enterprise",
+                "━" * 51,
+                "Storage          | 10GB  | 100GB   | 1TB      | Unlimited",
+                "Users            | 1     | 1       | Up to 10  | Unlimited",
+                "Support          | Email | Priority| Priority  | Dedicated",
+                "API Access       | No    | Yes     | Yes       | Custom",
+                "Custom Branding  | No    | No      | Yes       | Yes",
+                "━" * 51],
+        "next": "followup",
+    },
+    "handle_4_3": {
+        "say": ["\nWhat system or device are you checking compatibility for?",
+                "1: Windows",
+                "2: Mac",
+                "3: iOS",
+                "4: Android",
+                "5: Web browsers",
+                "6: Other"],
+        "prompt": "\nEnter your choice (1-6): ",  # next: one compatibility_<n> per system
+    },
+    "other_system": {
+        "prompt": "\nPlease specify your system: ", "store": "other_system", "next": "other_system_ticket",
+    },
+    "other_system_ticket": {
+        "set": {"ticket": ["ticket", "compatibility"]},
+        "say": ["\nI'll need to check compatibility for {other_system}. Let me create a ticket for our product team.",
+                "Ticket #{ticket} has been created. We'll email you with compatibility information within 48 hours."],
+        "next": "followup",
+    },
+
+    # Complaints
+    "handle_5_1": {
+        "say": ["\nI'm sorry to hear you're experiencing service quality issues.",
+                "Please rate the severity of the issue:",
+                "1: Minor inconvenience",
+                "2: Moderate issue",
+                "3: Major problem",
+                "4: Service completely unusable"],
+        "prompt": "\nEnter your choice (1-4): ", "store": "severity", "next": "quality_details",
+    },
+    "quality_details": {
+        "say": ["\nPlease provide more details about the service quality issue:"],
+        "prompt": "Details: ", "store": "details", "next": "quality_filed",
+    },
+    "quality_filed": {
+        "set": {"reference": ["ticket", "service_quality"]},
+        "say": ["\nThank you for bringing this to our attention. Your feedback is important to us.",
+                "Complaint reference #: {reference}"],
+        "branch": "severity", "next": {"3": "quality_escalated", "4": "quality_escalated", "*": "quality_review"},
+    },
+    "quality_escalated": {
+        "say": ["Due to the severity of this issue, a customer service manager will contact you within 24 hours."],
+        "next": "followup",
+    },
+    "quality_review": {"say": ["We'll review your feedback and work on improving our service."], "next": "followup"},
+    "handle_5_2": {
+        "say": ["\nI'm sorry to hear about the product defect.",
+                "Which product are you experiencing issues with?"],
+        "prompt": "Product name: ", "store": "product", "next": "defect_ownership",
+    },
+    "defect_ownership": {
+        "say": ["\nHow long have you owned this product?",
+                "1: Less than 30 days",
+                "2: 1-6 months",
+                "3: 6-12 months",
+                "4: Over 1 year"],
+        "prompt": "\nEnter your choice (1-4): ", "store": "ownership", "next": "defect_details",
+    },
+    "defect_details": {
+        "say": ["\nPlease describe the defect in detail:"],
+        "prompt": "Defect details: ", "store": "defect_details", "next": "defect_request",
+    },
+    "defect_request": {
+        "say": ["\nWould you like to:",
+                "1: Request a repair",
+                "2: Request a replacement",
+                "3: Request a refund"],
+        "prompt": "\nEnter your choice (1-3): ", "store": "request",
+        "values": {"1": "repair", "2": "replacement", "3": "refund"}, "next": "defect_submitted",
+    },
+    "defect_submitted": {
+        "set": {"reference": ["ticket", "product_defect"]},
+        "say": ["\nThank you. Your {request} request has been submitted.",
+                "Reference #: {reference}",
+                "A product specialist will contact you within 48 hours to process your request."],
+        "next": "followup",
+    },
+    "handle_5_3": {
+        "say": ["\nI'm sorry to hear you had a negative experience with our staff.",
+                "When did this incident occur?"],
+        "prompt": "Date (YYYY-MM-DD): ", "store": "date", "next": "staff_name",
+    },
+    "staff_name": {
+        "say": ["\nIf you know, please provide the name of the staff member:"],
+        "prompt": "Staff name (or leave blank if unknown): ", "store": "staff_name", "next": "staff_incident",
+    },
+    "staff_incident": {
+        "say": ["\nPlease describe what happened:"],
+        "prompt": "Incident details: ", "store": "incident", "next": "staff_filed",
+    },
+    "staff_filed": {
+        "set": {"reference": ["ticket", "staff_behavior"]},
+        "say": ["\nThank you for bringing this to our attention. We take these matters very seriously.",
+                "Complaint reference #: {reference}",
+                "Our customer relations manager will contact you within 24 hours to address this issue."],
+        "next": "followup",
+    },
+
+    # Human agent
+    "agent": {
+        "say": ["\nI understand you'd like to speak with a human agent.",
+                "Please select the department you need assistance with:",
+                "1: General customer service",
+                "2: Technical support",
+                "3: Billing department",
+                "4: Sales team"],
+        "prompt": "\nEnter your choice (1-4): ", "store": "department",
+        "values": {"1": "customer service", "2": "technical support", "3": "billing", "4": "sales"},
+        "next": "agent_issue",
+    },
+    "agent_issue": {
+        "say": ["\nThank you. I'll connect you with a {department} representative.",
+                "Please provide a brief description of your issue:"],
+        "prompt": "Issue description: ", "store": "issue", "next": "agent_hold",
+    },
+    "agent_hold": {
+        "set": {"reference": ["ticket", "agent"]},
+        "say": ["\nThank you. Your reference number is: #{reference}", {"transfer": "department"}],
+        "prompt": "\nPress Enter to return to the main menu...", "next": "main",
+    },
+
+    # Knowledge base answers found by free-text matching
+    "article": {
+        "say": ["\nHere's what I found in our help articles:", {"lookup": "articles", "key": "article"},
+                "\nDid this answer your question?",
+                "1: Yes, thanks",
+                "2: No, I still need help"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"2": "article_unhelpful", "*": "article_helpful"},
+    },
+    "article_helpful": {"say": ["Great! Is there anything else I can help you with?"], "next": "main"},
+    # Users the articles did not help queue ahead of others for the rest of the session
+    "article_unhelpful": {"set": {"priority": 1},
+                          "say": ["Sorry about that. Let me get you to someone who can take a closer look."],
+                          "next": "agent"},
+
+    # Goodbye
+    "end": {
+        "say": ["\nThank you for chatting with us today, {user_name}!",
+                "Is there anything else you'd like assistance with before you go?",
+                "1: Yes, I have another question",
+                "2: No, I'm all set"],
+        "prompt": "\nEnter your choice (1-2): ", "next": {"1": "another_question", "*": "goodbye"},
+    },
+    "another_question": {"say": ["Great! Let's go back to the main menu."], "next": "main"},
+    "goodbye": {
+        "say": ["\nThank you for using our customer support service, {user_name}.",
+                "Have a great day!",
+                "=" * 50],
+        "end": True,
+    },
+}
+
+
+class DialogueSession:
+    """Where one conversation stands; to_dict() is plain JSON"""
+
+    # One of these per live conversation, so no instance dict. history holds
+    # event codes, oldest first: the name of the state whose "history" line
+    # was logged (the state table's own string) or the line itself for free
+    # text; Dialogue.history() turns them into text.
+    __slots__ = ("id", "state", "variables", "history", "finished")
+
+    def __init__(self, state=None, variables=None, history=None, finished=False, session_id=None):
+        self.id = session_id or uuid.uuid4().hex
+        self.state = state
+        self.variables = variables if variables is not None else {}
+        self.history = history if history is not None else []
+        self.finished = finished
+
+    def to_dict(self):
+        return {"id": self.id, "state": self.state, "variables": self.variables, "history": self.history,
+                "finished": self.finished}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["state"], dict(data["variables"]), list(data["history"]), data["finished"], data.get("id"))
+
+
+class Dialogue:
+    """A compiled state table; begin() and step() advance a DialogueSession"""
+
+    # Automatic transitions allowed between two user messages
+    max_hops = 100
+
+    # History events kept per session; older ones are dropped (a recorder
+    # such as chat_store.ChatStore keeps all of them)
+    history_limit = 100
+
+    # Called with (session, state name) on entering every state when set,
+    # e.g. to count which branches a load test reaches (see chat_loadtest)
+    trace = None
+
+    # recorder, when given, is told about every history line and issues the
+    # ticket numbers: recorder.selected(session, text) and
+    # recorder.ticket(session, kind) -> number (see chat_store.ChatStore)
+    def __init__(self, states, tables=None, initial="start", intents=None, recorder=None):
+        self.states = states
+        self.tables = tables or {}
+        self.initial = initial
+        self.intents = intents
+        self.recorder = recorder
+        # Canonical state names, so sessions share the table's strings
+        self._names = {name: name for name in states}
+
+    def begin(self, session):
+        """Enter the initial state; returns the output up to the first prompt"""
+        return self._run(session, self.initial, [])
+
+    def step(self, session, message):
+        """Feed one user message; returns the output up to the next prompt"""
+        if session.finished:
+            return []
+        if session.state is None:
+            return self.begin(session)
+        state = self.states[session.state]
+        key = message.strip()
+        target = self._target(state, key, session.variables)
+        if target is None and state.get("free_text") and self.intents is not None:
+            match = self.intents.match(message)
+            if match is not None:
+                text = f"User asked: {key}"
+                self._history(session, text, text)
+                session.variables.update(match.intent.variables)
+                return self._run(session, match.intent.target, [])
+        if target is None or ("values" in state and key not in state["values"]):
+            output = [state.get("invalid", INVALID) + "\n"]
+            return self._run(session, session.state, output)
+        if "store" in state:
+            session.variables[state["store"]] = state["values"][key] if "values" in state else message
+        return self._run(session, target, [])
+
+    def _target(self, state, key, variables):
+        targets = state["next"]
+        if isinstance(targets, dict):
+            targets = targets.get(key, targets.get("*"))
+            if targets is None:
+                return None
+        return self._names.get(targets.format_map(variables))
+
+    def _run(self, session, name, output):
+        # Enter states until one waits for a message (or the dialogue ends)
+        for _ in range(self.max_hops):
+            session.state = name = self._names[name]
+            state = self.states[name]
+            if self.trace is not None:
+                self.trace(session, name)
+            variables = session.variables
+            for variable, value in state.get("set", {}).items():
+                if isinstance(value, list) and value[0] == "ticket":
+                    variables[variable] = self._ticket(session, value[1])
+                else:
+                    variables[variable] = _value(value)
+            if "history" in state:
+                self._history(session, name, state["history"])
+            context = {**self.tables, **variables}
+            for line in state.get("say", ()):
+                if isinstance(line, dict) and "lookup" in line:
+                    output.append(f"{self.tables[line['lookup']][variables[line['key']]]}\n")
+                elif isinstance(line, dict) and "transfer" in line:
+                    output.append(Transfer(variables[line["transfer"]], variables.get("priority", 0)))
+                elif isinstance(line, dict):
+                    for _ in range(line["dots"]):
+                        output.append(".")
+                        output.append(Pause(line["delay"]))
+                    if line.get("newline", True):
+                        output.append("\n")
+                else:
+                    output.append(line.format_map(context) + "\n")
+            if state.get("end"):
+                session.finished = True
+                return output
+            if "prompt" in state:
+                output.append(state["prompt"].format_map(context))
+                return output
+            key = str(variables.get(state["branch"], "")) if "branch" in state else ""
+            name = self._target(state, key, variables)
+            if name is None:
+                raise KeyError(f"State {session.state!r} has no transition for {key!r}")
+        raise RuntimeError(f"No prompt within {self.max_hops} states of {session.state!r}")
+
+    def history(self, session):
+        """The session's history lines that are still kept, oldest first"""
+        states = self.states
+        return [states[code].get("history", code) if code in states else code for code in session.history]
+
+    def _history(self, session, code, text):
+        history = session.history
+        history.append(code)
+        if len(history) > self.history_limit:
+            del history[:-self.history_limit]
+        if self.recorder is not None:
+            self.recorder.selected(session, text)
+
+    def _ticket(self, session, kind):
+        if self.recorder is not None:
+            return self.recorder.ticket(session, kind)
+        return next(_TICKETS)
+
+
+def _value(spec):
+    if isinstance(spec, list):
+        kind, *args = spec
+        if kind == "randint":
+            return random.randint(*args)
+        if kind == "choice":
+            return random.choice(args[0])
+        raise ValueError(f"Unknown value generator: {kind}")
+    return spec
+
+
+def compile_dialogue(services, service_options, solutions, feature_details, compatibility_info, intents=None,
+                     recorder=None, flow=FLOW):
+    """Build the full state table from the menu tables and the handler flow"""
+    states = dict(flow)
+    choices = {key: f"service_{key}" for key in services}
+    choices["7"] = "end"
+    states["main"] = {
+        "say": ["\nPlease select from the following options:"]
+               + [f"{key}: {service}" for key, service in services.items()]
+               + ["7: End conversation"],
+        "prompt": "\nEnter your choice (1-7): ", "next": choices, "free_text": True,
+    }
+    for key, service in services.items():
+        states[f"service_{key}"] = {
+            "set": {"service": key}, "history": f"User selected: {service}",
+            "say": [f"\nYou've selected: {service}"],
+            "next": f"menu_{key}" if key in service_options else "agent",
+        }
+    for key, options in service_options.items():
+        choices = {}
+        for option_key, option in options.items():
+            if option == "Return to main menu":
+                choices[option_key] = "back_to_main"
+                continue
+            choices[option_key] = f"option_{key}_{option_key}"
+            states[f"option_{key}_{option_key}"] = {
+                "set": {"service": key}, "history": f"User selected: {option}",
+                "say": [f"\nYou've selected: {option}", "Processing your request...", TYPING],
+                "next": f"handle_{key}_{option_key}",
+            }
+        states[f"menu_{key}"] = {
+            "say": ["\nWhat specifically do you need help with?"] + [f"{k}: {o}" for k, o in options.items()],
+            "prompt": "\nEnter your choice: ", "next": choices, "free_text": True,
+        }
+    states["back_to_main"] = {"say": ["Returning to main menu..."], "next": "main"}
+
+    # Detail pages; unknown choices just skip to the follow-up question
+    for key, text in feature_details.items():
+        states[f"feature_{key}"] = {"say": [f"\n{text}"], "next": "followup"}
+    for key, text in compatibility_info.items():
+        states[f"compatibility_{key}"] = {"say": [f"\n{text}"], "next": "followup"}
+    # The table's last entry is "other systems", which asks which one
+    if compatibility_info:
+        states[f"compatibility_{list(compatibility_info)[-1]}"]["next"] = "other_system"
+    states["handle_4_1"] = dict(states["handle_4_1"],
+                                next={**{key: f"feature_{key}" for key in feature_details}, "*": "followup"})
+    states["handle_4_3"] = dict(states["handle_4_3"],
+                                next={**{key: f"compatibility_{key}" for key in compatibility_info}, "*": "followup"})
+
+    _check(states)
+    answers = intents.answers if intents is not None else {}
+    return Dialogue(states, {"solutions": solutions, "articles": answers}, intents=intents, recorder=recorder)
+
+
+def _check(states):
+    # Every fixed target must exist, so typos fail at build time instead of mid-conversation
+    for name, state in states.items():
+        targets = state.get("next", {})
+        for target in (targets.values() if isinstance(targets, dict) else [targets]):
+            if "{" not in target and target not in states:
+                raise ValueError(f"State {name!r} points to unknown state {target!r}")
+        if "prompt" not in state and "next" not in state and not state.get("end"):
+            raise ValueError(f"State {name!r} has no way out")
@@ -0,0 +1,209 @@
+import argparse
+import collections
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+STOPWORDS = frozenset("""
+a about am an and any are as at be been but by can cant could do does doesnt dont for from get got had has have
+help how i im in is isnt it its me my need no not of on or please so that the there this to up was we what when
+where which why will with wont would you your
+""".split())
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# A matched intent: the dialogue state to enter and the variables to set on the way
+Intent = collections.namedtuple("Intent", "target text variables")
+Match = collections.namedtuple("Match", "intent score")
+
+
+def _stem(word):
+    # Just enough suffix stripping that "logging"/"logs"/"log",
+    # "charged"/"charges"/"charge" or "installation"/"install" meet
+    for suffix, replacement in (("ies", "y"), ("ation", ""), ("ing", ""), ("ed", ""), ("es", ""), ("s", "")):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("ss"):
+            word = word[:-len(suffix)] + replacement
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiousl":
+                word = word[:-1]
+            break
+    if len(word) > 4 and word.endswith("e"):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    words = _WORD.findall(text.lower().replace("'", ""))
+    return [_stem(word) for word in words if word not in STOPWORDS]
+
+
+class IntentIndex:
+    # TF-IDF over short intent texts, stored as an inverted index: for every
+    # term the documents containing it and their weights, one flat NumPy
+    # array for all terms with an offset table. Scoring a message gathers the
+    # postings of its terms and sums them per document with np.bincount, so
+    # a lookup costs the postings it touches rather than a pass over every
+    # document. Documents are L2 normalized, so scores are cosine similarities.
+    def __init__(self, intents, min_score=0.25):
+        self.intents = list(intents)
+        self.min_score = min_score
+        self.answers = {}
+        vocabulary = {}
+        doc_ids, term_ids, counts = [], [], []
+        for doc, intent in enumerate(self.intents):
+            for term, count in collections.Counter(tokenize(intent.text)).items():
+                doc_ids.append(doc)
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                counts.append(count)
+        self.vocabulary = vocabulary
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        counts = np.asarray(counts, dtype=np.float64)
+
+        documents = len(self.intents)
+        frequency = np.bincount(term_ids, minlength=len(vocabulary))
+        self.idf = np.log((1 + documents) / (1 + frequency)) + 1
+        weights = (1 + np.log(counts)) * self.idf[term_ids]
+        norms = np.sqrt(np.bincount(doc_ids, weights=weights ** 2, minlength=documents))
+        weights /= np.maximum(norms, 1e-12)[doc_ids]
+
+        order = np.argsort(term_ids, kind="stable")
+        self._docs = doc_ids[order]
+        self._weights = weights[order].astype(np.float32)
+        self._offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(frequency, out=self._offsets[1:])
+
+    def __len__(self):
+        return len(self.intents)
+
+    def scores(self, text):
+        # Cosine similarity of the message to every document
+        terms = collections.Counter(self.vocabulary[t] for t in tokenize(text) if t in self.vocabulary)
+        if not terms:
+            return np.zeros(len(self.intents))
+        ids = np.fromiter(terms, dtype=np.int64, count=len(terms))
+        query = (1 + np.log(np.fromiter(terms.values(), dtype=np.float64, count=len(terms)))) * self.idf[ids]
+        query /= np.linalg.norm(query)
+        starts, stops = self._offsets[ids], self._offsets[ids + 1]
+        lengths = stops - starts
+        # Positions of all postings of the query terms in one vector
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.bincount(self._docs[positions], weights=self._weights[positions] * np.repeat(query, lengths),
+                           minlength=len(self.intents))
+
+    def search(self, text, limit=5):
+        scores = self.scores(text)
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [Match(self.intents[doc], float(scores[doc])) for doc in top if scores[doc] > 0]
+
+    def match(self, text):
+        # Best intent, or None when nothing scores min_score
+        scores = self.scores(text)
+        if not len(scores):
+            return None
+        best = int(np.argmax(scores))
+        if scores[best] < self.min_score:
+            return None
+        return Match(self.intents[best], float(scores[best]))
+
+
+def load_knowledge_base(path):
+    # Articles from disk as {id: {"title", "answer", "keywords"}}. Accepts a
+    # JSON object of id -> answer (the tech_solutions layout) or id -> article,
+    # a JSON list of articles with an "id", or JSON lines of articles.
+    with open(path, encoding="utf-8") as f:
+        if os.path.splitext(path)[1].lower() == ".jsonl":
+            data = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+    if isinstance(data, dict):
+        data = [dict(article, id=key) if isinstance(article, dict) else {"id": key, "answer": article}
+                for key, article in data.items()]
+    articles = {}
+    for article in data:
+        key = str(article["id"])
+        answer = article.get("answer") or article.get("text")
+        if not answer:
+            raise ValueError(f"Article {key!r} in {path} has no answer")
+        articles[key] = {"title": article.get("title") or key.replace("_", " ").title(), "answer": answer,
+                         "keywords": article.get("keywords", "")}
+    return articles
+
+
+def build_intents(services, service_options, phrases=None, articles=None, min_score=0.25):
+    """Intents for the main menu, every service menu item and the knowledge base articles"""
+    phrases = phrases or {}
+    intents = []
+    for key, service in services.items():
+        target = f"service_{key}"
+        intents.append(Intent(target, f"{service} {phrases.get(target, '')}", {}))
+    intents.append(Intent("end", f"End conversation {phrases.get('end', '')}", {}))
+    for key, options in service_options.items():
+        for option_key, option in options.items():
+            if option == "Return to main menu":
+                continue
+            target = f"option_{key}_{option_key}"
+            intents.append(Intent(target, f"{option} {services[key]} {phrases.get(target, '')}", {}))
+    for key, article in (articles or {}).items():
+        keywords = article.get("keywords", "")
+        if isinstance(keywords, list):
+            keywords = " ".join(keywords)
+        # The title counts twice, the way a heading outweighs body text
+        text = f"{article['title']} {article['title']} {keywords} {article['answer']}"
+        intents.append(Intent("article", text, {"article": key}))
+    index = IntentIndex(intents, min_score)
+    # Answer texts for the dialogue's "article" state
+    index.answers = {key: article["answer"] for key, article in (articles or {}).items()}
+    return index
+
+
+def _synthetic_articles(count, seed=0):
+    # Random articles over a large vocabulary, for timing lookups
+    rng = np.random.default_rng(seed)
+    words = [f"term{i}" for i in range(20000)]
+    return {f"kb{i}": {"title": " ".join(rng.choice(words, 4)), "answer": " ".join(rng.choice(words, 80))}
+            for i in range(count)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Free-text intent matching for the support chatbot")
+    parser.add_argument("queries", nargs="*", help="messages to match")
+    parser.add_argument("--knowledge-base", help="JSON/JSONL articles to index next to the menus")
+    parser.add_argument("--bench", type=int, nargs="*", metavar="ARTICLES",
+                        help="time lookups with this many synthetic articles (default 100 1000 10000)")
+    args = parser.parse_args()
+
+    from python_chat import CustomerSupportChatbot
+    bot = CustomerSupportChatbot
+    if args.bench is not None:
+        queries = ["can't log in", "dispute a charge on my bill", "app keeps crashing", "term17 term9001 term42"]
+        for count in args.bench or (100, 1000, 10000):
+            articles = {**bot.knowledge_base(), **_synthetic_articles(count)}
+            start = time.perf_counter()
+            index = build_intents(bot.services, bot.service_options, bot.intent_phrases, articles)
+            built = time.perf_counter() - start
+            rounds = 2000
+            start = time.perf_counter()
+            for i in range(rounds):
+                index.match(queries[i % len(queries)])
+            per_query = (time.perf_counter() - start) / rounds
+            print(f"{len(index):6d} intents  build {built * 1000:8.1f} ms  match {per_query * 1e6:7.1f} us")
+        return
+
+    articles = dict(bot.knowledge_base())
+    if args.knowledge_base:
+        articles.update(load_knowledge_base(args.knowledge_base))
+    index = build_intents(bot.services, bot.service_options, bot.intent_phrases, articles)
+    for query in args.queries:
+        print(f"{query!r}")
+        for intent, score in index.search(query, 3):
+            detail = f" ({intent.variables['article']})" if intent.variables else ""
+            print(f"  {score:.3f}  {intent.target}{detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import collections
+import copy
+import json
+import os
+import platform
+import random
+import re
+import time
+import tracemalloc
+
+import numpy as np
+
+from chat_agents import AgentRouter, default_agents
+from chat_server import ChatServer
+from chat_store import ChatStore
+from python_chat import CustomerSupportChatbot
+
+# Menu entries are "1: ..." lines; a few menus number them "1. ..." instead
+_OPTION = re.compile(r"^(\d+): (.*)$", re.M)
+_NUMBERED = re.compile(r"^(\d+)\. (.*)$", re.M)
+
+# Replies to prompts that ask for text rather than a menu number
+ANSWERS = {
+    "Your name:": "{user}",
+    "Date (YYYY-MM-DD):": "2025-03-01",
+    "Staff name (or leave blank if unknown):": "",
+    "Product name:": "Smart Hub",
+    "Please specify (or type 'all' if everything is affected):": "all",
+    "Please specify your system:": "Linux",
+    "Error code/message:": "E1042 connection reset",
+    "Press Enter to return to the main menu...": "",
+}
+DEFAULT_ANSWER = "It stopped working after the last update"
+
+# What users type at a menu instead of a number now and then: questions the
+# intent index should route, and noise it should reject
+QUESTIONS = ["I can't log in", "there is a wrong charge on my bill", "the app keeps crashing",
+             "how much does the premium plan cost", "I want to talk to a real person", "is it compatible with mac",
+             "my product arrived broken", "I forgot my password", "asdf", "?"]
+
+# Menu entries that lead out of the conversation, best first
+WAY_OUT = ("End conversation", "Return to main menu", "No")
+
+# Chatbot modules, for the share of memory held by the sessions themselves
+_SESSION_FILES = {"python_chat.py", "chat_dialogue.py", "chat_server.py", "chat_store.py", "chat_intents.py"}
+
+
+class VirtualUser:
+    # One client. Replies come from the script while it lasts, then from a
+    # random walk: a random menu entry (or, with probability free_text, a
+    # typed question), canned text at free-text prompts, and after `steps`
+    # replies the way out of every menu. max_replies cuts off a user that
+    # never gets out, which is counted as abandoned.
+    def __init__(self, name, prompts, rng, script=(), steps=30, free_text=0.05, think=0.0):
+        self.name = name
+        self.prompts = prompts
+        self.rng = rng
+        self.script = list(script)
+        self.steps = steps
+        self.free_text = free_text
+        self.think = think
+        self.replies = 0
+        self.max_replies = steps * 5 + len(self.script)
+
+    def reply(self, text, prompt):
+        """The next message, given the bot's output ending in prompt"""
+        self.replies += 1
+        if self.replies <= len(self.script):
+            return self.script[self.replies - 1].format(user=self.name)
+        options = _OPTION.findall(text) or _NUMBERED.findall(text)
+        if not options:
+            return ANSWERS.get(prompt.strip(), DEFAULT_ANSWER).format(user=self.name)
+        if self.replies > self.steps:
+            for way_out in WAY_OUT:
+                for key, label in options:
+                    if label.startswith(way_out):
+                        return key
+        if self.rng.random() < self.free_text:
+            return self.rng.choice(QUESTIONS)
+        return self.rng.choice(options)[0]
+
+    async def run(self, host, port, latencies):
+        """Hold one conversation; returns True when the bot ended it"""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            text, prompt = await read_reply(reader, self.prompts)
+            while prompt is not None:
+                if self.replies >= self.max_replies:
+                    return False
+                line = self.reply(text, prompt)
+                if self.think:
+                    await asyncio.sleep(self.rng.expovariate(1 / self.think))
+                sent = time.perf_counter()
+                writer.write((line + "\n").encode())
+                text, prompt = await read_reply(reader, self.prompts)
+                latencies.append(time.perf_counter() - sent)
+            return True
+        finally:
+            writer.close()
+
+
+async def read_reply(reader, prompts):
+    # Output up to the next prompt as (text, prompt), or (text, None) once the
+    # server closes the connection
+    data = b""
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            return data.decode(errors="replace"), None
+        data += chunk
+        for prompt in prompts:
+            if data.endswith(prompt):
+                return data.decode(errors="replace"), prompt.decode()
+
+
+def dialogue_prompts(bot):
+    """Every prompt of the bot's dialogue as bytes, longest first"""
+    prompts = {state["prompt"].encode() for state in bot.dialogue.states.values() if "prompt" in state}
+    return sorted(prompts, key=len, reverse=True)
+
+
+def load_scripts(path):
+    # One JSON list of replies per line; "{user}" becomes the user's name
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _traced_factory(visits):
+    # Bots whose dialogue counts every state it enters. Each bot gets a
+    # shallow copy (sharing the state tables) so the cached dialogue other
+    # bots use is never traced
+    def count(session, state):
+        visits[state] += 1
+
+    class TracedChatbot(CustomerSupportChatbot):
+        __slots__ = ()
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.dialogue = copy.copy(self.dialogue)
+            self.dialogue.trace = count
+    return TracedChatbot
+
+
+def _raise_file_limit(connections):
+    # Both ends of every loopback connection are open in this process
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 2 * connections + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard),
+                                                    hard))
+
+
+def _percentiles_ms(samples):
+    samples = np.asarray(samples) * 1000
+    if not len(samples):
+        return {}
+    return {"mean": float(samples.mean()), "p50": float(np.percentile(samples, 50)),
+            "p90": float(np.percentile(samples, 90)), "p99": float(np.percentile(samples, 99)),
+            "max": float(samples.max())}
+
+
+async def run_load(users=2000, concurrency=500, steps=30, free_text=0.05, think=0.0, typing_delay=0.0, scripts=None,
+                   seed=0, knowledge_base=None, store=None, router=None):
+    """Run `users` virtual users, at most `concurrency` at a time, against an in-process ChatServer"""
+    _raise_file_limit(concurrency)
+    visits = collections.Counter()
+    # Headroom for sessions whose client has already given up
+    server = ChatServer(_traced_factory(visits), idle_timeout=60, max_sessions=2 * concurrency,
+                        typing_delay=typing_delay, knowledge_base=knowledge_base, store=store, router=router)
+    host, port = await server.start(port=0)
+    bot = CustomerSupportChatbot(intents=server.intents)
+    prompts = dialogue_prompts(bot)
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+    active = peak = 0
+
+    async def user(i):
+        nonlocal active, peak
+        script = scripts[i % len(scripts)] if scripts else ()
+        async with slots:
+            active += 1
+            peak = max(peak, active)
+            try:
+                return await VirtualUser(f"user{i}", prompts, random.Random(seed * 1000003 + i), script, steps,
+                                         free_text, think).run(host, port, latencies)
+            finally:
+                active -= 1
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(user(i) for i in range(users)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await server.stop()
+
+    errors = collections.Counter(type(outcome).__name__ for outcome in outcomes if isinstance(outcome, BaseException))
+    completed = sum(outcome is True for outcome in outcomes)
+    missed = sorted(set(bot.dialogue.states) - set(visits))
+    return {
+        "users": users,
+        "concurrency": concurrency,
+        "peak_concurrent": peak,
+        "elapsed_s": elapsed,
+        "completed": completed,
+        "abandoned": sum(outcome is False for outcome in outcomes),
+        "client_errors": dict(errors),
+        "server": server.stats(),
+        "sessions_per_s": completed / elapsed,
+        "replies": len(latencies),
+        "replies_per_s": len(latencies) / elapsed,
+        "reply_ms": _percentiles_ms(latencies),
+        "states_visited": len(bot.dialogue.states) - len(missed),
+        "states": len(bot.dialogue.states),
+        "states_missed": missed,
+        "agents": server.router.stats(),
+    }
+
+
+async def _held_user(host, port, name, prompts, held, release):
+    # Get to the main menu, then stay connected until released
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await read_reply(reader, prompts)
+        writer.write(f"{name}\n".encode())
+        await read_reply(reader, prompts)
+        held.append(name)
+        await release.wait()
+    finally:
+        writer.close()
+
+
+async def measure_memory(sessions=1000, knowledge_base=None, store=None):
+    """Traced memory per open session, with `sessions` users waiting at the main menu"""
+    _raise_file_limit(sessions)
+    server = ChatServer(idle_timeout=60, max_sessions=sessions, typing_delay=0.0, knowledge_base=knowledge_base,
+                        store=store)
+    host, port = await server.start(port=0)
+    prompts = dialogue_prompts(CustomerSupportChatbot(intents=server.intents))
+    held, release = [], asyncio.Event()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    users = [asyncio.create_task(_held_user(host, port, f"user{i}", prompts, held, release)) for i in range(sessions)]
+    while len(held) < sessions and not any(task.done() for task in users):
+        await asyncio.sleep(0.05)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    release.set()
+    await asyncio.gather(*users, return_exceptions=True)
+    await server.stop()
+
+    total = bots = 0
+    for stat in after.compare_to(before, "filename"):
+        total += stat.size_diff
+        if os.path.basename(stat.traceback[0].filename) in _SESSION_FILES:
+            bots += stat.size_diff
+    # Client and server ends of the connections are both in the total
+    return {"sessions": len(held), "bytes_per_session": total / max(len(held), 1),
+            "chatbot_bytes_per_session": bots / max(len(held), 1)}
+
+
+def measure_session_state(sessions=10000, replies=20, seed=0):
+    """Traced memory per chatbot session after `replies` random replies, without connections"""
+    # The tables and compiled dialogue are shared, so they are allocated here, before tracing
+    template = CustomerSupportChatbot()
+    intents, router = template.dialogue.intents, AgentRouter(default_agents())
+    prompts = [prompt.decode() for prompt in dialogue_prompts(template)]
+    bots = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(sessions):
+        bot = CustomerSupportChatbot(typing_delay=0.0, intents=intents, router=router)
+        user = VirtualUser(f"user{i}", prompts, random.Random(seed * 1000003 + i), steps=replies)
+        output = bot.begin()
+        while not bot.session.finished and user.replies < replies:
+            text = "".join(item for item in output if isinstance(item, str))
+            prompt = next(prompt for prompt in prompts if text.endswith(prompt))
+            output = bot.step(user.reply(text, prompt))
+        bots.append(bot)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    # One long conversation going round the account menu, to show how far its history grows
+    bot = CustomerSupportChatbot(typing_delay=0.0, intents=intents, router=router)
+    bot.begin()
+    bot.step("user")
+    for _ in range(2000):
+        for message in ("1", "1", "2", "2", "4"):
+            bot.step(message)
+    return {"sessions": sessions, "replies": replies, "bytes_per_session": size / sessions,
+            "history_after_10000_replies": len(bot.conversation_history)}
+
+
+def _environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def _print_report(load, memory, state):
+    print(f"{load['completed']}/{load['users']} sessions in {load['elapsed_s']:.2f} s  "
+          f"{load['sessions_per_s']:.1f} sessions/s  {load['replies_per_s']:.0f} replies/s  "
+          f"(concurrency {load['concurrency']}, peak {load['peak_concurrent']})")
+    reply = load["reply_ms"]
+    if reply:
+        print(f"reply latency  p50 {reply['p50']:.2f} ms  p90 {reply['p90']:.2f} ms  p99 {reply['p99']:.2f} ms  "
+              f"max {reply['max']:.2f} ms")
+    server = load["server"]
+    print(f"abandoned {load['abandoned']}  client errors {load['client_errors'] or 0}  "
+          f"server failed {server['failed']}  rejected {server['rejected']}")
+    agents = load["agents"]
+    print(f"agent queue  served {agents['served']}  mean wait {agents['mean_wait_s'] * 1000:.1f} ms  "
+          f"longest {agents['longest_wait_s'] * 1000:.1f} ms  ({agents['agents']} agents)")
+    print(f"states visited {load['states_visited']}/{load['states']}"
+          + (f"  never reached: {', '.join(load['states_missed'])}" if load["states_missed"] else ""))
+    if memory:
+        print(f"memory  {memory['bytes_per_session'] / 1024:.1f} KiB per open session, "
+              f"{memory['chatbot_bytes_per_session'] / 1024:.1f} KiB of it chatbot state "
+              f"({memory['sessions']} sessions at the main menu)")
+    if state:
+        print(f"session state  {state['bytes_per_session']:.0f} bytes per session after {state['replies']} replies "
+              f"({state['sessions']} sessions), history capped at {state['history_after_10000_replies']} events "
+              f"after 10000 replies")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chatbot server with scripted or random virtual users")
+    parser.add_argument("--users", type=int, default=2000, help="conversations to run")
+    parser.add_argument("--concurrency", type=int, default=500, help="virtual users connected at once")
+    parser.add_argument("--steps", type=int, default=30, help="random replies before a user heads for the exit")
+    parser.add_argument("--free-text", type=float, default=0.05, help="chance of typing a question at a menu")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds a user waits before replying")
+    parser.add_argument("--typing-delay", type=float, default=0.0, help="bot seconds per typing dot")
+    parser.add_argument("--script", help="JSON lines, each a list of replies to replay before the random walk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--knowledge-base", help="JSON/JSONL help articles for the server")
+    parser.add_argument("--store", help="SQLite file to record sessions and tickets in")
+    parser.add_argument("--agents", type=int, default=5, help="simulated agents per department")
+    parser.add_argument("--generalists", type=int, default=2, help="simulated agents who take every department")
+    parser.add_argument("--handle-time", type=float, default=0.05,
+                        help="mean seconds an agent spends per session (reply latency includes agent waits)")
+    parser.add_argument("--memory-sessions", type=int, default=1000,
+                        help="open sessions for the memory measurement (0 skips it)")
+    parser.add_argument("--state-sessions", type=int, default=10000,
+                        help="sessions for the connection-free session state measurement (0 skips it)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    parser.add_argument("-o", "--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    scripts = load_scripts(args.script) if args.script else None
+    store = ChatStore(args.store) if args.store else None
+    router = AgentRouter(default_agents(args.agents, args.generalists), service_time=args.handle_time,
+                         handle_time=args.handle_time, seed=args.seed)
+    try:
+        load = asyncio.run(run_load(args.users, args.concurrency, args.steps, args.free_text, args.think,
+                                    args.typing_delay, scripts, args.seed, args.knowledge_base, store, router))
+        memory = None
+        if args.memory_sessions:
+            memory = asyncio.run(measure_memory(args.memory_sessions, args.knowledge_base, store))
+        state = measure_session_state(args.state_sessions) if args.state_sessions else None
+    finally:
+        if store is not None:
+            store.close()
+
+    report = {"benchmark": "chat_load", "environment": _environment(),
+              "results": {"load": load, "memory": memory, "state": state}}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(load, memory, state)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+from chat_agents import AgentRouter, default_agents
+from chat_intents import load_knowledge_base
+from chat_store import ChatStore
+from python_chat import CustomerSupportChatbot
+
+_log = logging.getLogger(__name__)
+
+
+class StreamChannel:
+    """Line protocol over an asyncio stream: UTF-8 text out, one reply per line in"""
+
+    def __init__(self, reader, writer, idle_timeout=None):
+        self.reader = reader
+        self.writer = writer
+        self.idle_timeout = idle_timeout
+
+    def write(self, text):
+        # Lines are LF terminated; writes are buffered and flushed before
+        # every read, so a slow client only holds up its own session
+        self.writer.write(text.encode())
+
+    @property
+    def closed(self):
+        # The client hung up (and everything it sent has been read)
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    async def read_line(self, prompt):
+        """Send the prompt and wait for the next line (EOFError on disconnect or idle timeout)"""
+        self.writer.write(prompt.encode())
+        await self.writer.drain()
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            self.write("\nSession closed after being idle.\n")
+            raise EOFError("idle timeout")
+        if not line:
+            raise EOFError("client disconnected")
+        return line.decode(errors="replace").rstrip("\r\n")
+
+
+class ChatServer:
+    """Hosts one CustomerSupportChatbot per TCP connection in a single event loop"""
+
+    def __init__(self, bot_factory=CustomerSupportChatbot, idle_timeout=600, max_sessions=10000, typing_delay=0.5,
+                 knowledge_base=None, store=None, router=None):
+        self.bot_factory = bot_factory
+        self.store = store
+        # One agent pool and set of queues for every session
+        self.router = router or AgentRouter(default_agents(), handle_time=300)
+        # One free-text index for every session, with the articles of the knowledge base file
+        articles = load_knowledge_base(knowledge_base) if knowledge_base else None
+        self.intents = bot_factory.build_intents(articles)
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.typing_delay = typing_delay
+        self.sessions = {}
+        self.started = 0
+        self.finished = 0
+        self.failed = 0
+        self.rejected = 0
+        self._ids = itertools.count(1)
+        self._server = None
+
+    async def handle(self, reader, writer):
+        """Run a whole conversation for one client"""
+        if len(self.sessions) >= self.max_sessions:
+            self.rejected += 1
+            writer.write(b"All agents are busy, please try again later.\n")
+            await self._close(writer)
+            return
+        session_id = next(self._ids)
+        channel = StreamChannel(reader, writer, self.idle_timeout)
+        bot = self.bot_factory(channel, typing_delay=self.typing_delay, intents=self.intents, store=self.store,
+                               router=self.router)
+        self.sessions[session_id] = bot
+        self.started += 1
+        try:
+            await bot.start()
+            self.finished += 1
+        except (EOFError, ConnectionError):
+            self.finished += 1
+        except Exception as exc:
+            # A broken conversation ends its own session, never the server
+            self.failed += 1
+            channel.write(f"\nSorry, something went wrong ({type(exc).__name__}). Please reconnect.\n")
+        finally:
+            # close() saves unfinished sessions to the store, which raises once
+            # its writer has failed; the session must still end here
+            try:
+                bot.close()
+            except Exception:
+                _log.exception("Could not close session %s", session_id)
+            del self.sessions[session_id]
+            await self._close(writer)
+
+    async def _close(self, writer):
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def start(self, host="127.0.0.1", port=8765, backlog=1024):
+        self._server = await asyncio.start_server(self.handle, host, port, backlog=backlog)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def stats(self):
+        stats = {"active": len(self.sessions), "started": self.started, "finished": self.finished,
+                 "failed": self.failed, "rejected": self.rejected}
+        router = self.router.stats()
+        stats.update(agents_busy=router["agents_busy"], agent_queue=router["waiting"],
+                     agent_wait_s=round(router["mean_wait_s"], 3))
+        if self.store is not None:
+            stats.update(store_backlog=self.store.queued - self.store.committed, store_commits=self.store.commits)
+        return stats
+
+
+async def _report(server, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(time.strftime("%H:%M:%S"), server.stats(), flush=True)
+
+
+async def _serve(args, store):
+    router = AgentRouter(default_agents(args.agents, args.generalists), handle_time=args.handle_time)
+    server = ChatServer(idle_timeout=args.idle_timeout, max_sessions=args.max_sessions,
+                        typing_delay=args.typing_delay, knowledge_base=args.knowledge_base, store=store, router=router)
+    host, port = await server.start(args.host, args.port)
+    print(f"Chat server listening on {host}:{port} (connect with e.g. `nc {host} {port}`)", flush=True)
+    if args.stats_interval:
+        asyncio.create_task(_report(server, args.stats_interval))
+    await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Customer support chatbot server, one session per connection")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-sessions", type=int, default=10000, help="concurrent conversations")
+    parser.add_argument("--idle-timeout", type=float, default=600, help="seconds before a silent session is closed")
+    parser.add_argument("--typing-delay", type=float, default=0.5, help="seconds per simulated typing dot")
+    parser.add_argument("--knowledge-base", help="JSON/JSONL help articles to answer free-text questions from")
+    parser.add_argument("--store", help="SQLite file for conversation history and tickets")
+    parser.add_argument("--agents", type=int, default=2, help="simulated agents per department")
+    parser.add_argument("--generalists", type=int, default=1, help="simulated agents who take every department")
+    parser.add_argument("--handle-time", type=float, default=300, help="mean seconds an agent spends per session")
+    parser.add_argument("--stats-interval", type=float, default=0, help="print session counts every N seconds")
+    args = parser.parse_args()
+    store = ChatStore(args.store) if args.store else None
+    try:
+        asyncio.run(_serve(args, store))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if store is not None:
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
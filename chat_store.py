@@ -0,0 +1,244 @@
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user_name TEXT,
+    started REAL NOT NULL,
+    updated REAL NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0,
+    state TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_name);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    at REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_session ON events (session_id, id);
+CREATE TABLE IF NOT EXISTS tickets (
+    number INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_name TEXT,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS tickets_user ON tickets (user_name);
+CREATE INDEX IF NOT EXISTS tickets_session ON tickets (session_id);
+"""
+
+_STATEMENTS = {
+    "session": "INSERT INTO sessions (id, user_name, started, updated, finished, state) VALUES (?, ?, ?, ?, ?, ?) "
+               "ON CONFLICT (id) DO UPDATE SET user_name = excluded.user_name, updated = excluded.updated, "
+               "finished = excluded.finished, state = excluded.state",
+    "event": "INSERT INTO events (session_id, at, text) VALUES (?, ?, ?)",
+    "ticket": "INSERT INTO tickets (number, session_id, user_name, kind, created, details) VALUES (?, ?, ?, ?, ?, ?)",
+}
+
+# First ticket number of an empty store
+FIRST_TICKET = 100001
+
+# Marks the end of the writer's rows
+_END = object()
+
+
+class ChatStore:
+    # Conversation history, sessions and tickets in SQLite. Writes never touch
+    # the database on the caller's thread: rows go into a queue and a writer
+    # thread commits whatever has accumulated within linger seconds in one
+    # transaction (group commit), so the cost per reply is an append. Ticket
+    # numbers come from a counter seeded with the largest stored number, so
+    # they are unique across restarts (the number is the tickets table's
+    # primary key); only one process may write to a store at a time.
+    #
+    # Used as the dialogue's recorder: selected() logs history lines, ticket()
+    # issues a number and stores it with the session's variables.
+    def __init__(self, path, batch_size=1000, linger=0.01):
+        self.path = path
+        self.batch_size = batch_size
+        # Seconds the writer waits for more rows before a commit
+        self.linger = linger
+        self.queued = 0
+        self.committed = 0
+        self.commits = 0
+        self.error = None
+        with contextlib.closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            last = conn.execute("SELECT MAX(number) FROM tickets").fetchone()[0]
+        self._tickets = itertools.count(FIRST_TICKET if last is None else last + 1)
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    # Recorder interface
+
+    def selected(self, session, text):
+        self._put("event", (session.id, time.time(), text))
+
+    def ticket(self, session, kind):
+        number = next(self._tickets)
+        details = json.dumps({key: value for key, value in session.variables.items() if key != "user_name"})
+        self._put("ticket", (number, session.id, session.variables.get("user_name"), kind, time.time(), details))
+        return number
+
+    def save_session(self, session, started=None):
+        """Queue a snapshot of the session (insert or update)"""
+        now = time.time()
+        state = json.dumps(session.to_dict())
+        self._put("session", (session.id, session.variables.get("user_name"), started or now, now,
+                              int(session.finished), state))
+
+    # Writer
+
+    def _put(self, kind, row):
+        with self._cond:
+            if self.error is not None:
+                raise self.error
+            if self._closed:
+                raise ValueError("Store is closed")
+            self._pending.append((kind, row))
+            self.queued += 1
+            self._cond.notify_all()
+
+    def _take(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            if self.linger and not self._closed:
+                self._cond.wait_for(lambda: len(self._pending) >= self.batch_size or self._closed, self.linger)
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popleft())
+            return batch
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                batch = self._take()
+                done = batch[-1] is _END
+                if done:
+                    batch.pop()
+                rows = collections.defaultdict(list)
+                for kind, row in batch:
+                    rows[kind].append(row)
+                with conn:
+                    for kind in ("session", "event", "ticket"):
+                        if rows[kind]:
+                            conn.executemany(_STATEMENTS[kind], rows[kind])
+                with self._cond:
+                    self.committed += len(batch)
+                    self.commits += 1
+                    self._cond.notify_all()
+                if done:
+                    break
+        except Exception as exc:
+            with self._cond:
+                self.error = exc
+                self._pending.clear()
+                self._cond.notify_all()
+        finally:
+            conn.close()
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is committed"""
+        with self._cond:
+            target = self.queued
+            if not self._cond.wait_for(lambda: self.committed >= target or self.error is not None, timeout):
+                raise TimeoutError("Store writer is behind")
+            if self.error is not None:
+                raise self.error
+
+    def close(self):
+        with self._cond:
+            if not self._closed:
+                self._closed = True
+                self._pending.append(_END)
+                self._cond.notify_all()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Lookups (committed rows only; call flush() first to include queued ones)
+
+    def _query(self, sql, args):
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, args)]
+
+    def find_ticket(self, number):
+        rows = self._query("SELECT * FROM tickets WHERE number = ?", (number,))
+        return _with_details(rows[0]) if rows else None
+
+    def tickets_for_user(self, user_name):
+        return [_with_details(row) for row in
+                self._query("SELECT * FROM tickets WHERE user_name = ? ORDER BY number", (user_name,))]
+
+    def sessions_for_user(self, user_name):
+        return self._query("SELECT id, user_name, started, updated, finished FROM sessions WHERE user_name = ? "
+                           "ORDER BY started", (user_name,))
+
+    def history(self, session_id):
+        return self._query("SELECT at, text FROM events WHERE session_id = ? ORDER BY id", (session_id,))
+
+    def load_session(self, session_id):
+        """The session's last snapshot as DialogueSession.to_dict() data, or None"""
+        rows = self._query("SELECT state FROM sessions WHERE id = ?", (session_id,))
+        return json.loads(rows[0]["state"]) if rows and rows[0]["state"] else None
+
+
+def _with_details(row):
+    row["details"] = json.loads(row["details"]) if row["details"] else {}
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up stored chatbot sessions and tickets")
+    parser.add_argument("database", help="SQLite file written by the chatbot")
+    parser.add_argument("--user", help="sessions and tickets of this user name")
+    parser.add_argument("--ticket", type=int, help="one ticket by number")
+    parser.add_argument("--session", help="history of one session")
+    args = parser.parse_args()
+    # ChatStore creates a missing database, which a lookup never should
+    if not os.path.isfile(args.database):
+        parser.error(f"no such database: {args.database}")
+    store = ChatStore(args.database)
+    try:
+        if args.ticket is not None:
+            print(json.dumps(store.find_ticket(args.ticket), indent=2))
+        if args.user:
+            print(json.dumps({"sessions": store.sessions_for_user(args.user),
+                              "tickets": store.tickets_for_user(args.user)}, indent=2))
+        if args.session:
+            for event in store.history(args.session):
+                print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event["at"])), event["text"])
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
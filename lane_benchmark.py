@@ -0,0 +1,552 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from Road_Lane_Detection import (PREPROCESS_MODES, CannyThresholds, LaneDetector, LaneTracker,
+                                 MultiScaleLaneDetector, StageTimer, thread_detector)
+from lane_curved import CurvedLaneDetector
+from lane_pipeline import LanePipeline
+from lane_shm import LaneProcessPool
+from lane_synthetic import CONDITIONS, road_frames, scene_sequence
+
+# Detector configurations the pipeline benchmark can compare
+VARIANTS = {
+    "default": lambda: LaneDetector(),
+    "crop_roi": lambda: LaneDetector(crop_roi=True),
+    "tracking": lambda: LaneDetector(tracker=LaneTracker()),
+    "native": lambda: LaneDetector(size=None),
+    "fused": lambda: LaneDetector(preprocess="fused"),
+    "lab": lambda: LaneDetector(preprocess="lab"),
+    "aspect": lambda: LaneDetector(size=640),
+    "pyramid": lambda: MultiScaleLaneDetector(320),
+    "pyramid_coarse": lambda: MultiScaleLaneDetector(320, refine=False),
+    "curved": lambda: CurvedLaneDetector(),
+    "pipeline": lambda: LanePipeline.from_config(),
+}
+
+STAGES = ("resize", "clahe", "color_mask", "gray", "blur", "median", "canny", "roi",
+          "hough", "classification", "track", "refine", "drawing", "blend")
+
+
+def _time_per_call(func, args_list, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for args in args_list:
+            func(*args)
+    return (time.perf_counter() - start) / (repeat * len(args_list))
+
+
+def bench_thresholds(frames=20, width=640, height=480, repeat=20):
+    # Latency of each auto-Canny strategy, plus how far its edge map drifts
+    # from the np.median baseline inside the ROI. "masked" uses the pipeline's
+    # blurred color-masked image (mostly zeros), "dense" a blurred plain
+    # grayscale frame, where np.median has to partition real data.
+    detector = LaneDetector(size=(width, height))
+    datasets = {"masked": [], "dense": []}
+    for frame in road_frames(frames, width, height):
+        detector.find_lanes(frame)
+        datasets["masked"].append(detector.buffers(height, width).blur.copy())
+        # The working-size frame, which buf.resized only holds when a resize ran
+        gray = cv2.cvtColor(detector.stage_images()["resized"], cv2.COLOR_BGR2GRAY)
+        datasets["dense"].append(cv2.GaussianBlur(gray, (7, 7), 0))
+    roi_mask = detector.buffers(height, width).roi_mask
+
+    return {name: _bench_threshold_strategies(blurs, roi_mask, repeat)
+            for name, blurs in datasets.items()}
+
+
+def _bench_threshold_strategies(blurs, roi_mask, repeat):
+    strategies = {
+        "median": lambda: CannyThresholds("median"),
+        "histogram": lambda: CannyThresholds("histogram"),
+        "median_roi": lambda: CannyThresholds("median", roi_only=True),
+        "histogram_roi": lambda: CannyThresholds("histogram", roi_only=True),
+        "histogram_refresh10": lambda: CannyThresholds("histogram", refresh=10),
+    }
+
+    baseline = CannyThresholds("median")
+    baseline_edges = [cv2.Canny(blur, *baseline(blur, roi_mask)) & roi_mask for blur in blurs]
+
+    results = {}
+    for name, make in strategies.items():
+        thresholds = make()
+        seconds = _time_per_call(thresholds, [(blur, roi_mask) for blur in blurs], repeat)
+
+        thresholds = make()
+        identical = 0
+        mismatch = 0
+        total = 0
+        for blur, expected in zip(blurs, baseline_edges):
+            edges = cv2.Canny(blur, *thresholds(blur, roi_mask)) & roi_mask
+            identical += np.array_equal(edges, expected)
+            mismatch += np.count_nonzero(edges != expected)
+            total += max(1, np.count_nonzero(expected))
+        results[name] = {
+            "ms": seconds * 1000,
+            "identical_frames": f"{identical}/{len(blurs)}",
+            "edge_mismatch": mismatch / total,
+        }
+    return results
+
+
+def _percentiles_ms(samples):
+    samples = np.asarray(samples) * 1000
+    return {"mean": float(samples.mean()), "p50": float(np.percentile(samples, 50)),
+            "p99": float(np.percentile(samples, 99))}
+
+
+def bench_pipeline(resolutions=((640, 360), (1280, 720), (1920, 1080)), variants=("default",),
+                   frames=20, repeat=3):
+    # Per-stage and whole-frame latency of process() on synthetic input at each
+    # resolution. Memory is measured in a separate pass since tracemalloc
+    # slows down the Python parts of the frame.
+    results = []
+    for width, height in resolutions:
+        inputs = road_frames(frames, width, height)
+        for variant in variants:
+            detector = VARIANTS[variant]()
+            for frame in inputs[:2]:
+                detector.process(frame)  # warm up buffers and caches
+
+            timer = detector.timer = StageTimer()
+            if getattr(detector, "tracker", None) is not None:
+                detector.tracker.reset()
+            frame_times = []
+            for _ in range(repeat):
+                for frame in inputs:
+                    start = time.perf_counter()
+                    detector.process(frame)
+                    frame_times.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            for frame in inputs:
+                detector.process(frame)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            frame_ms = _percentiles_ms(frame_times)
+            results.append({
+                "resolution": f"{width}x{height}",
+                "variant": variant,
+                "frames": len(frame_times),
+                "stages": {stage: _percentiles_ms(timer.samples[stage])
+                           for stage in STAGES if stage in timer.samples},
+                "frame_ms": frame_ms,
+                "fps": 1000 / frame_ms["mean"],
+                "peak_traced_kb": peak / 1024,
+            })
+    return results
+
+
+def _endpoint_error(result, reference):
+    # Mean pixel distance between matching lane endpoints, None if a side
+    # was found by only one of the two results
+    errors = []
+    for line, expected in ((result.left, reference.left), (result.right, reference.right)):
+        if (line is None) != (expected is None):
+            return None
+        if line is not None:
+            errors.extend(np.hypot(*np.subtract(line.endpoints, expected.endpoints).T))
+    return float(np.mean(errors)) if errors else 0.0
+
+
+def check_preprocess_parity(frames=20, width=1280, height=720, tolerance=5.0):
+    # Compares every preprocess mode against the original "bgr" path: the
+    # masked gray image, the rendered output and the lane endpoints. "fused"
+    # and the default LanePipeline config must be bit-identical, approximate
+    # modes must keep endpoints within tolerance pixels on average and find
+    # the same sides. The repository has no test suite, so this is the parity
+    # test: `lane_benchmark.py parity` exits with status 1 when a mode fails,
+    # which makes it usable as a CI gate.
+    inputs = road_frames(frames, width, height)
+    reference = LaneDetector(preprocess="bgr")
+    expected = []
+    for frame in inputs:
+        image, result = reference.find_lanes(frame)
+        gray = reference.buffers(*reference.size[::-1]).gray.copy()
+        expected.append((gray, reference.draw_lanes(image, result), result))
+
+    report = {}
+    candidates = [(mode, lambda mode=mode: LaneDetector(preprocess=mode)) for mode in PREPROCESS_MODES]
+    candidates.append(("pipeline", LanePipeline.from_config))
+    for mode, factory in candidates:
+        detector = factory()
+        identical = 0
+        ious = []
+        errors = []
+        missing = 0
+        for frame, (gray_ref, output_ref, result_ref) in zip(inputs, expected):
+            image, result = detector.find_lanes(frame)
+            if isinstance(detector, LanePipeline):
+                gray = detector.state.gray
+            else:
+                gray = detector.buffers(*detector.size[::-1]).gray
+            identical += np.array_equal(detector.draw_lanes(image, result), output_ref)
+            union = np.count_nonzero((gray > 0) | (gray_ref > 0))
+            ious.append(np.count_nonzero((gray > 0) & (gray_ref > 0)) / union if union else 1.0)
+            error = _endpoint_error(result, result_ref)
+            if error is None:
+                missing += 1
+            else:
+                errors.append(error)
+
+        seconds = _time_per_call(detector.find_lanes, [(frame,) for frame in inputs], 3)
+        mean_error = float(np.mean(errors)) if errors else 0.0
+        if mode in ("fused", "pipeline"):
+            ok = identical == len(inputs)
+        else:
+            ok = missing == 0 and mean_error <= tolerance
+        report[mode] = {
+            "ms": seconds * 1000,
+            "identical_frames": f"{identical}/{len(inputs)}",
+            "mask_iou": float(np.mean(ious)),
+            "endpoint_error_px": mean_error,
+            "side_mismatches": missing,
+            "ok": bool(ok),
+        }
+    return report
+
+
+def _lane_xs(lane, rows, result, width, height):
+    # x of a detected lane at the given frame rows, in frame pixels
+    if hasattr(lane, "points"):
+        # Curved lanes are polylines in frame coordinates, bottom to top
+        return np.interp(rows, lane.points[::-1, 1], lane.points[::-1, 0])
+    sx, sy = width / result.width, height / result.height
+    return (rows / sy - lane.intercept) / lane.slope * sx
+
+
+def bench_accuracy(variants=("default",), conditions=tuple(CONDITIONS), frames=20, width=1280, height=720,
+                   tolerance=0.02):
+    # Scores every variant against the ground truth of synthetic scene clips
+    # and times it on the same frames. Per side and frame the error is the
+    # mean horizontal distance to the true lane center over the ROI rows; a
+    # side counts as detected when found with an error below tolerance times
+    # the frame width. Each clip gets a fresh detector, fed in order.
+    clips = {condition: scene_sequence(frames, width, height, condition) for condition in conditions}
+    max_error = tolerance * width
+    results = []
+    for variant in variants:
+        totals = {"errors": [], "detected": 0, "sides": 0, "seconds": 0.0, "frames": 0}
+        # Warm up OpenCV on a throwaway detector so stateful ones start clean
+        VARIANTS[variant]().detect(next(iter(clips.values()))[0][0])
+        for condition, scenes in clips.items():
+            detector = VARIANTS[variant]()
+            errors = []
+            detected = 0
+            seconds = 0.0
+            for frame, truth in scenes:
+                start = time.perf_counter()
+                result = detector.detect(frame)
+                seconds += time.perf_counter() - start
+                for side in ("left", "right"):
+                    lane = getattr(result, side)
+                    if lane is None:
+                        continue
+                    xs = _lane_xs(lane, truth["rows"], result, width, height)
+                    error = float(np.mean(np.abs(xs - truth[side])))
+                    errors.append(error)
+                    detected += error <= max_error
+            row = _accuracy_row(variant, condition, errors, detected, 2 * len(scenes), seconds, len(scenes))
+            results.append(row)
+            totals["errors"] += errors
+            totals["detected"] += detected
+            totals["sides"] += 2 * len(scenes)
+            totals["seconds"] += seconds
+            totals["frames"] += len(scenes)
+        results.append(_accuracy_row(variant, "all", totals["errors"], totals["detected"], totals["sides"],
+                                     totals["seconds"], totals["frames"]))
+    return results
+
+
+def _accuracy_row(variant, condition, errors, detected, sides, seconds, frames):
+    return {
+        "variant": variant,
+        "condition": condition,
+        "detection_rate": detected / sides,
+        "error_px_mean": float(np.mean(errors)) if errors else None,
+        "error_px_p95": float(np.percentile(errors, 95)) if errors else None,
+        "fps": frames / seconds if seconds else 0.0,
+    }
+
+
+def compare_accuracy(results, baseline, max_error_increase=1.0, max_rate_drop=0.02):
+    # Accuracy regressions against an earlier --output file: a lower detection
+    # rate or a mean error more than max_error_increase pixels above the baseline
+    previous = {(row["variant"], row["condition"]): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        old = previous.get((row["variant"], row["condition"]))
+        if old is None:
+            continue
+        if row["detection_rate"] < old["detection_rate"] - max_rate_drop:
+            regressions.append((row["variant"], row["condition"], "detection rate",
+                                old["detection_rate"], row["detection_rate"]))
+        if (row["error_px_mean"] is not None and old["error_px_mean"] is not None
+                and row["error_px_mean"] > old["error_px_mean"] + max_error_increase):
+            regressions.append((row["variant"], row["condition"], "mean error px",
+                                old["error_px_mean"], row["error_px_mean"]))
+    return regressions
+
+
+def _pickled_detect(frame):
+    # Pool baseline: frame and annotated output are pickled both ways
+    cv2.setNumThreads(1)
+    detector = thread_detector()
+    image, result = detector.find_lanes(frame)
+    return detector.draw_lanes(image, result), result.as_dict()
+
+
+def bench_transport(frames=60, resolutions=((1280, 720), (1920, 1080)), workers=None):
+    # Frame throughput of a multiprocessing.Pool that pickles frames against
+    # the shared-memory ring, both with annotated output sent back
+    workers = workers or os.cpu_count() or 1
+    results = []
+    for width, height in resolutions:
+        inputs = road_frames(frames, width, height)
+        row = {"resolution": f"{width}x{height}", "workers": workers}
+
+        with multiprocessing.Pool(workers) as pool:
+            list(pool.imap(_pickled_detect, inputs[:workers]))  # start up workers
+            start = time.perf_counter()
+            for output, lanes in pool.imap(_pickled_detect, inputs, chunksize=1):
+                pass
+            row["pickle_fps"] = frames / (time.perf_counter() - start)
+
+        with LaneProcessPool(inputs[0].shape, workers) as pool:
+            list(pool.imap(inputs[:workers]))
+            start = time.perf_counter()
+            for seq, output, result in pool.imap(inputs):
+                pass
+            row["shm_fps"] = frames / (time.perf_counter() - start)
+
+        row["speedup"] = row["shm_fps"] / row["pickle_fps"]
+        results.append(row)
+    return results
+
+
+def bench_tiles(frames=10, resolutions=((1920, 1080), (3840, 2160)), cores=None, repeat=2):
+    # Native-resolution detection on 1..cores threads: OpenCV's own threading
+    # (cv2.setNumThreads) against the banded stages (bands=n, OpenCV single
+    # threaded), with and without banded CLAHE. Frames whose edges or lanes
+    # differ from the serial run are counted.
+    cores = cores or os.cpu_count() or 1
+    threads = cv2.getNumThreads()
+    results = []
+    try:
+        for width, height in resolutions:
+            inputs = road_frames(frames, width, height)
+            cv2.setNumThreads(1)
+            serial = LaneDetector(size=None)
+            reference = []
+            for frame in inputs:
+                result = serial.detect(frame)
+                reference.append((serial.stage_images()["canny"].copy(), result))
+
+            serial_fps = None
+            for n in range(1, cores + 1):
+                setups = {"opencv": (n, {}), "bands": (1, {"bands": n}),
+                          "bands_tile_clahe": (1, {"bands": n, "tile_clahe": True})}
+                for mode, (cv_threads, options) in setups.items():
+                    if n == 1 and mode != "opencv":
+                        continue
+                    cv2.setNumThreads(cv_threads)
+                    with LaneDetector(size=None, **options) as detector:
+                        detector.detect(inputs[0])
+                        identical = 0
+                        start = time.perf_counter()
+                        for _ in range(repeat):
+                            for frame, (edges, expected) in zip(inputs, reference):
+                                result = detector.detect(frame)
+                                identical += result == expected and np.array_equal(
+                                    detector.stage_images()["canny"], edges)
+                        fps = repeat * frames / (time.perf_counter() - start)
+                    serial_fps = serial_fps or fps
+                    results.append({"resolution": f"{width}x{height}", "cores": n, "mode": mode, "fps": fps,
+                                    "speedup": fps / serial_fps,
+                                    "identical_frames": f"{identical}/{repeat * frames}"})
+    finally:
+        cv2.setNumThreads(threads)
+    return results
+
+
+def _environment():
+    maxrss = None
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+        "max_rss_kb": maxrss,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare_pipeline(results, baseline, tolerance):
+    # Frame p50 regressions against an earlier --output file
+    previous = {(row["resolution"], row["variant"]): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        old = previous.get((row["resolution"], row["variant"]))
+        if old is None:
+            continue
+        ratio = row["frame_ms"]["p50"] / old["frame_ms"]["p50"]
+        if ratio > 1 + tolerance:
+            regressions.append((row["resolution"], row["variant"], old["frame_ms"]["p50"],
+                                row["frame_ms"]["p50"], ratio))
+    return regressions
+
+
+def _print_pipeline(results):
+    for row in results:
+        frame = row["frame_ms"]
+        print(f"[{row['resolution']} {row['variant']}] p50 {frame['p50']:.2f} ms  p99 {frame['p99']:.2f} ms  "
+              f"{row['fps']:.1f} fps  peak {row['peak_traced_kb']:.0f} KiB")
+        for stage, stats in row["stages"].items():
+            share = stats["mean"] / frame["mean"]
+            print(f"  {stage:15s} {stats['mean']:7.3f} ms  {share:6.1%}")
+
+
+def _print_thresholds(results):
+    for dataset, rows in results.items():
+        print(f"[{dataset}]")
+        for name, row in rows.items():
+            print(f"  {name:22s} {row['ms']:8.3f} ms  identical {row['identical_frames']:>7s}  "
+                  f"edge mismatch {row['edge_mismatch']:.2%}")
+
+
+def _print_parity(results):
+    for mode, row in results.items():
+        print(f"{mode:8s} {row['ms']:7.3f} ms  identical {row['identical_frames']:>7s}  "
+              f"mask IoU {row['mask_iou']:.3f}  endpoint error {row['endpoint_error_px']:.2f}px  "
+              f"side mismatches {row['side_mismatches']}  {'OK' if row['ok'] else 'FAIL'}")
+
+
+def _print_accuracy(results):
+    for row in results:
+        mean = "-" if row["error_px_mean"] is None else f"{row['error_px_mean']:6.2f}"
+        p95 = "-" if row["error_px_p95"] is None else f"{row['error_px_p95']:6.2f}"
+        print(f"{row['variant']:15s} {row['condition']:12s} {row['fps']:7.1f} fps  "
+              f"detected {row['detection_rate']:6.1%}  error mean {mean:>6s} px  p95 {p95:>6s} px")
+
+
+def _print_transport(results):
+    for row in results:
+        print(f"{row['resolution']:>10s} x{row['workers']}  pickle {row['pickle_fps']:7.1f} fps  "
+              f"shared memory {row['shm_fps']:7.1f} fps  ({row['speedup']:.2f}x)")
+
+
+def _print_tiles(results):
+    for row in results:
+        print(f"{row['resolution']:>10s} {row['cores']:2d} cores  {row['mode']:16s} {row['fps']:7.1f} fps  "
+              f"({row['speedup']:.2f}x)  identical {row['identical_frames']:>7s}")
+
+
+def _resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lane detection benchmarks")
+    parser.add_argument("--frames", type=int, default=20, help="synthetic frames per run")
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    parser.add_argument("-o", "--output", help="also write the JSON report to this file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("thresholds", help="auto-Canny threshold strategies")
+    pipeline = sub.add_parser("pipeline", help="per-stage timings of the full pipeline")
+    pipeline.add_argument("--resolutions", default="640x360,1280x720,1920x1080",
+                          help="comma separated input sizes")
+    pipeline.add_argument("--variants", default="default",
+                          help=f"comma separated, from: {', '.join(VARIANTS)}")
+    pipeline.add_argument("--repeat", type=int, default=3, help="passes over the frames")
+    pipeline.add_argument("--compare", help="baseline JSON report to check for regressions")
+    pipeline.add_argument("--tolerance", type=float, default=0.1, help="allowed p50 slowdown")
+    parity = sub.add_parser("parity", help="check preprocess modes against the original path")
+    parity.add_argument("--max-error", type=float, default=5.0, help="allowed mean endpoint error (px)")
+    accuracy = sub.add_parser("accuracy", help="detection error against synthetic ground truth, with fps")
+    accuracy.add_argument("--variants", default="default",
+                          help=f"comma separated, from: {', '.join(VARIANTS)}")
+    accuracy.add_argument("--conditions", default=",".join(CONDITIONS),
+                          help=f"comma separated, from: {', '.join(CONDITIONS)}")
+    accuracy.add_argument("--resolution", type=_resolution, default=(1280, 720), help="scene size")
+    accuracy.add_argument("--tolerance", type=float, default=0.02,
+                          help="largest error (fraction of the width) that still counts as detected")
+    accuracy.add_argument("--compare", help="baseline JSON report to check for accuracy regressions")
+    accuracy.add_argument("--max-error-increase", type=float, default=1.0, help="allowed mean error growth (px)")
+    transport = sub.add_parser("transport", help="pool pickling vs the shared-memory frame ring")
+    transport.add_argument("--resolutions", default="1280x720,1920x1080", help="comma separated input sizes")
+    transport.add_argument("-j", "--workers", type=int, default=None, help="worker processes")
+    tiles = sub.add_parser("tiles", help="banded high-resolution stages vs OpenCV threading, 1..N cores")
+    tiles.add_argument("--resolutions", default="1920x1080,3840x2160", help="comma separated input sizes")
+    tiles.add_argument("--cores", type=int, default=None, help="largest thread count (default: all CPUs)")
+    args = parser.parse_args()
+
+    if args.command == "thresholds":
+        results = bench_thresholds(args.frames)
+        printer = _print_thresholds
+    elif args.command == "pipeline":
+        resolutions = [_resolution(r) for r in args.resolutions.split(",")]
+        results = bench_pipeline(resolutions, args.variants.split(","), args.frames, args.repeat)
+        printer = _print_pipeline
+    elif args.command == "parity":
+        results = check_preprocess_parity(args.frames, tolerance=args.max_error)
+        printer = _print_parity
+    elif args.command == "accuracy":
+        width, height = args.resolution
+        results = bench_accuracy(args.variants.split(","), args.conditions.split(","), args.frames, width, height,
+                                 args.tolerance)
+        printer = _print_accuracy
+    elif args.command == "transport":
+        resolutions = [_resolution(r) for r in args.resolutions.split(",")]
+        results = bench_transport(args.frames * 3, resolutions, args.workers)
+        printer = _print_transport
+    elif args.command == "tiles":
+        resolutions = [_resolution(r) for r in args.resolutions.split(",")]
+        results = bench_tiles(args.frames // 2, resolutions, args.cores)
+        printer = _print_tiles
+
+    report = {"benchmark": args.command, "environment": _environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printer(results)
+
+    if args.command == "accuracy" and args.compare:
+        with open(args.compare) as f:
+            regressions = compare_accuracy(results, json.load(f), args.max_error_increase)
+        for variant, condition, metric, old, new in regressions:
+            print(f"REGRESSION {variant} {condition}: {metric} {old:.3f} -> {new:.3f}")
+        if regressions:
+            sys.exit(1)
+    elif getattr(args, "compare", None):
+        with open(args.compare) as f:
+            regressions = compare_pipeline(results, json.load(f), args.tolerance)
+        for resolution, variant, old, new, ratio in regressions:
+            print(f"REGRESSION {resolution} {variant}: p50 {old:.2f} -> {new:.2f} ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+    if args.command == "parity" and not all(row["ok"] for row in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from Road_Lane_Detection import LAB_WHITE_LOWER, LAB_WHITE_UPPER, LAB_YELLOW_LOWER, LAB_YELLOW_UPPER, blend_overlay
+
+# Road trapezoid (fractions of the frame) that becomes a rectangle in the
+# bird's-eye view: bottom-left, top-left, top-right, bottom-right. The top
+# edge matches the ROI top of the straight-line detector.
+SOURCE_POINTS = ((0.15, 1.0), (0.44, 0.65), (0.56, 0.65), (0.85, 1.0))
+
+
+@dataclass
+class CurvedLane:
+    fit: tuple         # (a, b, c) of x = a*y^2 + b*y + c in bird's-eye pixels
+    points: np.ndarray  # (n, 2) int32 polyline in frame coordinates, bottom to top
+    pixels: int        # mask pixels behind the fit
+    coverage: float    # share of bird's-eye rows with lane pixels, 0..1
+    radius: float      # curvature radius at the bottom, bird's-eye pixels (inf when straight)
+
+
+@dataclass
+class CurvedLaneResult:
+    left: Optional[CurvedLane]
+    right: Optional[CurvedLane]
+    width: int
+    height: int
+    incremental: bool  # found by searching around the previous fits
+
+    @property
+    def confidence(self):
+        sides = [lane.coverage if lane else 0.0 for lane in (self.left, self.right)]
+        return sum(sides) / 2
+
+    def as_dict(self):
+        def lane_dict(lane):
+            if lane is None:
+                return None
+            return {"fit": list(lane.fit), "points": lane.points.tolist(), "pixels": lane.pixels,
+                    "coverage": lane.coverage, "radius": lane.radius if np.isfinite(lane.radius) else None}
+        return {"left": lane_dict(self.left), "right": lane_dict(self.right), "width": self.width,
+                "height": self.height, "incremental": self.incremental, "confidence": self.confidence}
+
+
+class _WarpBuffers:
+    # Perspective matrices and bird's-eye images for one frame size
+    def __init__(self, width, height, size, source_points):
+        bw, bh = size
+        src = np.float32([(x * width, y * height) for x, y in source_points])
+        dst = np.float32([(bw * 0.25, bh), (bw * 0.25, 0), (bw * 0.75, 0), (bw * 0.75, bh)])
+        self.matrix = cv2.getPerspectiveTransform(src, dst)
+        self.inverse = cv2.getPerspectiveTransform(dst, src)
+
+        self.warped = np.empty((bh, bw, 3), dtype=np.uint8)
+        self.lab = np.empty((bh, bw, 3), dtype=np.uint8)
+        self.lightness = np.empty((bh, bw), dtype=np.uint8)
+        self.white_mask = np.empty((bh, bw), dtype=np.uint8)
+        self.yellow_mask = np.empty((bh, bw), dtype=np.uint8)
+        self.binary = np.empty((bh, bw), dtype=np.uint8)
+        self.line_image = np.empty((height, width, 3), dtype=np.uint8)
+
+
+def radius_of(fit, y):
+    a, b, _ = fit
+    if a == 0:
+        return float("inf")
+    return float((1 + (2 * a * y + b) ** 2) ** 1.5 / abs(2 * a))
+
+
+class CurvedLaneDetector:
+    # Second-order lane fits in a bird's-eye view. The road trapezoid is warped
+    # into a size[0] x size[1] image (straight lanes become vertical lines),
+    # CLAHE and the LAB white/yellow masks give a binary image, and lanes are
+    # found by a sliding-window search seeded from a column histogram of its
+    # lower half. On the next frames only pixels within margin of the previous
+    # polynomials are used; the sliding windows run again when a side loses
+    # too many pixels or the two lanes stop looking like a lane pair.
+    #
+    # Keeps state between frames: one detector per stream, frames in order.
+    def __init__(self, size=(320, 240), windows=9, margin=None, min_pixels=None, source_points=SOURCE_POINTS,
+                 incremental=True):
+        self.size = size
+        self.windows = windows
+        self.margin = margin or max(8, size[0] // 10)
+        self.min_pixels = min_pixels or max(20, size[0] * size[1] // 1000)
+        self.source_points = source_points
+        self.incremental = incremental
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self.fits = [None, None]
+        self._buffers = {}
+        # Rows the fits are evaluated at, bottom to top
+        self._plot_y = np.linspace(size[1] - 1, 0, 24)
+
+    def reset(self):
+        self.fits = [None, None]
+
+    def buffers(self, height, width):
+        buffers = self._buffers.get((height, width))
+        if buffers is None:
+            buffers = self._buffers[(height, width)] = _WarpBuffers(width, height, self.size, self.source_points)
+        return buffers
+
+    def binary(self, image):
+        # Bird's-eye lane mask of a frame
+        buf = self.buffers(*image.shape[:2])
+        cv2.warpPerspective(image, buf.matrix, self.size, dst=buf.warped, flags=cv2.INTER_LINEAR)
+        cv2.cvtColor(buf.warped, cv2.COLOR_BGR2LAB, dst=buf.lab)
+        cv2.extractChannel(buf.lab, 0, dst=buf.lightness)
+        self.clahe.apply(buf.lightness, dst=buf.lightness)
+        cv2.insertChannel(buf.lightness, buf.lab, 0)
+        cv2.inRange(buf.lab, LAB_WHITE_LOWER, LAB_WHITE_UPPER, dst=buf.white_mask)
+        cv2.inRange(buf.lab, LAB_YELLOW_LOWER, LAB_YELLOW_UPPER, dst=buf.yellow_mask)
+        cv2.bitwise_or(buf.white_mask, buf.yellow_mask, dst=buf.binary)
+        return buf.binary
+
+    def _sliding_windows(self, binary, ys, xs):
+        # ys comes out of np.nonzero sorted, so every window's rows are one
+        # contiguous slice found by binary search
+        bh, bw = binary.shape
+        histogram = np.count_nonzero(binary[bh // 2:], axis=0)
+        mid = bw // 2
+        bases = [int(np.argmax(histogram[:mid])), mid + int(np.argmax(histogram[mid:]))]
+        window_height = bh // self.windows
+        min_window = max(5, self.min_pixels // self.windows)
+
+        selected = [[], []]
+        for side, base in enumerate(bases):
+            if histogram[base] == 0:
+                continue
+            x_center = base
+            for window in range(self.windows):
+                y_high = bh - window * window_height
+                y_low = 0 if window == self.windows - 1 else y_high - window_height
+                start, stop = np.searchsorted(ys, (y_low, y_high))
+                window_xs = xs[start:stop]
+                hits = np.flatnonzero(np.abs(window_xs - x_center) <= self.margin) + start
+                selected[side].append(hits)
+                if len(hits) >= min_window:
+                    x_center = int(xs[hits].mean())
+        return [np.concatenate(hits) if hits else np.empty(0, dtype=np.intp) for hits in selected]
+
+    def _around_fits(self, ys, xs):
+        selected = []
+        for fit in self.fits:
+            predicted = (fit[0] * ys + fit[1]) * ys + fit[2]
+            selected.append(np.flatnonzero(np.abs(xs - predicted) <= self.margin))
+        return selected
+
+    def _plausible(self, fits):
+        # Both lanes found, roughly the expected distance apart along the whole view
+        if fits[0] is None or fits[1] is None:
+            return fits[0] is not None or fits[1] is not None
+        y = self._plot_y
+        gap = np.polyval(fits[1], y) - np.polyval(fits[0], y)
+        bw = self.size[0]
+        return bool(gap.min() > 0.2 * bw and gap.max() < 0.9 * bw)
+
+    def _fit(self, selections, ys, xs):
+        fits = []
+        for hits in selections:
+            if len(hits) < self.min_pixels:
+                fits.append(None)
+            else:
+                fits.append(np.polyfit(ys[hits], xs[hits], 2))
+        return fits
+
+    def find_lanes(self, image):
+        # Returns the frame to draw on and its CurvedLaneResult
+        binary = self.binary(image)
+        ys, xs = np.nonzero(binary)
+        ys = ys.astype(np.float64)
+        xs = xs.astype(np.float64)
+
+        incremental = self.incremental and all(fit is not None for fit in self.fits)
+        if incremental:
+            selections = self._around_fits(ys, xs)
+            fits = self._fit(selections, ys, xs)
+            if any(fit is None for fit in fits) or not self._plausible(fits):
+                incremental = False
+        if not incremental:
+            selections = self._sliding_windows(binary, ys, xs)
+            fits = self._fit(selections, ys, xs)
+            if not self._plausible(fits):
+                fits = [None, None]
+        self.fits = fits
+
+        buf = self.buffers(*image.shape[:2])
+        height = self.size[1]
+        sides = []
+        for fit, hits in zip(fits, selections):
+            if fit is None:
+                sides.append(None)
+                continue
+            plot_x = np.polyval(fit, self._plot_y)
+            bird = np.stack([plot_x, self._plot_y], axis=1).reshape(-1, 1, 2)
+            points = cv2.perspectiveTransform(bird, buf.inverse).reshape(-1, 2)
+            coverage = len(np.unique(ys[hits].astype(np.int32))) / height
+            sides.append(CurvedLane(tuple(float(v) for v in fit), np.rint(points).astype(np.int32),
+                                    len(hits), coverage, radius_of(fit, height - 1)))
+        return image, CurvedLaneResult(sides[0], sides[1], image.shape[1], image.shape[0], incremental)
+
+    def detect(self, image):
+        return self.find_lanes(image)[1]
+
+    def draw_lanes(self, image, result, out=None):
+        # Lane area in translucent green between the two fits, lane lines on top
+        line_image = self.buffers(*image.shape[:2]).line_image
+        line_image.fill(0)
+        if result.left is not None and result.right is not None:
+            area = np.concatenate([result.left.points, result.right.points[::-1]])
+            cv2.fillPoly(line_image, [area], (0, 96, 0))
+        thickness = max(2, round(8 * image.shape[1] / 640))
+        for lane in (result.left, result.right):
+            if lane is not None:
+                cv2.polylines(line_image, [lane.points], False, (0, 255, 0), thickness)
+        return blend_overlay(image, line_image, out)
+
+    def process(self, image, out=None):
+        image, result = self.find_lanes(image)
+        return self.draw_lanes(image, result, out)
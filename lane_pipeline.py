@@ -0,0 +1,527 @@
+import argparse
+import importlib
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from Road_Lane_Detection import (LAB_WHITE_LOWER, LAB_WHITE_UPPER, LAB_YELLOW_LOWER, LAB_YELLOW_UPPER, ROI_TOP,
+                                 WHITE_LOWER, WHITE_UPPER, YELLOW_LOWER, YELLOW_UPPER, CannyThresholds, LaneLine,
+                                 LaneResult, LaneTracker, NoTimer, classify_lines, line_confidence, make_coordinates,
+                                 overlay_lanes, working_size)
+from lane_sinks import ImageSequenceSink
+
+# Stage types by the name used in configs, see register_stage()
+STAGE_TYPES = {}
+
+
+def register_stage(cls):
+    STAGE_TYPES[cls.name] = cls
+    return cls
+
+
+class FrameState:
+    # What the stages of one pipeline pass to each other. Kept between frames,
+    # so stages may also leave state for the next frame (the tracker does).
+    def __init__(self):
+        self.tracker = None
+        self.reset(None)
+
+    def reset(self, image):
+        self.frame = image     # BGR frame at the working resolution
+        self.image = image     # image lanes are drawn on (the enhanced frame after CLAHE)
+        self.lab = None
+        self.lightness = None
+        self.mask = None       # white/yellow color mask
+        self.gray = None
+        self.blur = None
+        self.edges = None
+        self.lines = None      # HoughLinesP output
+        self.fits = (np.empty((0, 2)), np.empty((0, 2)))
+        self.averages = [None, None]
+        self.top = ROI_TOP     # ROI top as a fraction of the height, for the endpoints
+        self.width = self.height = 0
+        if image is not None:
+            self.height, self.width = image.shape[:2]
+
+
+class Stage:
+    # A pipeline step. Subclasses set name (the config key) and defaults (their
+    # parameters); unknown parameters are rejected, numeric ones must be
+    # numbers and validate() checks their values, so a bad config fails when
+    # it is loaded rather than on some later frame. produces names the
+    # FrameState image the stage writes, requires the images it reads (any one
+    # of them will do). Disabled stages are skipped, so a pipeline whose stage
+    # would miss all of its inputs is rejected when it is built.
+    name = None
+    defaults = {}
+    produces = None
+    requires = ()
+
+    def __init__(self, enabled=True, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"Unknown parameters for stage {self.name}: {', '.join(sorted(unknown))}")
+        for key, value in params.items():
+            default = self.defaults[key]
+            if isinstance(default, (int, float)) and not isinstance(default, bool) and (
+                    isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f"Stage {self.name}: {key} must be a number, got {value!r}")
+        self.enabled = enabled
+        self.params = {**self.defaults, **params}
+        for key, value in self.params.items():
+            setattr(self, key, value)
+        self.validate()
+        self._buffers = {}
+
+    def validate(self):
+        pass
+
+    def _require(self, condition, message):
+        if not condition:
+            raise ValueError(f"Stage {self.name}: {message}")
+
+    def buffer(self, key, shape):
+        # uint8 work image reused across frames of the same size
+        buf = self._buffers.get(key)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[key] = np.empty(shape, dtype=np.uint8)
+        return buf
+
+    def config(self):
+        entry = {"stage": self.name, **self.params}
+        if not self.enabled:
+            entry["enabled"] = False
+        return entry
+
+    def __call__(self, state):
+        raise NotImplementedError
+
+
+@register_stage
+class Resize(Stage):
+    # size: [width, height], a width that keeps the aspect ratio, or null (see working_size)
+    name = "resize"
+    produces = "frame"
+    defaults = {"size": [640, 480], "interpolation": "linear"}
+    INTERPOLATIONS = {"nearest": cv2.INTER_NEAREST, "linear": cv2.INTER_LINEAR, "area": cv2.INTER_AREA}
+
+    def validate(self):
+        self._require(self.interpolation in self.INTERPOLATIONS, f"unknown interpolation {self.interpolation!r}")
+
+    def __call__(self, state):
+        image = state.frame
+        width, height = working_size(self.size, image.shape)
+        if (height, width) != image.shape[:2]:
+            image = cv2.resize(image, (width, height), dst=self.buffer("resized", (height, width, 3)),
+                               interpolation=self.INTERPOLATIONS[self.interpolation])
+            state.reset(image)
+
+
+@register_stage
+class Clahe(Stage):
+    # CLAHE on the LAB lightness. output="bgr" converts back and draws on the
+    # enhanced frame, "lab" leaves only the LAB image for the later stages.
+    name = "clahe"
+    produces = "image"
+    defaults = {"clip_limit": 2.0, "tile_grid": 8, "output": "bgr"}
+
+    def validate(self):
+        self._require(self.clip_limit > 0, "clip_limit must be positive")
+        self._require(isinstance(self.tile_grid, int) and self.tile_grid >= 1, "tile_grid must be an integer >= 1")
+        self._require(self.output in ("bgr", "lab"), f"unknown output {self.output!r}")
+
+    def __init__(self, enabled=True, **params):
+        super().__init__(enabled, **params)
+        self.clahe = cv2.createCLAHE(clipLimit=self.clip_limit, tileGridSize=(self.tile_grid, self.tile_grid))
+
+    def __call__(self, state):
+        shape = state.frame.shape
+        lab = cv2.cvtColor(state.frame, cv2.COLOR_BGR2LAB, dst=self.buffer("lab", shape))
+        lightness = cv2.extractChannel(lab, 0, dst=self.buffer("lightness", shape[:2]))
+        self.clahe.apply(lightness, dst=lightness)
+        cv2.insertChannel(lightness, lab, 0)
+        state.lab, state.lightness = lab, lightness
+        if self.output == "bgr":
+            state.image = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=self.buffer("enhanced", shape))
+
+
+@register_stage
+class ColorMask(Stage):
+    # White or yellow pixels, thresholded on the (enhanced) BGR image or on
+    # LAB. Bounds are [[lower], [upper]]; null picks the module's defaults.
+    name = "color_mask"
+    produces = "mask"
+    defaults = {"space": "bgr", "white": None, "yellow": None}
+    BOUNDS = {
+        "bgr": ((WHITE_LOWER, WHITE_UPPER), (YELLOW_LOWER, YELLOW_UPPER)),
+        "lab": ((LAB_WHITE_LOWER, LAB_WHITE_UPPER), (LAB_YELLOW_LOWER, LAB_YELLOW_UPPER)),
+    }
+
+    def validate(self):
+        self._require(self.space in self.BOUNDS, f"unknown color space {self.space!r}")
+
+    def __init__(self, enabled=True, **params):
+        super().__init__(enabled, **params)
+        white, yellow = self.BOUNDS[self.space]
+        self._white = white if self.white is None else tuple(np.array(b, dtype=np.uint8) for b in self.white)
+        self._yellow = yellow if self.yellow is None else tuple(np.array(b, dtype=np.uint8) for b in self.yellow)
+
+    def __call__(self, state):
+        if self.space == "lab":
+            source = state.lab
+            if source is None:
+                source = cv2.cvtColor(state.frame, cv2.COLOR_BGR2LAB, dst=self.buffer("lab", state.frame.shape))
+        else:
+            source = state.image
+        shape = source.shape[:2]
+        white = cv2.inRange(source, *self._white, dst=self.buffer("white", shape))
+        yellow = cv2.inRange(source, *self._yellow, dst=self.buffer("yellow", shape))
+        state.mask = cv2.bitwise_or(white, yellow, dst=self.buffer("mask", shape))
+
+
+@register_stage
+class Gray(Stage):
+    # Grayscale image for the edge stages, zeroed outside the color mask:
+    #   "masked"    mask the BGR image, then convert (the original order)
+    #   "fused"     convert, then mask (same result, cheaper)
+    #   "lightness" the CLAHE'd L channel (pairs with clahe output "lab")
+    name = "gray"
+    produces = "gray"
+    defaults = {"mode": "masked"}
+
+    def validate(self):
+        self._require(self.mode in ("masked", "fused", "lightness"), f"unknown mode {self.mode!r}")
+
+    def __call__(self, state):
+        shape = state.image.shape[:2]
+        gray = self.buffer("gray", shape)
+        if self.mode == "masked" and state.mask is not None:
+            masked = self.buffer("masked", state.image.shape)
+            # A masked bitwise_and leaves unselected pixels of a reused dst untouched
+            masked.fill(0)
+            cv2.bitwise_and(state.image, state.image, dst=masked, mask=state.mask)
+            state.gray = cv2.cvtColor(masked, cv2.COLOR_BGR2GRAY, dst=gray)
+            return
+        if self.mode == "lightness" and state.lightness is not None:
+            source = state.lightness
+        else:
+            source = cv2.cvtColor(state.image, cv2.COLOR_BGR2GRAY, dst=gray)
+        if state.mask is not None:
+            source = cv2.bitwise_and(source, state.mask, dst=gray)
+        state.gray = source
+
+
+@register_stage
+class Blur(Stage):
+    name = "blur"
+    produces = "blur"
+    requires = ("gray",)
+    defaults = {"kernel": 7}
+
+    def validate(self):
+        self._require(isinstance(self.kernel, int) and self.kernel >= 1 and self.kernel % 2,
+                      "kernel must be an odd integer >= 1")
+
+    def __call__(self, state):
+        state.blur = cv2.GaussianBlur(state.gray, (self.kernel, self.kernel), 0,
+                                      dst=self.buffer("blur", state.gray.shape))
+
+
+@register_stage
+class Canny(Stage):
+    # Auto thresholds at low/high times the median, see CannyThresholds
+    name = "canny"
+    produces = "edges"
+    requires = ("blur", "gray")
+    defaults = {"low": 0.7, "high": 1.3, "method": "histogram", "refresh": 1}
+
+    def validate(self):
+        self._require(0 <= self.low <= self.high, "thresholds need 0 <= low <= high")
+        self._require(isinstance(self.refresh, int) and self.refresh >= 1, "refresh must be an integer >= 1")
+
+    def __init__(self, enabled=True, **params):
+        super().__init__(enabled, **params)
+        self.thresholds = CannyThresholds(self.method, refresh=self.refresh, low=self.low, high=self.high)
+
+    def __call__(self, state):
+        source = state.blur if state.blur is not None else state.gray
+        lower, upper = self.thresholds(source)
+        state.edges = cv2.Canny(source, lower, upper, edges=self.buffer("edges", source.shape))
+
+
+@register_stage
+class Roi(Stage):
+    # Keeps edges inside the polygon (fractions of width and height), narrowed
+    # to the predicted lanes when a track stage is tracking
+    name = "roi"
+    produces = "edges"
+    requires = ("edges",)
+    defaults = {"vertices": [[0.1, 1.0], [0.4, 0.65], [0.6, 0.65], [0.9, 1.0]]}
+
+    def validate(self):
+        self._require(len(self.vertices) >= 3 and all(
+            len(vertex) == 2 and all(isinstance(v, (int, float)) and 0 <= v <= 1 for v in vertex)
+            for vertex in self.vertices), "vertices must be at least 3 [x, y] pairs of fractions in [0, 1]")
+
+    def mask(self, height, width):
+        key = ("mask", height, width)
+        mask = self._buffers.get(key)
+        if mask is None:
+            mask = self._buffers[key] = np.zeros((height, width), dtype=np.uint8)
+            vertices = np.array([[(width * x, height * y) for x, y in self.vertices]], dtype=np.int32)
+            cv2.fillPoly(mask, vertices, 255)
+        return mask
+
+    def __call__(self, state):
+        mask = self.mask(*state.edges.shape)
+        if state.tracker is not None:
+            mask = state.tracker.search_mask(mask)
+        state.edges = cv2.bitwise_and(state.edges, mask, dst=self.buffer("roi_edges", state.edges.shape))
+        state.top = min(y for _, y in self.vertices)
+
+
+@register_stage
+class Hough(Stage):
+    # theta in degrees. With scale=True lengths and votes are given for a 640
+    # wide frame and scaled to the working width, like LaneDetector does.
+    name = "hough"
+    defaults = {"rho": 1, "theta": 1.0, "threshold": 30, "min_line_length": 50, "max_line_gap": 30,
+                "scale": True}
+    requires = ("edges",)
+
+    def validate(self):
+        self._require(self.rho > 0 and self.theta > 0, "rho and theta must be positive")
+        self._require(self.threshold >= 1, "threshold must be at least 1")
+        self._require(self.min_line_length >= 0 and self.max_line_gap >= 0,
+                      "min_line_length and max_line_gap must not be negative")
+
+    def __call__(self, state):
+        scale = state.width / 640 if self.scale else 1.0
+        state.lines = cv2.HoughLinesP(state.edges, rho=self.rho, theta=np.deg2rad(self.theta),
+                                      threshold=max(8, round(self.threshold * scale)),
+                                      minLineLength=max(10, round(self.min_line_length * scale)),
+                                      maxLineGap=max(6, round(self.max_line_gap * scale)))
+
+
+@register_stage
+class Classification(Stage):
+    name = "classification"
+    defaults = {"min_slope": 0.4}
+
+    def validate(self):
+        self._require(self.min_slope >= 0, "min_slope must not be negative")
+
+    def __call__(self, state):
+        state.fits = classify_lines(state.lines, state.width, state.height, self.min_slope)
+        state.averages = [fit.mean(axis=0) if len(fit) else None for fit in state.fits]
+
+
+@register_stage
+class Track(Stage):
+    # Smooths the averages across frames (LaneTracker); from the next frame on
+    # the roi stage searches around the tracked lanes. Frames must be in order.
+    name = "track"
+    defaults = {"alpha": 0.5, "beta": 0.3, "band": 40, "max_misses": 5}
+
+    def validate(self):
+        self._require(0 < self.alpha <= 1, "alpha must be in (0, 1]")
+        self._require(self.beta >= 0, "beta must not be negative")
+        self._require(self.band > 0, "band must be positive")
+        self._require(isinstance(self.max_misses, int) and self.max_misses >= 0,
+                      "max_misses must be an integer >= 0")
+
+    def __init__(self, enabled=True, **params):
+        super().__init__(enabled, **params)
+        self.tracker = LaneTracker(self.alpha, self.band, self.max_misses, self.beta)
+
+    def __call__(self, state):
+        state.tracker = self.tracker
+        state.averages = list(self.tracker.update(*state.averages, state.height))
+
+
+class StageCapture:
+    # Pipeline hook that keeps each stage's output image of the last frame.
+    # The images are the stages' own buffers, valid until the next frame.
+    def __init__(self):
+        self.images = {}
+
+    def __call__(self, stage, state, seconds):
+        if stage.produces is not None:
+            self.images[stage.name] = getattr(state, stage.produces)
+
+
+def _stage_type(name):
+    # Registered names, or "package.module:Class" for stages defined elsewhere
+    if name in STAGE_TYPES:
+        return STAGE_TYPES[name]
+    if ":" in name:
+        module, attr = name.split(":", 1)
+        return getattr(importlib.import_module(module), attr)
+    raise ValueError(f"Unknown stage: {name}")
+
+
+def _check_inputs(stages):
+    # Every enabled stage needs one of its inputs from an earlier enabled stage
+    produced = {"frame", "image"}
+    for stage in stages:
+        if not stage.enabled:
+            continue
+        if stage.requires and produced.isdisjoint(stage.requires):
+            raise ValueError(f"Stage {stage.name} needs {' or '.join(stage.requires)} from an earlier enabled stage")
+        if stage.produces is not None:
+            produced.add(stage.produces)
+
+
+# Same processing as LaneDetector() and process_image
+DEFAULT_CONFIG = {
+    "stages": [
+        {"stage": "resize"},
+        {"stage": "clahe"},
+        {"stage": "color_mask"},
+        {"stage": "gray"},
+        {"stage": "blur"},
+        {"stage": "canny"},
+        {"stage": "roi"},
+        {"stage": "hough"},
+        {"stage": "classification"},
+    ],
+    "draw": {"color": [0, 255, 0], "thickness": 8, "weight": 0.8},
+}
+
+
+class LanePipeline:
+    # Lane detection as a list of stage objects, built from a declarative
+    # config. Stages can be reordered, disabled ("enabled": false), tuned or
+    # replaced by any Stage subclass. The timer gets one mark per stage, and
+    # every hook is called as hook(stage, state, seconds) after each stage.
+    # Same interface as LaneDetector; not thread safe, one pipeline per thread.
+    def __init__(self, stages, draw=None, timer=None):
+        self.stages = list(stages)
+        _check_inputs(self.stages)
+        self.draw = {**DEFAULT_CONFIG["draw"], **(draw or {})}
+        self.timer = timer or NoTimer()
+        self.hooks = []
+        self.state = FrameState()
+        self._line_image = None
+
+    @classmethod
+    def from_config(cls, config=None, timer=None):
+        config = DEFAULT_CONFIG if config is None else config
+        stages = []
+        for entry in config.get("stages", DEFAULT_CONFIG["stages"]):
+            if isinstance(entry, str):
+                entry = {"stage": entry}
+            params = dict(entry)
+            stages.append(_stage_type(params.pop("stage"))(**params))
+        return cls(stages, config.get("draw"), timer)
+
+    def config(self):
+        return {"stages": [stage.config() for stage in self.stages], "draw": dict(self.draw)}
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    @property
+    def tracker(self):
+        for stage in self.stages:
+            if isinstance(stage, Track) and stage.enabled:
+                return stage.tracker
+        return None
+
+    def process(self, image, out=None):
+        image, result = self.find_lanes(image)
+        return self.draw_lanes(image, result, out)
+
+    def detect(self, image):
+        return self.find_lanes(image)[1]
+
+    def find_lanes(self, image):
+        state = self.state
+        state.reset(image)
+        timer = self.timer
+        timer.start()
+        for stage in self.stages:
+            if not stage.enabled:
+                continue
+            if self.hooks:
+                start = time.perf_counter()
+                stage(state)
+                seconds = time.perf_counter() - start
+                for hook in self.hooks:
+                    hook(stage, state, seconds)
+            else:
+                stage(state)
+            timer.mark(stage.name)
+
+        sides = []
+        for avg, fits in zip(state.averages, state.fits):
+            if avg is None:
+                sides.append(None)
+                continue
+            sides.append(LaneLine(float(avg[0]), float(avg[1]), make_coordinates(state.frame, avg, state.top),
+                                  len(fits), line_confidence(fits, state.width, state.height)))
+        return state.image, LaneResult(sides[0], sides[1], state.width, state.height)
+
+    def draw_lanes(self, image, result, out=None):
+        if self._line_image is None or self._line_image.shape != image.shape:
+            self._line_image = np.empty_like(image)
+        return overlay_lanes(image, result, self._line_image, out, tuple(self.draw["color"]), self.draw["thickness"],
+                             self.draw["weight"], self.timer)
+
+
+def load_config(path):
+    # JSON, or YAML when PyYAML is installed
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("PyYAML is required for YAML pipeline configs (pip install pyyaml)")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def load_pipeline(path=None, timer=None):
+    return LanePipeline.from_config(load_config(path) if path else None, timer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lane detection pipeline configs")
+    parser.add_argument("config", nargs="?", help="config file to validate (default: the built-in config)")
+    parser.add_argument("--image", help="run the pipeline on this image and print per-stage times")
+    parser.add_argument("-o", "--output", help="write the annotated image here")
+    parser.add_argument("--debug-dir", help="write every stage's output image here")
+    args = parser.parse_args()
+
+    pipeline = load_pipeline(args.config)
+    if not args.image:
+        # Prints the effective config, a starting point for a deployment's own file
+        print(json.dumps(pipeline.config(), indent=2))
+        return
+
+    image = cv2.imread(args.image)
+    if image is None:
+        raise SystemExit(f"Could not read image: {args.image}")
+    times = []
+    capture = StageCapture()
+    pipeline.hooks += [lambda stage, state, seconds: times.append((stage.name, seconds)), capture]
+    result_image, result = pipeline.find_lanes(image)
+    if args.debug_dir:
+        with ImageSequenceSink(os.path.join(args.debug_dir, "{index}.png")) as sink:
+            for name, step in capture.images.items():
+                sink.put(step, name)
+    for name, seconds in times:
+        print(f"{name:15s} {seconds * 1000:7.3f} ms")
+    print(json.dumps(result.as_dict()))
+    if args.output:
+        cv2.imwrite(args.output, pipeline.draw_lanes(result_image, result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+import argparse
+import collections
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from Road_Lane_Detection import LaneDetector, LaneTracker
+from lane_video import open_video
+
+# Socket protocol: every message is a 4-byte big-endian length followed by the
+# payload. Clients send encoded (JPEG/PNG) frames and receive one JSON lane
+# result per processed frame; frames dropped by the server get no reply.
+_HEADER = struct.Struct(">I")
+
+_log = logging.getLogger(__name__)
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+def recv_message(sock):
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    return _recv_exact(sock, _HEADER.unpack(header)[0])
+
+
+def send_message(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+class StreamStats:
+    def __init__(self, window=1000):
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        # Frames the detector raised on; the first error is kept (and logged)
+        self.errors = 0
+        self.error = None
+        self.latencies = collections.deque(maxlen=window)
+        self.started = self.last = time.perf_counter()
+
+    def snapshot(self):
+        latencies = np.asarray(self.latencies) * 1000
+        elapsed = self.last - self.started
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "error": self.error,
+            "fps": self.processed / elapsed if elapsed else 0.0,
+            "latency_ms_p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_ms_p99": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+
+class LaneStream:
+    # One camera feed. Holds at most max_pending frames; when the server falls
+    # behind, the oldest frame is dropped (drop=False makes push() wait instead).
+    # At most one frame per stream is processed at a time, so each stream owns
+    # its detector and can track lanes across its own frames.
+    def __init__(self, name, detector, max_pending=2, drop=True, on_result=None):
+        self.name = name
+        self.detector = detector
+        self.max_pending = max_pending
+        self.drop = drop
+        self.on_result = on_result
+        self.pending = collections.deque()
+        self.stats = StreamStats()
+        self.busy = False
+        self.closed = False
+        self._server = None
+
+    def push(self, frame, seq=None):
+        cond = self._server._cond
+        with cond:
+            self.stats.received += 1
+            if seq is None:
+                seq = self.stats.received - 1
+            while not self.drop and len(self.pending) >= self.max_pending and not self._server.stopped:
+                cond.wait(0.1)
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.stats.dropped += 1
+            self.pending.append((seq, frame, time.perf_counter()))
+            cond.notify_all()
+
+    def close(self):
+        with self._server._cond:
+            self.closed = True
+            self._server._cond.notify_all()
+
+
+class LaneServer:
+    # Schedules frames from many streams onto one shared worker pool. The
+    # dispatcher visits streams round-robin and never queues more frames than
+    # there are workers, so a busy stream cannot starve the others and frames
+    # wait in their (bounded) stream instead of an unbounded executor queue.
+    def __init__(self, workers=None, detector_factory=LaneDetector):
+        self.workers = workers or os.cpu_count() or 1
+        self.detector_factory = detector_factory
+        self.streams = []
+        self.finished = {}  # name -> StreamStats of streams that have ended
+        self.stopped = False
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._next = 0
+        self._pool = ThreadPoolExecutor(self.workers)
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+
+    def start(self):
+        self._dispatcher.start()
+        return self
+
+    def add_stream(self, name, max_pending=2, drop=True, on_result=None):
+        stream = LaneStream(name, self.detector_factory(), max_pending, drop, on_result)
+        stream._server = self
+        with self._cond:
+            self.streams.append(stream)
+            self._cond.notify_all()
+        return stream
+
+    def add_capture(self, name, source, pace=True, **options):
+        # Files are paced at their frame rate by default so they behave like live
+        # cameras; pace=False reads as fast as the stream accepts frames
+        capture = open_video(source)
+        stream = self.add_stream(name, **options)
+        interval = 1.0 / (capture.get(cv2.CAP_PROP_FPS) or 30.0) if pace else 0.0
+
+        def read():
+            next_time = time.perf_counter()
+            try:
+                while not self.stopped:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    stream.push(frame)
+                    if interval:
+                        next_time += interval
+                        time.sleep(max(0.0, next_time - time.perf_counter()))
+            finally:
+                capture.release()
+                stream.close()
+
+        self._spawn(read)
+        return stream
+
+    def listen(self, host="127.0.0.1", port=0, **options):
+        # Every client connection becomes a stream named after its address
+        server_sock = socket.create_server((host, port))
+        server_sock.settimeout(0.5)
+
+        def serve_client(conn, address):
+            name = f"{address[0]}:{address[1]}"
+
+            def reply(stream, seq, result):
+                try:
+                    send_message(conn, json.dumps({"seq": seq, **result.as_dict()}).encode())
+                except OSError:
+                    stream.close()
+
+            stream = self.add_stream(name, on_result=reply, **options)
+            try:
+                while not self.stopped:
+                    payload = recv_message(conn)
+                    if payload is None:
+                        break
+                    frame = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+                    if frame is not None:
+                        stream.push(frame)
+            except OSError:
+                pass
+            finally:
+                stream.close()
+                self._wait_idle(stream)
+                conn.close()
+
+        def accept():
+            with server_sock:
+                while not self.stopped:
+                    try:
+                        conn, address = server_sock.accept()
+                    except socket.timeout:
+                        continue
+                    conn.settimeout(None)
+                    self._spawn(serve_client, conn, address)
+
+        self._spawn(accept)
+        return server_sock.getsockname()
+
+    def _spawn(self, target, *args):
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    def _wait_idle(self, stream):
+        with self._cond:
+            while (stream.pending or stream.busy) and not self.stopped:
+                self._cond.wait(0.1)
+
+    def _dispatch(self):
+        with self._cond:
+            while not self.stopped:
+                submitted = False
+                count = len(self.streams)
+                for i in range(count):
+                    if self._inflight >= self.workers:
+                        break
+                    stream = self.streams[(self._next + i) % count]
+                    if stream.busy or not stream.pending:
+                        continue
+                    item = stream.pending.popleft()
+                    stream.busy = True
+                    self._inflight += 1
+                    self._pool.submit(self._process, stream, item)
+                    submitted = True
+                if count:
+                    self._next = (self._next + 1) % count
+
+                # Retire streams that ended and have nothing left in flight
+                retired = [s for s in self.streams if s.closed and not s.pending and not s.busy]
+                for stream in retired:
+                    self.finished[stream.name] = stream.stats
+                if retired:
+                    self.streams = [s for s in self.streams if s not in retired]
+                if not submitted:
+                    self._cond.wait(0.5)
+
+    def _process(self, stream, item):
+        # Runs on the pool, where an exception would only be stored on a
+        # future nobody reads: a failed frame is counted instead, and the
+        # stream's first failure logged
+        seq, frame, captured = item
+        error = None
+        try:
+            result = stream.detector.detect(frame)
+            if stream.on_result is not None:
+                stream.on_result(stream, seq, result)
+        except Exception as exc:
+            error = exc
+        with self._cond:
+            stream.busy = False
+            stream.stats.last = time.perf_counter()
+            if error is None:
+                stream.stats.processed += 1
+                stream.stats.latencies.append(stream.stats.last - captured)
+            else:
+                stream.stats.errors += 1
+                first = stream.stats.error is None
+                if first:
+                    stream.stats.error = f"{type(error).__name__}: {error}"
+            self._inflight -= 1
+            self._cond.notify_all()
+        if error is not None and first:
+            _log.error("Stream %s: frame %s failed", stream.name, seq, exc_info=error)
+
+    def active(self):
+        with self._cond:
+            return bool(self.streams)
+
+    def stats(self, finished=False):
+        with self._cond:
+            stats = {stream.name: stream.stats.snapshot() for stream in self.streams}
+            if finished:
+                stats.update((name, s.snapshot()) for name, s in self.finished.items())
+            return stats
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+        self._pool.shutdown(wait=True)
+
+
+def send_video(address, source, pace=True):
+    # Test client: streams a video to a listening server, prints the replies
+    host, port = address.rsplit(":", 1)
+    capture = open_video(source)
+    interval = 1.0 / (capture.get(cv2.CAP_PROP_FPS) or 30.0) if pace else 0.0
+    replies = []
+    with socket.create_connection((host, int(port))) as sock:
+        def receive():
+            while True:
+                payload = recv_message(sock)
+                if payload is None:
+                    break
+                replies.append(json.loads(payload))
+
+        receiver = threading.Thread(target=receive, daemon=True)
+        receiver.start()
+        sent = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            send_message(sock, cv2.imencode(".jpg", frame)[1].tobytes())
+            sent += 1
+            if interval:
+                time.sleep(interval)
+        sock.shutdown(socket.SHUT_WR)
+        receiver.join()
+    capture.release()
+    return sent, replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lane detection server for several camera streams")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="process video sources and/or socket clients")
+    serve.add_argument("sources", nargs="*", help="video files, pipes or camera indices")
+    serve.add_argument("--listen", help="accept socket streams on HOST:PORT")
+    serve.add_argument("-j", "--workers", type=int, default=None, help="shared worker threads")
+    serve.add_argument("--max-pending", type=int, default=2, help="frames a stream may queue before dropping")
+    serve.add_argument("--no-pace", action="store_true", help="read files as fast as possible without drops")
+    serve.add_argument("--track", action="store_true", help="track lanes within each stream")
+    serve.add_argument("--lanes-dir", help="write each stream's lane results to <stream>.jsonl here")
+    serve.add_argument("--stats-interval", type=float, default=5.0, help="seconds between stats reports")
+    send = sub.add_parser("send", help="stream a video to a listening server")
+    send.add_argument("address", help="HOST:PORT")
+    send.add_argument("source", help="video file or camera index")
+    send.add_argument("--no-pace", action="store_true", help="send frames as fast as possible")
+    args = parser.parse_args()
+
+    if args.command == "send":
+        sent, replies = send_video(args.address, args.source, not args.no_pace)
+        print(f"Sent {sent} frames, received {len(replies)} results")
+        return
+
+    server = LaneServer(args.workers, lambda: LaneDetector(tracker=LaneTracker() if args.track else None))
+    server.start()
+
+    on_result = None
+    files = {}
+    if args.lanes_dir:
+        os.makedirs(args.lanes_dir, exist_ok=True)
+        files_lock = threading.Lock()
+
+        def on_result(stream, seq, result):
+            with files_lock:
+                if stream.name not in files:
+                    safe = stream.name.replace(os.sep, "_").replace(":", "_")
+                    files[stream.name] = open(os.path.join(args.lanes_dir, f"{safe}.jsonl"), "w")
+                files[stream.name].write(json.dumps({"seq": seq, **result.as_dict()}) + "\n")
+
+    for index, source in enumerate(args.sources):
+        server.add_capture(f"{index}:{source}", source, pace=not args.no_pace, max_pending=args.max_pending,
+                           drop=not args.no_pace, on_result=on_result)
+    if args.listen:
+        host, port = args.listen.rsplit(":", 1)
+        address = server.listen(host, int(port), max_pending=args.max_pending)
+        print(f"Listening on {address[0]}:{address[1]}")
+
+    try:
+        last_report = time.perf_counter()
+        while args.listen or server.active():
+            time.sleep(0.2)
+            if time.perf_counter() - last_report >= args.stats_interval:
+                last_report = time.perf_counter()
+                stats = server.stats()
+                if stats:
+                    print(json.dumps(stats))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        for f in files.values():
+            f.close()
+    print(json.dumps(server.stats(finished=True), indent=2))
+
+
+if __name__ == "__main__":
+    main()
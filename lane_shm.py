@@ -0,0 +1,212 @@
+import multiprocessing
+import os
+import queue
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from Road_Lane_Detection import LaneDetector, LaneLine, LaneResult, working_size
+
+# Lane results travel as a fixed float64 record per slot:
+# [width, height] + per side [valid, slope, intercept, x1, y1, x2, y2, segments, confidence]
+_SIDE_FIELDS = 9
+RESULT_FIELDS = 2 + 2 * _SIDE_FIELDS
+
+
+def pack_result(result, record):
+    record[0], record[1] = result.width, result.height
+    for side, line in enumerate((result.left, result.right)):
+        fields = record[2 + side * _SIDE_FIELDS:2 + (side + 1) * _SIDE_FIELDS]
+        if line is None:
+            fields[0] = 0
+            continue
+        (x1, y1), (x2, y2) = line.endpoints
+        fields[:] = (1, line.slope, line.intercept, x1, y1, x2, y2, line.segments, line.confidence)
+    return record
+
+
+def unpack_result(record):
+    sides = []
+    for side in range(2):
+        fields = record[2 + side * _SIDE_FIELDS:2 + (side + 1) * _SIDE_FIELDS]
+        if not fields[0]:
+            sides.append(None)
+            continue
+        _, slope, intercept, x1, y1, x2, y2, segments, confidence = fields.tolist()
+        sides.append(LaneLine(slope, intercept, ((int(x1), int(y1)), (int(x2), int(y2))),
+                              int(segments), confidence))
+    return LaneResult(sides[0], sides[1], int(record[0]), int(record[1]))
+
+
+class FrameRing:
+    # Fixed number of slots in one shared memory block. Every slot holds an
+    # input frame, an output frame (the annotated image) and a lane record,
+    # all exposed as NumPy views so processes read and write them in place.
+    def __init__(self, slots, shape, out_shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.out_shape = tuple(out_shape)
+        in_bytes = int(np.prod(self.shape))
+        out_bytes = int(np.prod(self.out_shape))
+        self._slot_bytes = in_bytes + out_bytes + RESULT_FIELDS * 8
+        # Keep the float64 record 8-byte aligned
+        self._slot_bytes += -self._slot_bytes % 8
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * self._slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.inputs, self.outputs, self.records = [], [], []
+        for slot in range(slots):
+            offset = slot * self._slot_bytes
+            self.inputs.append(np.ndarray(self.shape, np.uint8, self.shm.buf, offset))
+            offset += in_bytes
+            self.outputs.append(np.ndarray(self.out_shape, np.uint8, self.shm.buf, offset))
+            offset += out_bytes + (-(offset + out_bytes) % 8)
+            self.records.append(np.ndarray((RESULT_FIELDS,), np.float64, self.shm.buf, offset))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # Views must go before the buffer can be released
+        self.inputs = self.outputs = self.records = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _ring_worker(name, slots, shape, out_shape, ready, done, render, options):
+    cv2.setNumThreads(1)
+    ring = FrameRing(slots, shape, out_shape, name=name)
+    detector = LaneDetector(**options)
+    try:
+        while True:
+            task = ready.get()
+            if task is None:
+                break
+            slot, seq = task
+            try:
+                image, result = detector.find_lanes(ring.inputs[slot])
+                if render:
+                    detector.draw_lanes(image, result, out=ring.outputs[slot])
+                pack_result(result, ring.records[slot])
+            except Exception as exc:
+                done.put((slot, seq, repr(exc)))
+                continue
+            finally:
+                image = None  # may be a view into the ring, which must be released before close
+            done.put((slot, seq, None))
+    finally:
+        ring.close()
+
+
+class LaneProcessPool:
+    # Lane detection in worker processes without pickling frames. Frames are
+    # written into free ring slots, workers get only (slot, seq) over a queue,
+    # annotate in place and hand the slot back. A slot is recycled once the
+    # consumer moved past its result; with every slot in use no new frame is
+    # read until one comes back (backpressure). Input frames must all have the
+    # ring's shape.
+    def __init__(self, shape, workers=None, slots=None, render=True, **options):
+        self.workers = workers or os.cpu_count() or 1
+        slots = slots or 2 * self.workers + 2
+        width, height = working_size(options.get("size", (640, 480)), shape)
+        out_shape = (height, width, 3)
+        self.render = render
+        self.ring = FrameRing(slots, shape, out_shape)
+        self.free = list(range(slots))
+        self.ready = multiprocessing.Queue()
+        self.done = multiprocessing.Queue()
+        self.processes = [
+            multiprocessing.Process(target=_ring_worker, daemon=True,
+                                    args=(self.ring.name, slots, shape, out_shape, self.ready, self.done,
+                                          render, options))
+            for _ in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+        self._finished = {}
+
+    def _collect(self, poll=1.0):
+        # Finished slots stay reserved until the consumer is done with them.
+        # Workers only exit on close(), so one that is gone while frames are
+        # in flight died hard (killed, segfault) and its frame never comes back
+        while True:
+            try:
+                slot, seq, error = self.done.get(timeout=poll)
+                break
+            except queue.Empty:
+                dead = [process for process in self.processes if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Lane worker {dead[0].pid} exited with code {dead[0].exitcode}")
+        if error is not None:
+            raise RuntimeError(f"Lane worker failed on frame {seq}: {error}")
+        self._finished[seq] = slot
+
+    def _run(self, fill):
+        # fill(input_view) writes the next frame into a free slot, False at the end
+        submitted = 0
+        next_seq = 0
+        held = None
+        exhausted = False
+        while True:
+            if held is not None:
+                self.free.append(held)
+                held = None
+            while self.free and not exhausted:
+                slot = self.free.pop()
+                if not fill(self.ring.inputs[slot]):
+                    self.free.append(slot)
+                    exhausted = True
+                    break
+                self.ready.put((slot, submitted))
+                submitted += 1
+            if next_seq == submitted:
+                return
+            while next_seq not in self._finished:
+                self._collect()
+            held = self._finished.pop(next_seq)
+            output = self.ring.outputs[held] if self.render else None
+            yield next_seq, output, unpack_result(self.ring.records[held])
+            next_seq += 1
+
+    def imap(self, frames):
+        # Yields (seq, annotated view or None, LaneResult) in input order. The
+        # view lives in shared memory and is only valid until the next item.
+        frames = iter(frames)
+
+        def fill(view):
+            frame = next(frames, None)
+            if frame is None:
+                return False
+            np.copyto(view, frame)
+            return True
+        return self._run(fill)
+
+    def imap_capture(self, capture):
+        # Like imap, but a cv2.VideoCapture decodes straight into the ring.
+        # A frame of another shape makes read() allocate a new array instead,
+        # which would leave the workers with the slot's stale contents
+        def fill(view):
+            ok, frame = capture.read(view)
+            if ok and frame is not view:
+                raise ValueError(f"Capture frame shape {frame.shape} does not match the ring's {view.shape}")
+            return ok
+        return self._run(fill)
+
+    def close(self):
+        for _ in self.processes:
+            self.ready.put(None)
+        for process in self.processes:
+            process.join()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
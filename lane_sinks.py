@@ -0,0 +1,184 @@
+import collections
+import os
+import threading
+
+import cv2
+
+# Marks the end of a sink's frames
+_END = object()
+
+
+class FrameSink:
+    # Consumes annotated frames on a background thread so detection never
+    # waits for encoding, disk or the screen. With drop=True a full queue
+    # loses its oldest frame and put() returns at once; with drop=False put()
+    # waits for room, which keeps recordings complete at the cost of slowing
+    # the producer to the sink. A failure in the sink thread is raised by the
+    # next put() or by close().
+    def __init__(self, queue_size=1, drop=True):
+        self.queue_size = queue_size
+        self.drop = drop
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, frame, index=None):
+        # frame must not be modified by the caller afterwards (pass a copy of reused buffers)
+        with self._cond:
+            if self.error is not None:
+                raise self.error
+            if self._closed:
+                raise ValueError("Sink is closed")
+            if index is None:
+                index = self.received
+            self.received += 1
+            while not self.drop and len(self._pending) >= self.queue_size and self.error is None:
+                self._cond.wait(0.1)
+            if len(self._pending) >= self.queue_size:
+                self._pending.popleft()
+                self.dropped += 1
+            self._pending.append((index, frame))
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            if not self._closed:
+                self._closed = True
+                self._pending.append(_END)
+                self._cond.notify_all()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _next(self):
+        with self._cond:
+            while not self._pending:
+                if not self._cond.wait(self.idle_interval):
+                    return None
+            item = self._pending.popleft()
+            self._cond.notify_all()
+            return item
+
+    def _run(self):
+        try:
+            while True:
+                item = self._next()
+                if item is None:
+                    self.idle()
+                    continue
+                if item is _END:
+                    break
+                index, frame = item
+                self.write(frame, index)
+                self.written += 1
+        except Exception as exc:
+            with self._cond:
+                self.error = exc
+                self._pending.clear()
+                self._cond.notify_all()
+        finally:
+            self.release()
+
+    # Subclass hooks, all called on the sink thread
+    idle_interval = None
+
+    def write(self, frame, index):
+        raise NotImplementedError
+
+    def idle(self):
+        pass
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DisplaySink(FrameSink):
+    # Shows the latest frame in a HighGUI window; frames arriving faster than
+    # the window can draw them are dropped. Pressing quit_key sets quit. With
+    # hold=True close() leaves the last frame up until a key is pressed.
+    # All HighGUI calls happen on the sink thread (works with the GTK and Qt
+    # backends; macOS only allows windows on the main thread).
+    idle_interval = 0.03
+
+    def __init__(self, title="Lane Detection", hold=False, quit_key="q"):
+        self.title = title
+        self.hold = hold
+        self.quit_key = ord(quit_key)
+        self.quit = threading.Event()
+        self._shown = False
+        super().__init__(queue_size=1, drop=True)
+
+    def write(self, frame, index):
+        cv2.imshow(self.title, frame)
+        self._shown = True
+        self._poll(1)
+
+    def idle(self):
+        # Keep the window responsive between frames
+        if self._shown:
+            self._poll(1)
+
+    def _poll(self, delay):
+        if cv2.waitKey(delay) & 0xFF == self.quit_key:
+            self.quit.set()
+
+    def release(self):
+        if not self._shown:
+            return
+        if self.hold and not self.quit.is_set():
+            cv2.waitKey(0)
+        cv2.destroyWindow(self.title)
+        cv2.waitKey(1)
+
+
+class VideoSink(FrameSink):
+    # cv2.VideoWriter opened with the first frame's size
+    def __init__(self, path, fps=30.0, fourcc="mp4v", queue_size=64, drop=False):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self._writer = None
+        super().__init__(queue_size, drop)
+
+    def write(self, frame, index):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                                           (width, height))
+            if not self._writer.isOpened():
+                raise IOError(f"Cannot open video writer: {self.path}")
+        self._writer.write(frame)
+
+    def release(self):
+        if self._writer is not None:
+            self._writer.release()
+
+
+class ImageSequenceSink(FrameSink):
+    # One image file per frame. pattern is formatted with the frame index
+    # (e.g. "out/{index:06d}.jpg"); a directory gets frame_000000.png, ...
+    def __init__(self, pattern, queue_size=64, drop=False):
+        if "{" not in pattern:
+            pattern = os.path.join(pattern, "frame_{index:06d}.png")
+        self.pattern = pattern
+        super().__init__(queue_size, drop)
+
+    def write(self, frame, index):
+        path = self.pattern.format(index=index)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not cv2.imwrite(path, frame):
+            raise IOError(f"Cannot write image: {path}")
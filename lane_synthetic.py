@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+
+
+def road_frame(width=1280, height=720, seed=None):
+    # Synthetic dashcam-like frame: textured asphalt, a solid white left line,
+    # a dashed yellow right line and some bright clutter inside the ROI
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(40, 110, (height, width, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (5, 5), 0)
+
+    # Sky above the horizon
+    horizon = int(height * 0.55)
+    frame[:horizon] = cv2.add(frame[:horizon], (70, 40, 20, 0))
+
+    thickness = max(2, width // 110)
+    shift = int(rng.integers(-width // 30, width // 30 + 1))
+    y_top = int(height * 0.66)
+    cv2.line(frame, (int(width * 0.18) + shift, height), (int(width * 0.44) + shift, y_top),
+             (235, 240, 245), thickness)
+
+    # Dashed yellow line, interpolated along the lane
+    bottom, top = np.array([width * 0.84 + shift, height]), np.array([width * 0.56 + shift, y_top])
+    dashes = 6
+    for i in range(dashes):
+        t0, t1 = i / dashes, (i + 0.6) / dashes
+        p0, p1 = bottom + (top - bottom) * t0, bottom + (top - bottom) * t1
+        cv2.line(frame, tuple(int(v) for v in p0), tuple(int(v) for v in p1), (30, 200, 220), thickness)
+
+    # Clutter (cracks, glare, road paint) that Hough has to ignore
+    for _ in range(int(rng.integers(0, 8))):
+        x = int(rng.integers(0, width))
+        y = int(rng.integers(int(height * 0.6), height))
+        dx, dy = int(rng.integers(-width // 14, width // 14)), int(rng.integers(0, height // 9))
+        cv2.line(frame, (x, y), (x + dx, y - dy), (220, 220, 220), 3)
+    return frame
+
+
+def road_frames(count, width=1280, height=720, seed=0):
+    return [road_frame(width, height, seed + i) for i in range(count)]
+
+
+MARKING_COLORS = {"white": (235, 240, 245), "yellow": (30, 200, 220)}
+
+# Named lane_scene() settings the accuracy benchmark runs through
+CONDITIONS = {
+    "clear": {},
+    "dim": {"brightness": 0.55},
+    "glare": {"brightness": 1.35},
+    "shadows": {"shadows": 5},
+    "curve_left": {"curve": -0.07},
+    "curve_right": {"curve": 0.07},
+    "white": {"colors": ("white", "white"), "dashed": (True, False)},
+    "yellow": {"colors": ("yellow", "yellow")},
+}
+
+
+def lane_scene(width=1280, height=720, seed=None, curve=0.0, shift=0.0, brightness=1.0, shadows=0,
+               colors=("white", "yellow"), dashed=(False, True), clutter=True):
+    # Road frame with known lane geometry. Both lanes run from the bottom
+    # towards a vanishing point; curve bends their far end sideways by that
+    # fraction of the width, shift moves the whole road. shadows darkens that
+    # many soft bands across the road, brightness scales the finished frame.
+    # Returns (frame, truth) with the lane centers at truth["rows"]:
+    # truth["left"] and truth["right"] hold their x coordinates, bottom to ROI top.
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(40, 110, (height, width, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (5, 5), 0)
+    horizon = int(height * 0.55)
+    frame[:horizon] = cv2.add(frame[:horizon], (70, 40, 20, 0))
+
+    # Lanes are drawn up to just above the ROI top so the truth covers all of it
+    y_vanish, y_end = height * 0.58, height * 0.63
+    x_vanish = width * (0.5 + shift * 0.2)
+
+    def center(x_bottom, ys):
+        straight = x_bottom + (x_vanish - x_bottom) * (height - ys) / (height - y_vanish)
+        return straight + curve * width * ((height - ys) / (height - y_end)) ** 2
+
+    ys = np.linspace(height, y_end, 120)
+    half_width = width / 140 * (ys - y_vanish) / (height - y_vanish)
+    progress = (height - ys) / (height - y_end)
+    bottoms = (width * (0.18 + shift), width * (0.84 + shift))
+    for x_bottom, color, dashes in zip(bottoms, colors, dashed):
+        xs = center(x_bottom, ys)
+        # Dashes cover 60% of each of six segments along the lane
+        visible = (progress * 6) % 1 < 0.6 if dashes else np.ones_like(ys, dtype=bool)
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], visible.astype(np.int8), [0]])))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            part = slice(start, stop)
+            outline = np.concatenate([
+                np.stack([xs[part] - half_width[part], ys[part]], axis=1),
+                np.stack([xs[part] + half_width[part], ys[part]], axis=1)[::-1],
+            ])
+            cv2.fillPoly(frame, [np.rint(outline).astype(np.int32)], MARKING_COLORS[color], cv2.LINE_AA)
+
+    if clutter:
+        for _ in range(int(rng.integers(0, 4))):
+            x = int(rng.integers(0, width))
+            y = int(rng.integers(int(height * 0.6), height))
+            dx, dy = int(rng.integers(-width // 14, width // 14)), int(rng.integers(0, height // 9))
+            cv2.line(frame, (x, y), (x + dx, y - dy), (220, 220, 220), 3)
+
+    if shadows or brightness != 1.0:
+        shade = np.full((height, width), brightness, dtype=np.float32)
+        for _ in range(shadows):
+            # Slanted band across the road, like the shadow of a pole or tree
+            y = rng.uniform(height * 0.6, height)
+            thickness = rng.uniform(height * 0.03, height * 0.1)
+            slant = rng.uniform(-0.15, 0.15) * height
+            band = np.array([(0, y), (width, y + slant), (width, y + slant + thickness), (0, y + thickness)])
+            cv2.fillPoly(shade, [np.rint(band).astype(np.int32)], brightness * rng.uniform(0.35, 0.6))
+        shade = cv2.GaussianBlur(shade, (0, 0), max(1.0, width / 400))
+        frame = cv2.convertScaleAbs(frame * shade[..., None])
+
+    rows = np.linspace(height - 1, height * 0.65, 48)
+    truth = {"rows": rows, "left": center(bottoms[0], rows), "right": center(bottoms[1], rows)}
+    return frame, truth
+
+
+def scene_sequence(count, width=1280, height=720, condition="clear", seed=0):
+    # A short clip under one condition: the road drifts and bends a little
+    # from frame to frame, so trackers and incremental searches get real use
+    settings = dict(CONDITIONS[condition])
+    base_curve = settings.pop("curve", 0.0)
+    scenes = []
+    for i in range(count):
+        shift = 0.02 * np.sin(i / 7)
+        curve = base_curve + 0.01 * np.sin(i / 5)
+        scenes.append(lane_scene(width, height, seed + i, curve=curve, shift=shift, **settings))
+    return scenes
@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from Road_Lane_Detection import PREPROCESS_MODES, LaneDetector, LaneTracker, MultiScaleLaneDetector, render_lanes
+from lane_curved import CurvedLaneDetector
+from lane_pipeline import LanePipeline, load_config
+from lane_sinks import DisplaySink, ImageSequenceSink, VideoSink
+
+# Marks the end of the frame stream between pipeline stages
+_END = object()
+
+
+def open_video(source):
+    # Camera indices are passed as plain digits ("0"), everything else is a path/URL
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        raise IOError(f"Cannot open video source: {source}")
+    return capture
+
+
+def read_frames(capture):
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def _put(q, item, stop):
+    # Bounded put that gives up once the pipeline is shutting down
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def per_thread(factory=LaneDetector, render=True, lines_only=False):
+    # Detectors keep per-frame buffers, so every worker thread gets its own.
+    # Returns (annotated frame or None when not rendering, LaneResult);
+    # process.close() closes the detectors that have one (banded detectors
+    # hold a thread pool). lines_only draws with render_lanes() on a copy of
+    # the frame, blending just the lane pixels instead of a full line image
+    # (straight-lane results only).
+    local = threading.local()
+    detectors = []
+
+    def process(frame):
+        detector = getattr(local, "detector", None)
+        if detector is None:
+            detector = local.detector = factory()
+            detectors.append(detector)
+        image, result = detector.find_lanes(frame)
+        if not render:
+            return None, result
+        if lines_only:
+            # image may be one of the detector's buffers, reused by the next frame
+            return render_lanes(image.copy(), result), result
+        return detector.draw_lanes(image, result), result
+
+    def close():
+        for detector in detectors:
+            if hasattr(detector, "close"):
+                detector.close()
+        detectors.clear()
+    process.close = close
+    return process
+
+
+def process_frames(frames, process, workers=None, queue_size=8):
+    """Run process over an iterable of frames, yielding results in input order"""
+    workers = workers or os.cpu_count() or 1
+    inputs = queue.Queue(maxsize=queue_size)
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    # Decode stage: pulls frames from the source into the bounded input queue
+    def decode():
+        try:
+            for index, frame in enumerate(frames):
+                if not _put(inputs, (index, frame), stop):
+                    return
+        except Exception as exc:
+            errors.append(exc)
+            stop.set()
+        for _ in range(workers):
+            _put(inputs, _END, stop)
+
+    # Processing stage: OpenCV releases the GIL, so frames run in parallel here
+    def work():
+        while not stop.is_set():
+            try:
+                item = inputs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END:
+                break
+            index, frame = item
+            try:
+                result = process(frame)
+            except Exception as exc:
+                errors.append(exc)
+                stop.set()
+                break
+            if not _put(results, (index, result), stop):
+                break
+        _put(results, _END, stop)
+
+    threads = [threading.Thread(target=decode, daemon=True)]
+    threads += [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    # Output stage: workers finish out of order, so hold results until their turn
+    pending = {}
+    next_index = 0
+    finished = 0
+    try:
+        while finished < workers and not errors:
+            try:
+                item = results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END:
+                finished += 1
+                continue
+            index, result = item
+            pending[index] = result
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+        if errors:
+            raise errors[0]
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def process_video(source, output=None, display=False, workers=None, queue_size=8, process=None,
+                  lanes=None, frames_dir=None, sinks=()):
+    # process maps a frame to (annotated frame or None, LaneResult); by default
+    # frames are only rendered when something consumes them. Writing and
+    # display run in FrameSinks on their own threads: the display drops frames
+    # it cannot keep up with, the file sinks buffer and only slow detection
+    # down once their queues are full.
+    sinks = list(sinks)
+    if process is None:
+        process = per_thread(render=bool(output or display or frames_dir or sinks))
+    capture = open_video(source)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    display_sink = None
+    if output:
+        sinks.append(VideoSink(output, fps))
+    if frames_dir:
+        sinks.append(ImageSequenceSink(frames_dir))
+    if display:
+        display_sink = DisplaySink()
+        sinks.append(display_sink)
+    lanes_file = open(lanes, "w") if lanes else None
+    frames = 0
+    start = time.perf_counter()
+    try:
+        for image, result in process_frames(read_frames(capture), process, workers, queue_size):
+            if lanes_file:
+                lanes_file.write(json.dumps({"frame": frames, **result.as_dict()}) + "\n")
+            for sink in sinks:
+                sink.put(image, frames)
+            frames += 1
+            if display_sink is not None and display_sink.quit.is_set():
+                break
+    finally:
+        capture.release()
+        if lanes_file:
+            lanes_file.close()
+        # Every sink gets closed (writers flushed, threads joined) even if
+        # one of them fails; the first failure is raised afterwards
+        error = None
+        for sink in sinks:
+            try:
+                sink.close()
+            except Exception as exc:
+                error = error or exc
+        if error is not None:
+            raise error
+
+    elapsed = time.perf_counter() - start
+    stats = {"frames": frames, "seconds": elapsed, "fps": frames / elapsed if elapsed else 0.0}
+    if display_sink is not None:
+        stats["display_dropped"] = display_sink.dropped
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run lane detection over a video file or camera stream")
+    parser.add_argument("source", help="video path, stream URL or camera index")
+    parser.add_argument("-o", "--output", help="write the annotated video to this file")
+    parser.add_argument("--display", action="store_true", help="show the annotated frames (press q to quit)")
+    parser.add_argument("--frames-dir", help="also write every annotated frame as an image into this directory")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="processing threads (default: CPU count)")
+    parser.add_argument("--queue-size", type=int, default=8, help="frames buffered between stages")
+    parser.add_argument("--track", action="store_true", help="track lanes across frames (single worker)")
+    parser.add_argument("--crop-roi", action="store_true", help="only process the ROI's bounding box")
+    parser.add_argument("--preprocess", choices=PREPROCESS_MODES, default=None,
+                        help="color masking path (see LaneDetector, default: bgr)")
+    parser.add_argument("--lanes", help="write per-frame lane geometry as JSON lines to this file")
+    parser.add_argument("--detect-width", type=int, default=None,
+                        help="detect at this width (aspect ratio kept) and report lanes at native resolution")
+    parser.add_argument("--no-refine", action="store_true",
+                        help="with --detect-width, skip the native-resolution refinement (faster, coarser)")
+    parser.add_argument("--band", type=int, default=None, help="refinement band half width in native pixels")
+    parser.add_argument("--native", action="store_true", help="detect at the source resolution instead of 640x480")
+    parser.add_argument("--bands", type=int, default=1,
+                        help="split each frame's pixel stages into this many bands on threads (for --native)")
+    parser.add_argument("--tile-clahe", action="store_true",
+                        help="with --bands, also split CLAHE (faster on many cores, L may differ by one level)")
+    parser.add_argument("--config", help="pipeline config file (JSON/YAML) instead of the detector options")
+    parser.add_argument("--curved", action="store_true",
+                        help="fit curved lanes in a bird's-eye view (single worker, searches around the last fit)")
+    parser.add_argument("--lines-only", action="store_true",
+                        help="draw only the lane pixels instead of blending a full line image (not with --curved)")
+    args = parser.parse_args()
+    if args.lines_only and args.curved:
+        parser.error("--lines-only draws straight lanes and cannot be used with --curved")
+
+    # Detector options that were given, rejected where the chosen detector would ignore them
+    given = {"--track": args.track, "--crop-roi": args.crop_roi, "--preprocess": args.preprocess is not None,
+             "--detect-width": args.detect_width is not None, "--no-refine": args.no_refine,
+             "--band": args.band is not None, "--native": args.native, "--bands": args.bands != 1,
+             "--tile-clahe": args.tile_clahe, "--curved": args.curved}
+
+    def reject(option, ignored):
+        used = [name for name in ignored if given[name]]
+        if used:
+            parser.error(f"{option} cannot be combined with {', '.join(used)}")
+
+    if args.config:
+        reject("--config", given)
+    if args.curved:
+        reject("--curved", [name for name in given if name != "--curved"])
+    if args.detect_width is not None:
+        reject("--detect-width", ["--native", "--bands", "--tile-clahe"])
+    elif args.no_refine or args.band is not None:
+        parser.error("--no-refine and --band only apply with --detect-width")
+    if args.tile_clahe and args.bands == 1:
+        parser.error("--tile-clahe only applies with --bands")
+
+    # The config is parsed once; the first worker gets this pipeline, any
+    # other worker its own copy (pipelines are not thread safe)
+    config = load_config(args.config) if args.config else None
+    pipelines = [LanePipeline.from_config(config)] if args.config else []
+    tracked_config = bool(pipelines) and pipelines[0].tracker is not None
+    if args.track or args.curved or tracked_config:
+        # Tracking needs frames in order; decode and encode still overlap with detection
+        args.workers = 1
+
+    def make_detector():
+        if args.config:
+            try:
+                return pipelines.pop()
+            except IndexError:
+                return LanePipeline.from_config(config)
+        if args.curved:
+            return CurvedLaneDetector()
+        options = {"tracker": LaneTracker() if args.track else None, "crop_roi": args.crop_roi,
+                   "preprocess": args.preprocess or "bgr"}
+        if args.detect_width:
+            return MultiScaleLaneDetector(args.detect_width, refine=not args.no_refine, band=args.band, **options)
+        return LaneDetector(size=None if args.native else (640, 480), bands=args.bands, tile_clahe=args.tile_clahe,
+                            **options)
+
+    process = per_thread(make_detector, render=bool(args.output or args.display or args.frames_dir),
+                         lines_only=args.lines_only)
+    try:
+        stats = process_video(args.source, args.output, args.display, args.workers, args.queue_size, process,
+                              args.lanes, args.frames_dir)
+    finally:
+        process.close()
+    print(f"Processed {stats['frames']} frames in {stats['seconds']:.2f}s ({stats['fps']:.1f} fps)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,583 +1,289 @@
-import time
-import random
+import argparse
+import asyncio
+import sys
+import types
+
+from chat_agents import AgentRouter, default_agents, format_wait
+from chat_dialogue import DialogueSession, Transfer, compile_dialogue
+from chat_intents import build_intents, load_knowledge_base
+from chat_store import ChatStore
+
+# Compiled dialogues shared between sessions, see CustomerSupportChatbot._shared_dialogue
+_DIALOGUES = {}
+
+
+def _frozen(table):
+    """Read-only view of a table and the tables inside it"""
+    return types.MappingProxyType({key: _frozen(value) if isinstance(value, dict) else value
+                                   for key, value in table.items()})
+
+
+class ConsoleChannel:
+    """Terminal I/O for a single local session"""
+
+    closed = False
+
+    def write(self, text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    async def read_line(self, prompt):
+        """Read a line in a thread so the event loop keeps running"""
+        return await asyncio.to_thread(input, prompt)
+
 
 class CustomerSupportChatbot:
-    def __init__(self):
-        self.user_name = ""
-        self.conversation_history = []
-        self.services = {
-            "1": "Check account status",
-            "2": "Billing inquiries",
-            "3": "Technical support",
-            "4": "Product information",
-            "5": "File a complaint",
-            "6": "Speak to a human agent"
-        }
-        
-        # Sub-options for each service
-        self.service_options = {
-            "1": {  # Account status options
-                "1": "View account balance",
-                "2": "Update account information",
-                "3": "Check subscription status",
-                "4": "Return to main menu"
-            },
-            "2": {  # Billing inquiries options
-                "1": "View recent transactions",
-                "2": "Dispute a charge",
-                "3": "Update payment method",
-                "4": "Payment plans",
-                "5": "Return to main menu"
-            },
-            "3": {  # Technical support options
-                "1": "Login issues",
-                "2": "App/Website not working",
-                "3": "Installation help",
-                "4": "Error messages",
-                "5": "Return to main menu"
-            },
-            "4": {  # Product information options
-                "1": "Features overview",
-                "2": "Pricing information",
-                "3": "Compatibility questions",
-                "4": "Return to main menu"
-            },
-            "5": {  # Complaint options
-                "1": "Service quality issue",
-                "2": "Product defect",
-                "3": "Staff behavior",
-                "4": "Return to main menu"
-            }
-        }
-        
-        # Knowledge base for common technical issues
-        self.tech_solutions = {
-            "login": "Try clearing your browser cookies and cache, then restart your browser. If the issue persists, try resetting your password through the 'Forgot Password' link.",
-            "app": "Please try the following steps:\n1. Ensure your app is updated to the latest version\n2. Restart the app\n3. Restart your device\n4. Check your internet connection",
-            "installation": "For installation issues, please make sure your system meets the minimum requirements. You can find these in the documentation at docs.example.com/requirements.",
-            "error": "Please take a screenshot of the error message and send it to support@example.com along with details about what you were doing when the error occurred."
-        }
+    # One conversation. The menu and answer tables are class attributes,
+    # read-only and shared by every session, and so is the compiled dialogue:
+    # an instance holds its channel, settings and DialogueSession.
+    __slots__ = ("channel", "typing_delay", "store", "router", "dialogue", "session")
 
-    def start(self):
-        """Start the chatbot conversation"""
-        self.display_welcome_message()
-        self.get_user_name()
-        
-        while True:
-            user_choice = self.display_main_options()
-            
-            if user_choice == "7":
-                self.end_conversation()
-                break
-            
-            if user_choice in self.services:
-                self.handle_service(user_choice)
-            else:
-                print("I'm sorry, that's not a valid option. Please try again.")
-
-    def display_welcome_message(self):
-        """Display the welcome message"""
-        print("\n" + "=" * 50)
-        print("Welcome to our Customer Support Chatbot!")
-        print("I'm here to help you with any questions or issues you might have.")
-        print("=" * 50)
-
-    def get_user_name(self):
-        """Get the user's name for personalized interaction"""
-        print("Before we begin, may I know your name?")
-        self.user_name = input("Your name: ")
-        print(f"\nNice to meet you, {self.user_name}! How can I assist you today?")
-    
-    def display_main_options(self):
-        """Display the main service options"""
-        print("\nPlease select from the following options:")
-        for key, service in self.services.items():
-            print(f"{key}: {service}")
-        print("7: End conversation")
-        
-        return input("\nEnter your choice (1-7): ")
-    
-    def handle_service(self, service_choice):
-        """Handle the selected service"""
-        selected_service = self.services[service_choice]
-        self.conversation_history.append(f"User selected: {selected_service}")
-        
-        print(f"\nYou've selected: {selected_service}")
-        
-        # If user wants to speak to a human agent
-        if service_choice == "6":
-            self.transfer_to_agent()
-            return
-            
-        # Display sub-options for the selected service
-        while True:
-            print("\nWhat specifically do you need help with?")
-            
-            # Display options for the selected service
-            for key, option in self.service_options[service_choice].items():
-                print(f"{key}: {option}")
-                
-            sub_choice = input("\nEnter your choice: ")
-            
-            # Return to main menu
-            if sub_choice == "4" or sub_choice == "5":  # Some menus have 4, some have 5 options
-                print("Returning to main menu...")
-                break
-                
-            # Handle the specific sub-option
-            if sub_choice in self.service_options[service_choice]:
-                self.handle_specific_issue(service_choice, sub_choice)
-            else:
-                print("I'm sorry, that's not a valid option. Please try again.")
+    # Seconds between queue position updates while waiting for an agent
+    queue_update_interval = 30
+
+    services = _frozen({
+        "1": "Check account status",
+        "2": "Billing inquiries",
+        "3": "Technical support",
+        "4": "Product information",
+        "5": "File a complaint",
+        "6": "Speak to a human agent"
+    })
     
-    def handle_specific_issue(self, service_choice, sub_choice):
-        """Handle specific issues based on user's selection"""
-        selected_option = self.service_options[service_choice][sub_choice]
-        self.conversation_history.append(f"User selected: {selected_option}")
-        
-        print(f"\nYou've selected: {selected_option}")
-        
-        # Simulate processing time
-        print("Processing your request...")
-        self.simulate_typing()
-        
-        # Handle each service category differently
-        if service_choice == "1":  # Account status
-            self.handle_account_issue(sub_choice)
-        elif service_choice == "2":  # Billing
-            self.handle_billing_issue(sub_choice)
-        elif service_choice == "3":  # Technical support
-            self.handle_technical_issue(sub_choice)
-        elif service_choice == "4":  # Product information
-            self.handle_product_info(sub_choice)
-        elif service_choice == "5":  # Complaints
-            self.handle_complaint(sub_choice)
-            
-        # Ask if there's anything else the user needs help with
-        print("\nIs there anything else you need help with regarding this issue?")
-        print("1: Yes, I need more assistance")
-        print("2: No, I'm good for now")
-        
-        follow_up = input("\nEnter your choice (1-2): ")
-        
-        if follow_up == "1":
-            print("Let me help you further...")
-        else:
-            print("Great! Let's return to the previous menu.")
+    # Sub-options for each service
+    service_options = _frozen({
+        "1": {  # Account status options
+            "1": "View account balance",
+            "2": "Update account information",
+            "3": "Check subscription status",
+            "4": "Return to main menu"
+        },
+        "2": {  # Billing inquiries options
+            "1": "View recent transactions",
+            "2": "Dispute a charge",
+            "3": "Update payment method",
+            "4": "Payment plans",
+            "5": "Return to main menu"
+        },
+        "3": {  # Technical support options
+            "1": "Login issues",
+            "2": "App/Website not working",
+            "3": "Installation help",
+            "4": "Error messages",
+            "5": "Return to main menu"
+        },
+        "4": {  # Product information options
+            "1": "Features overview",
+            "2": "Pricing information",
+            "3": "Compatibility questions",
+            "4": "Return to main menu"
+        },
+        "5": {  # Complaint options
+            "1": "Service quality issue",
+            "2": "Product defect",
+            "3": "Staff behavior",
+            "4": "Return to main menu"
+        }
+    })
     
-    def handle_account_issue(self, sub_choice):
-        """Handle account-related issues"""
-        if sub_choice == "1":  # View account balance
-            balance = random.randint(100, 1000)
-            print(f"\nYour current account balance is ${balance}.00")
-            print("Would you like to make a payment?")
-            print("1: Yes, make a payment")
-            print("2: No, just checking")
-            
-            payment_choice = input("\nEnter your choice (1-2): ")
-            
-            if payment_choice == "1":
-                print("Redirecting you to our secure payment portal...")
-                self.simulate_typing()
-                print("You would now be redirected to make a payment in our actual system.")
-            else:
-                print("No problem! Your account is in good standing.")
-                
-        elif sub_choice == "2":  # Update account information
-            print("\nWhat information would you like to update?")
-            print("1: Contact information")
-            print("2: Mailing address")
-            print("3: Email preferences")
-            print("4: Security settings")
-            
-            update_choice = input("\nEnter your choice (1-4): ")
-            
-            print("In a real system, you would now be guided through updating your selected information.")
-            self.simulate_typing()
-            print("Information updated successfully!")
-            
-        elif sub_choice == "3":  # Check subscription status
-            subscription_status = random.choice(["Active", "Expiring soon", "Renewal needed"])
-            print(f"\nYour subscription status is: {subscription_status}")
-            
-            if subscription_status != "Active":
-                print("Would you like to renew your subscription?")
-                print("1: Yes, renew now")
-                print("2: No, maybe later")
-                
-                renew_choice = input("\nEnter your choice (1-2): ")
-                
-                if renew_choice == "1":
-                    print("Processing your renewal...")
-                    self.simulate_typing()
-                    print("Subscription renewed successfully!")
+    # Knowledge base for common technical issues
+    tech_solutions = _frozen({
+        "login": "Try clearing your browser cookies and cache, then restart your browser. If the issue persists, try resetting your password through the 'Forgot Password' link.",
+        "app": "Please try the following steps:\n1. Ensure your app is updated to the latest version\n2. Restart the app\n3. Restart your device\n4. Check your internet connection",
+        "installation": "For installation issues, please make sure your system meets the minimum requirements. You can find these in the documentation at docs.example.com/requirements.",
+        "error": "Please take a screenshot of the error message and send it to support@example.com along with details about what you were doing when the error occurred."
+    })
+
+    # Detail pages of the product information menus
+    feature_details = _frozen({
+        "1": "Our cloud sync technology ensures your data is always up-to-date across all your devices, with changes reflected in real-time.",
+        "2": "We use industry-standard encryption and offer multiple two-factor authentication options including SMS, authenticator apps, and hardware keys.",
+        "3": "Multiple users can edit the same document simultaneously, with changes visible instantly and conflict resolution built-in.",
+        "4": "We automatically create backups every 15 minutes and maintain a 30-day version history for all your files.",
+        "5": "Our AI analyzes your usage patterns to provide helpful suggestions and insights, helping you work more efficiently."
+    })
+    compatibility_info = _frozen({
+        "1": "Windows: Compatible with Windows 10 and 11. Requires 4GB RAM and 500MB disk space.",
+        "2": "Mac: Compatible with macOS 10.14 (Mojave) and newer. Requires 4GB RAM and 500MB disk space.",
+        "3": "iOS: Compatible with iOS 13 and newer. Optimized for both iPhone and iPad.",
+        "4": "Android: Compatible with Android 8.0 and newer. Tablet support available.",
+        "5": "Web: Compatible with Chrome, Firefox, Safari, and Edge (latest versions).",
+        "6": "For other systems, please specify and we'll check compatibility for you."
+    })
+
+    # Extra words people use for the menu entries, for free-text matching
+    intent_phrases = _frozen({
+        "service_1": "my account profile balance subscription",
+        "service_2": "bill billing charged charge payment invoice refund money",
+        "service_3": "tech technical problem broken bug not working",
+        "service_4": "product features pricing price plans cost",
+        "service_5": "complaint complain unhappy bad service",
+        "service_6": "human agent person representative real someone talk speak",
+        "end": "bye goodbye quit exit done finished thanks",
+        "option_1_1": "how much do i owe balance",
+        "option_1_2": "change update my email phone address details",
+        "option_1_3": "renew renewal subscription expire expiring",
+        "option_2_1": "transactions history statement recent payments",
+        "option_2_2": "wrong charge overcharged dispute unauthorized",
+        "option_2_3": "card credit debit bank change payment method",
+        "option_2_4": "installments monthly quarterly annual plan",
+        "option_3_1": "log in login sign in password locked out account access",
+        "option_3_2": "app website site crash crashing down slow loading blank",
+        "option_3_3": "install installing setup download",
+        "option_3_4": "error code message exception",
+        "option_4_1": "features what can it do",
+        "option_4_2": "price pricing cost how much plans",
+        "option_4_3": "compatible compatibility windows mac ios android browser",
+        "option_5_1": "poor service quality slow outage",
+        "option_5_2": "defect defective broken faulty damaged product repair replacement",
+        "option_5_3": "rude staff employee behavior",
+    })
+
+    def __init__(self, channel=None, typing_delay=0.5, intents=None, store=None, router=None):
+        # channel carries the text: anything with write(text) and an async
+        # read_line(prompt) that raises EOFError once the user is gone (and
+        # a closed flag, checked while waiting for an agent).
+        # intents matches free text typed at the menus; by default it is built
+        # once from the tables above (servers build one with build_intents(),
+        # e.g. with more articles, and share it between sessions). store (a chat_store.ChatStore) keeps
+        # the history, tickets and session snapshots. router (a
+        # chat_agents.AgentRouter) hands sessions to human agents; servers
+        # share one, by default the bot has its own pool of simulated agents.
+        self.channel = channel or ConsoleChannel()
+        self.typing_delay = typing_delay
+        self.store = store
+        self.router = router or AgentRouter(default_agents(), handle_time=300)
+        # The whole conversation as a state machine over these tables
+        self.dialogue = self._shared_dialogue(intents, store)
+        self.session = DialogueSession()
+
+    def _shared_dialogue(self, intents, store):
+        # One compiled dialogue (and default intent index) per class, intents and store
+        key = (type(self), intents, store)
+        dialogue = _DIALOGUES.get(key)
+        if dialogue is None:
+            dialogue = compile_dialogue(self.services, self.service_options, self.tech_solutions,
+                                        self.feature_details, self.compatibility_info,
+                                        self.build_intents() if intents is None else intents, store)
+            if len(_DIALOGUES) >= 32:
+                del _DIALOGUES[next(iter(_DIALOGUES))]
+            _DIALOGUES[key] = dialogue
+        return dialogue
+
+    @classmethod
+    def build_intents(cls, articles=None):
+        """Free-text index over the menus, tech_solutions and any extra articles"""
+        return build_intents(cls.services, cls.service_options, cls.intent_phrases,
+                             {**cls.knowledge_base(), **(articles or {})})
+
+    @classmethod
+    def knowledge_base(cls):
+        """tech_solutions as knowledge base articles, see chat_intents.load_knowledge_base"""
+        return {key: {"title": f"{key.title()} help", "answer": answer}
+                for key, answer in cls.tech_solutions.items()}
+
+    @property
+    def user_name(self):
+        return self.session.variables.get("user_name", "")
+
+    @property
+    def conversation_history(self):
+        return self.dialogue.history(self.session)
+
+    def begin(self):
+        """Start a new conversation; returns the bot's first output"""
+        self.session = DialogueSession()
+        if self.store is not None:
+            self.store.save_session(self.session)
+        return self.dialogue.begin(self.session)
+
+    def step(self, message):
+        """Handle one user message; returns text chunks and Pause items up to the next prompt"""
+        output = self.dialogue.step(self.session, message)
+        if self.session.finished and self.store is not None:
+            self.store.save_session(self.session)
+        return output
+
+    def close(self):
+        """Store where an unfinished conversation stopped, so it can be resumed"""
+        if self.store is not None and self.session.state is not None and not self.session.finished:
+            self.store.save_session(self.session)
+
+    def save(self):
+        """The session as a JSON-compatible dict"""
+        return self.session.to_dict()
+
+    def resume(self, data):
+        """Continue a conversation saved with save()"""
+        self.session = DialogueSession.from_dict(data)
+
+    async def send(self, output):
+        """Write step output to the channel, sleeping for the typing pauses and waiting for agents"""
+        # One write per stretch of text between pauses (a socket send each)
+        text = []
+        for item in output:
+            if isinstance(item, str):
+                text.append(item)
+            elif isinstance(item, Transfer) or self.typing_delay:
+                if text:
+                    self.channel.write("".join(text))
+                    text = []
+                if isinstance(item, Transfer):
+                    await self.transfer(item)
                 else:
-                    print("No problem! We'll remind you again before it expires.")
-            else:
-                print("Your subscription is active and will renew automatically.")
-    
-    def handle_billing_issue(self, sub_choice):
-        """Handle billing-related issues"""
-        if sub_choice == "1":  # View recent transactions
-            print("\nHere are your most recent transactions:")
-            transactions = [
-                {"date": "2025-03-01", "amount": "$45.99", "description": "Monthly subscription"},
-                {"date": "2025-02-15", "amount": "$10.00", "description": "Add-on service"},
-                {"date": "2025-02-01", "amount": "$45.99", "description": "Monthly subscription"}
-            ]
-            
-            for t in transactions:
-                print(f"{t['date']} - {t['amount']} - {t['description']}")
-                
-        elif sub_choice == "2":  # Dispute a charge
-            print("\nWhich charge would you like to dispute?")
-            print("1: March 1, 2025 - $45.99 - Monthly subscription")
-            print("2: February 15, 2025 - $10.00 - Add-on service")
-            print("3: February 1, 2025 - $45.99 - Monthly subscription")
-            
-            dispute_choice = input("\nEnter your choice (1-3): ")
-            
-            print("\nPlease tell us why you're disputing this charge:")
-            print("1: Unauthorized charge")
-            print("2: Incorrect amount")
-            print("3: Service not received")
-            print("4: Other reason")
-            
-            reason_choice = input("\nEnter your choice (1-4): ")
-            
-            print("\nThank you for providing this information. Your dispute has been filed.")
-            print("Dispute reference number: #" + str(random.randint(10000, 99999)))
-            print("A billing specialist will review this and contact you within 48 hours.")
-            
-        elif sub_choice == "3":  # Update payment method
-            print("\nSelect the payment method you'd like to use:")
-            print("1: Add new credit/debit card")
-            print("2: Use existing payment method")
-            print("3: Set up automatic bank transfer")
-            
-            payment_choice = input("\nEnter your choice (1-3): ")
-            
-            print("In a real system, you would now be guided through updating your payment method.")
-            self.simulate_typing()
-            print("Payment method updated successfully!")
-            
-        elif sub_choice == "4":  # Payment plans
-            print("\nWe offer the following payment plans:")
-            print("1: Monthly ($45.99/month)")
-            print("2: Quarterly ($129.99/quarter - Save 5%)")
-            print("3: Annual ($499.99/year - Save 10%)")
-            
-            plan_choice = input("\nEnter your choice (1-3): ")
-            
-            print("Would you like to switch to this payment plan?")
-            print("1: Yes, switch now")
-            print("2: No, just checking")
-            
-            switch_choice = input("\nEnter your choice (1-2): ")
-            
-            if switch_choice == "1":
-                print("Processing your request...")
-                self.simulate_typing()
-                print("Payment plan updated successfully!")
-            else:
-                print("No problem! Your current payment plan remains unchanged.")
-    
-    def handle_technical_issue(self, sub_choice):
-        """Handle technical support issues"""
-        if sub_choice == "1":  # Login issues
-            print(self.tech_solutions["login"])
-            print("\nDid this solution help resolve your issue?")
-            print("1: Yes, it's resolved")
-            print("2: No, I still need help")
-            
-            resolved = input("\nEnter your choice (1-2): ")
-            
-            if resolved == "2":
-                print("\nLet me connect you with our technical team for more specialized assistance.")
-                print("Please provide additional details about your login issue:")
-                issue_details = input("\nYour issue details: ")
-                print(f"\nThank you for providing these details. A support ticket (#{random.randint(100000, 999999)}) has been created.")
-                print("Our technical team will contact you within 24 hours.")
-                
-        elif sub_choice == "2":  # App/Website not working
-            print(self.tech_solutions["app"])
-            print("\nIs there a specific feature or page that's not working?")
-            feature = input("\nPlease specify (or type 'all' if everything is affected): ")
-            
-            print(f"\nThank you for letting us know about issues with {feature}.")
-            print("Let me check if there are any known outages in our system...")
-            self.simulate_typing()
-            
-            if random.choice([True, False]):
-                print("We're currently experiencing some technical difficulties with this feature.")
-                print("Our team is working on it and it should be resolved within the next few hours.")
-            else:
-                print("There are no known outages at this time. I recommend clearing your browser cache or reinstalling the app.")
-                print("Would you like me to guide you through these steps?")
-                print("1: Yes, guide me through the steps")
-                print("2: No, I'll try on my own")
-                
-                guide_choice = input("\nEnter your choice (1-2): ")
-                
-                if guide_choice == "1":
-                    print("\nHere's how to clear your cache and cookies:")
-                    print("1. Open your browser settings")
-                    print("2. Navigate to Privacy & Security")
-                    print("3. Select 'Clear browsing data'")
-                    print("4. Check 'Cookies' and 'Cached images and files'")
-                    print("5. Click 'Clear data'")
-                
-        elif sub_choice == "3":  # Installation help
-            print(self.tech_solutions["installation"])
-            print("\nWhich platform are you trying to install on?")
-            print("1: Windows")
-            print("2: Mac")
-            print("3: iOS")
-            print("4: Android")
-            
-            platform_choice = input("\nEnter your choice (1-4): ")
-            
-            print("\nHere are the specific installation steps for your platform:")
-            self.simulate_typing()
-            
-            if platform_choice == "1":
-                print("1. Download the installer from our website")
-                print("2. Right-click the installer and select 'Run as administrator'")
-                print("3. Follow the on-screen instructions")
-                print("4. Restart your computer after installation")
-            elif platform_choice == "2":
-                print("1. Download the DMG file from our website")
-                print("2. Open the DMG file")
-                print("3. Drag the application to your Applications folder")
-                print("4. Right-click the app and select 'Open' for first-time use")
-            else:
-                print("1. Open the App Store/Google Play Store")
-                print("2. Search for our application")
-                print("3. Tap 'Install' and follow the prompts")
-                
-        elif sub_choice == "4":  # Error messages
-            print(self.tech_solutions["error"])
-            print("\nCan you provide the error code or message you're seeing?")
-            error_message = input("\nError code/message: ")
-            
-            print(f"\nI've searched our database for error '{error_message}'")
-            self.simulate_typing()
-            
-            print("This error typically occurs when there's a connection issue with our servers.")
-            print("Would you like to try some troubleshooting steps or file a detailed report?")
-            print("1: Try troubleshooting steps")
-            print("2: File a detailed report")
-            
-            error_choice = input("\nEnter your choice (1-2): ")
-            
-            if error_choice == "1":
-                print("\nPlease try the following:")
-                print("1. Check your internet connection")
-                print("2. Disable any VPN or proxy services")
-                print("3. Clear your application cache")
-                print("4. Restart the application")
-            else:
-                print("\nA support ticket has been created.")
-                print(f"Ticket number: #{random.randint(100000, 999999)}")
-                print("A technical specialist will contact you within 24 hours.")
-    
-    def handle_product_info(self, sub_choice):
-        """Handle product information requests"""
-        if sub_choice == "1":  # Features overview
-            print("\nOur product includes the following key features:")
-            print("1. Cloud synchronization across all your devices")
-            print("2. Advanced security with two-factor authentication")
-            print("3. Collaborative editing in real-time")
-            print("4. Automated backup and version history")
-            print("5. AI-powered suggestions and insights")
-            
-            print("\nWhich feature would you like to learn more about?")
-            feature_choice = input("\nEnter your choice (1-5): ")
-            
-            feature_details = {
-                "1": "Our cloud sync technology ensures your data is always up-to-date across all your devices, with changes reflected in real-time.",
-                "2": "We use industry-standard encryption and offer multiple two-factor authentication options including SMS, authenticator apps, and hardware keys.",
-                "3": "Multiple users can edit the same document simultaneously, with changes visible instantly and conflict resolution built-in.",
-                "4": "We automatically create backups every 15 minutes and maintain a 30-day version history for all your files.",
-                "5": "Our AI analyzes your usage patterns to provide helpful suggestions and insights, helping you work more efficiently."
-            }
-            
-            if feature_choice in feature_details:
-                print(f"\n{feature_details[feature_choice]}")
-            
-        elif sub_choice == "2":  # Pricing information
-            print("\nWe offer the following pricing plans:")
-            print("Basic Plan: $9.99/month - Includes core features for individual users")
-            print("Premium Plan: $19.99/month - Includes advanced features and priority support")
-            print("Business Plan: $49.99/month - Includes team collaboration and admin controls")
-            print("Enterprise: Custom pricing - Includes custom integrations and dedicated support")
-            
-            print("\nWould you like to see a detailed feature comparison?")
-            print("1: Yes, show comparison")
-            print("2: No, thanks")
-            
-            compare_choice = input("\nEnter your choice (1-2): ")
-            
-            if compare_choice == "1":
-                print("\nFeature Comparison:")
-                print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                print("Feature          | Basic | Premium | Business | Enterprise")
-                print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                print("Storage          | 10GB  | 100GB   | 1TB      | Unlimited")
-                print("Users            | 1     | 1       | Up to 10  | Unlimited")
-                print("Support          | Email | Priority| Priority  | Dedicated")
-                print("API Access       | No    | Yes     | Yes       | Custom")
-                print("Custom Branding  | No    | No      | Yes       | Yes")
-                print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-            
-        elif sub_choice == "3":  # Compatibility questions
-            print("\nWhat system or device are you checking compatibility for?")
-            print("1: Windows")
-            print("2: Mac")
-            print("3: iOS")
-            print("4: Android")
-            print("5: Web browsers")
-            print("6: Other")
-            
-            system_choice = input("\nEnter your choice (1-6): ")
-            
-            compatibility_info = {
-                "1": "Windows: Compatible with Windows 10 and 11. Requires 4GB RAM and 500MB disk space.",
-                "2": "Mac: Compatible with macOS 10.14 (Mojave) and newer. Requires 4GB RAM and 500MB disk space.",
-                "3": "iOS: Compatible with iOS 13 and newer. Optimized for both iPhone and iPad.",
-                "4": "Android: Compatible with Android 8.0 and newer. Tablet support available.",
-                "5": "Web: Compatible with Chrome, Firefox, Safari, and Edge (latest versions).",
-                "6": "For other systems, please specify and we'll check compatibility for you."
-            }
-            
-            if system_choice in compatibility_info:
-                print(f"\n{compatibility_info[system_choice]}")
-                
-            if system_choice == "6":
-                other_system = input("\nPlease specify your system: ")
-                print(f"\nI'll need to check compatibility for {other_system}. Let me create a ticket for our product team.")
-                print(f"Ticket #{random.randint(10000, 99999)} has been created. We'll email you with compatibility information within 48 hours.")
-    
-    def handle_complaint(self, sub_choice):
-        """Handle customer complaints"""
-        if sub_choice == "1":  # Service quality issue
-            print("\nI'm sorry to hear you're experiencing service quality issues.")
-            print("Please rate the severity of the issue:")
-            print("1: Minor inconvenience")
-            print("2: Moderate issue")
-            print("3: Major problem")
-            print("4: Service completely unusable")
-            
-            severity = input("\nEnter your choice (1-4): ")
-            
-            print("\nPlease provide more details about the service quality issue:")
-            details = input("Details: ")
-            
-            print("\nThank you for bringing this to our attention. Your feedback is important to us.")
-            print(f"Complaint reference #: {random.randint(100000, 999999)}")
-            
-            if severity in ["3", "4"]:
-                print("Due to the severity of this issue, a customer service manager will contact you within 24 hours.")
-            else:
-                print("We'll review your feedback and work on improving our service.")
-                
-        elif sub_choice == "2":  # Product defect
-            print("\nI'm sorry to hear about the product defect.")
-            print("Which product are you experiencing issues with?")
-            product = input("Product name: ")
-            
-            print("\nHow long have you owned this product?")
-            print("1: Less than 30 days")
-            print("2: 1-6 months")
-            print("3: 6-12 months")
-            print("4: Over 1 year")
-            
-            ownership = input("\nEnter your choice (1-4): ")
-            
-            print("\nPlease describe the defect in detail:")
-            defect_details = input("Defect details: ")
-            
-            print("\nWould you like to:")
-            print("1: Request a repair")
-            print("2: Request a replacement")
-            print("3: Request a refund")
-            
-            request_type = input("\nEnter your choice (1-3): ")
-            
-            print(f"\nThank you. Your {['repair', 'replacement', 'refund'][int(request_type) - 1]} request has been submitted.")
-            print(f"Reference #: {random.randint(100000, 999999)}")
-            print("A product specialist will contact you within 48 hours to process your request.")
-            
-        elif sub_choice == "3":  # Staff behavior
-            print("\nI'm sorry to hear you had a negative experience with our staff.")
-            print("When did this incident occur?")
-            date = input("Date (YYYY-MM-DD): ")
-            
-            print("\nIf you know, please provide the name of the staff member:")
-            staff_name = input("Staff name (or leave blank if unknown): ")
-            
-            print("\nPlease describe what happened:")
-            incident = input("Incident details: ")
-            
-            print("\nThank you for bringing this to our attention. We take these matters very seriously.")
-            print(f"Complaint reference #: {random.randint(100000, 999999)}")
-            print("Our customer relations manager will contact you within 24 hours to address this issue.")
-    
-    def transfer_to_agent(self):
-        """Transfer the user to a human agent"""
-        print("\nI understand you'd like to speak with a human agent.")
-        print("Please select the department you need assistance with:")
-        print("1: General customer service")
-        print("2: Technical support")
-        print("3: Billing department")
-        print("4: Sales team")
-        
-        department = input("\nEnter your choice (1-4): ")
-        
-        print(f"\nThank you. I'll connect you with a {['customer service', 'technical support', 'billing', 'sales'][int(department) - 1]} representative.")
-        print("Please provide a brief description of your issue:")
-        issue = input("Issue description: ")
-        
-        print("\nThank you. Please hold while I connect you with the next available agent...")
-        for _ in range(3):
-            print(".", end="", flush=True)
-            time.sleep(1)
-        
-        print("\nIn a real implementation, you would now be connected with a live agent.")
-        print("Your reference number is: #" + str(random.randint(1000, 9999)))
-        print("Estimated wait time: 5-10 minutes")
-        
-        # Return to main menu
-        input("\nPress Enter to return to the main menu...")
-    
-    def simulate_typing(self):
-        """Simulate typing/processing time"""
-        for _ in range(3):
-            print(".", end="", flush=True)
-            time.sleep(0.5)
-        print()
-    
-    def end_conversation(self):
-        """End the conversation with the user"""
-        print(f"\nThank you for chatting with us today, {self.user_name}!")
-        print("Is there anything else you'd like assistance with before you go?")
-        print("1: Yes, I have another question")
-        print("2: No, I'm all set")
-        
-        final_choice = input("\nEnter your choice (1-2): ")
-        
-        if final_choice == "1":
-            print("Great! Let's go back to the main menu.")
-            self.start()
-        else:
-            print(f"\nThank you for using our customer support service, {self.user_name}.")
-            print("Have a great day!")
-            print("=" * 50)
+                    await asyncio.sleep(item.units * self.typing_delay)
+        if text:
+            self.channel.write("".join(text))
+
+    async def transfer(self, transfer):
+        """Queue for a human agent and wait, telling the user where they stand"""
+        router = self.router
+        request = router.request(transfer.department, transfer.priority, self.session.id)
+        try:
+            if not request.future.done():
+                self.channel.write(f"Please hold while I connect you with the next available {transfer.department} "
+                                   f"agent.\nYou are number {router.position(request) + 1} in line. "
+                                   f"Estimated wait time: {format_wait(request.estimate)}\n")
+            while not request.future.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(request.future), self.queue_update_interval)
+                except asyncio.TimeoutError:
+                    if self.channel.closed:
+                        raise EOFError("client disconnected")
+                    self.channel.write(f"Still waiting: you are number {router.position(request) + 1} in line, "
+                                       f"estimated wait {format_wait(router.estimate(request))}.\n")
+        finally:
+            # Gives up the place in the queue on disconnects and shutdowns
+            router.cancel(request)
+        self.channel.write(f"You're now connected with {request.agent.name}. "
+                           f"In a real implementation, they would take over this chat.\n")
+
+    async def start(self):
+        """Run the conversation over the channel (continuing a resumed session)"""
+        if self.session.state is None:
+            await self.send(self.begin())
+        while not self.session.finished:
+            await self.send(self.step(await self.channel.read_line("")))
 
 
 def main():
-    chatbot = CustomerSupportChatbot()
-    chatbot.start()
+    parser = argparse.ArgumentParser(description="Customer support chatbot")
+    parser.add_argument("--knowledge-base", help="JSON/JSONL help articles to answer free-text questions from")
+    parser.add_argument("--store", help="SQLite file for conversation history and tickets")
+    args = parser.parse_args()
+    store = ChatStore(args.store) if args.store else None
+    intents = None
+    if args.knowledge_base:
+        intents = CustomerSupportChatbot.build_intents(load_knowledge_base(args.knowledge_base))
+    chatbot = CustomerSupportChatbot(intents=intents, store=store)
+    try:
+        asyncio.run(chatbot.start())
+    except (EOFError, KeyboardInterrupt):
+        print()
+    finally:
+        chatbot.close()
+        if store is not None:
+            store.close()
 
 
 if __name__ == "__main__":